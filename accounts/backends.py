@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import router
+
+# 缓存用户字段的键，用户保存或删除时通过信号清除
+USER_KEY = 'accounts:user-fields:{}'
+
+
+def get_user_cache():
+    # 与会话使用同一个缓存，多进程部署时所有进程都能看到清除后的结果
+    return caches[getattr(settings, 'SESSION_CACHE_ALIAS', 'default')]
+
+
+def invalidate_user(user_id):
+    get_user_cache().delete(USER_KEY.format(user_id))
+
+
+def invalidate_users(user_ids):
+    """
+    QuerySet.update()（如 User.objects.filter(...).update(is_active=False)）不会发送信号，
+    批量修改用户后需要调用这个函数，否则被禁用的用户在 AUTH_USER_CACHE_TIMEOUT 秒内仍然保持登录
+    """
+    get_user_cache().delete_many([USER_KEY.format(user_id) for user_id in user_ids])
+
+
+'''
+带缓存的认证后端
+AuthenticationMiddleware 在每个请求中都会通过 get_user 查询一次 auth_user 表，
+这里先从缓存中读取用户字段，不存在时再查询数据库并写入缓存。
+缓存中不保存密码摘要，只保存会话中同样保存的会话验证摘要（由密码和 SECRET_KEY 计算的 HMAC），
+Django 仍然会校验会话中的摘要，修改密码后其它会话同样会失效。
+从缓存中恢复的用户对象 password 字段是延迟加载的，读取时才查询数据库，save() 时也不会覆盖密码
+'''
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache = get_user_cache()
+        key = USER_KEY.format(user_id)
+        data = cache.get(key)
+        if data is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, self._dump(user), getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+        else:
+            user = self._load(data)
+        return user if self.user_can_authenticate(user) else None
+
+    @staticmethod
+    def _dump(user):
+        return {
+            'fields': {field.attname: getattr(user, field.attname)
+                       for field in user._meta.concrete_fields if field.attname != 'password'},
+            'session_hash': user.get_session_auth_hash(),
+            'fallback_hashes': list(user.get_session_auth_fallback_hash()),
+        }
+
+    @staticmethod
+    def _load(data):
+        UserModel = get_user_model()
+        names = list(data['fields'])
+        user = UserModel.from_db(router.db_for_read(UserModel), names, [data['fields'][name] for name in names])
+
+        # 会话验证使用缓存的摘要，不需要读取密码；密码已经读取（如修改密码）时按新的密码计算
+        def get_session_auth_hash():
+            if 'password' in user.__dict__:
+                return UserModel.get_session_auth_hash(user)
+            return data['session_hash']
+
+        def get_session_auth_fallback_hash():
+            if 'password' in user.__dict__:
+                return UserModel.get_session_auth_fallback_hash(user)
+            return iter(data['fallback_hashes'])
+
+        user.get_session_auth_hash = get_session_auth_hash
+        user.get_session_auth_fallback_hash = get_session_auth_fallback_hash
+        return user
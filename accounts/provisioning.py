@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+
+from utils.passwords import hash_passwords, make_initial_password
+
+
+def default_password(username):
+    """
+    初始密码为用户名（学号或手机号）的后6位
+    """
+    return username[-6:]
+
+
+def provision_user(username):
+    """
+    获取或创建单个账号，已经存在时直接返回
+    """
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        user = User.objects.create(username=username, password=make_initial_password(default_password(username)))
+    return user
+
+
+def provision_users(usernames, batch_size=500):
+    """
+    批量获取或创建账号，返回 {username: user_id}
+    不存在的账号先并行加密初始密码，再通过 bulk_create 一次性写入
+    """
+    usernames = list(usernames)
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    missing = [username for username in usernames if username not in existing]
+    passwords = hash_passwords(default_password(username) for username in missing)
+    User.objects.bulk_create([
+        User(username=username, password=password)
+        for username, password in zip(missing, passwords)
+    ], batch_size=batch_size)
+    # MySQL 下 bulk_create 不会回填主键，所以重新查询一次用户 id
+    return dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
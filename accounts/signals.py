@@ -0,0 +1,16 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .backends import invalidate_user
+
+
+# 用户保存（修改密码、登录时间、禁用账号等）或删除后清除缓存的用户对象，
+# 事务提交后再清除一次，避免其它请求在提交前把旧的用户对象重新写入缓存
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    user_id = instance.pk
+    invalidate_user(user_id)
+    transaction.on_commit(lambda: invalidate_user(user_id))
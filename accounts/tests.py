@@ -1,3 +1,215 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, identify_hasher
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from students.models import Student
+from utils.passwords import PARALLEL_THRESHOLD, hash_passwords
+from .backends import USER_KEY, CachedModelBackend, invalidate_users
+from .provisioning import provision_users
+
+LOCMEM = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
 
 # Create your tests here.
+@override_settings(CACHES={'default': LOCMEM, 'sessions': {**LOCMEM, 'LOCATION': 'sessions'}})
+class SessionQueryTests(TestCase):
+    """
+    会话中保存角色和显示名称，会话和登录用户从缓存中读取，已登录的请求不再查询 django_session 和 auth_user 表
+    """
+    def setUp(self):
+        grade_cache.invalidate()
+        caches['sessions'].clear()
+        User.objects.create_superuser('admin', password='admin')
+
+    def login(self):
+        response = self.client.post(reverse('user_login'), {'username': 'admin', 'password': 'admin', 'role': 'admin'})
+        self.assertEqual(response.json()['status'], 'success')
+
+    def count_queries(self):
+        # 第一次请求让班级目录、分页总数等缓存生效
+        self.client.get(reverse('student_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('student_list'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_cached_sessions_skip_session_and_user_queries(self):
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db',
+                           AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend']):
+            self.login()
+            before = self.count_queries()
+        for engine in ('cached_db', 'cache', 'signed_cookies'):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                # SessionMiddleware 在创建时就确定了会话存储方式，所以每种方式使用新的客户端
+                self.client = self.client_class()
+                self.login()
+                after = self.count_queries()
+                self.assertEqual(len(after), len(before) - 2)
+                self.assertFalse([sql for sql in after if 'django_session' in sql or 'auth_user' in sql])
+                self.assertEqual(self.client.session['user_role'], 'admin')
+
+    def test_password_change_invalidates_cached_user(self):
+        self.login()
+        self.count_queries()
+        user = User.objects.get(username='admin')
+        user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        # 缓存的用户已经清除，会话中的密码摘要与新密码不一致，需要重新登录
+        response = self.client.get(reverse('student_list'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.login()
+        self.count_queries()
+        user = User.objects.get(username='admin')
+        data = caches['sessions'].get(USER_KEY.format(user.pk))
+        self.assertNotIn('password', data['fields'])
+        self.assertNotIn(user.password, repr(data))
+
+        backend = CachedModelBackend()
+        with self.assertNumQueries(0):
+            cached = backend.get_user(user.pk)
+            self.assertEqual(cached.get_session_auth_hash(), user.get_session_auth_hash())
+        # 保存缓存中恢复的用户时不会覆盖密码，读取密码时才查询
+        cached.first_name = '管理员'
+        cached.save()
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.check_password('admin')), ('管理员', True))
+        with self.assertNumQueries(1):
+            self.assertTrue(backend.get_user(user.pk).check_password('admin'))
+
+    def test_password_change_keeps_the_current_session(self):
+        self.login()
+        self.count_queries()
+        response = self.client.post(reverse('change_password'), {
+            'old_password': 'admin', 'new_password1': 'Changed-2024', 'new_password2': 'Changed-2024'})
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(self.client.get(reverse('student_list')).status_code, 200)
+        self.assertTrue(User.objects.get(username='admin').check_password('Changed-2024'))
+
+    def test_bulk_update_needs_explicit_invalidation(self):
+        self.login()
+        self.count_queries()
+        # QuerySet.update 不发送信号，缓存的用户仍然可以使用
+        User.objects.filter(username='admin').update(is_active=False)
+        self.assertEqual(self.client.get(reverse('student_list')).status_code, 200)
+        invalidate_users(User.objects.filter(username='admin').values_list('id', flat=True))
+        self.assertEqual(self.client.get(reverse('student_list')).status_code, 302)
+
+
+@override_settings(CACHES={'default': LOCMEM, 'sessions': {**LOCMEM, 'LOCATION': 'sessions'}},
+                   LOGIN_THROTTLE_RATES={'username': (3, 300), 'ip': (5, 60)})
+class LoginTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        for i in range(10):
+            user = User.objects.create_user(f'{20000000 + i}', password='secret')
+            Student.objects.create(student_number=user.username, student_name=f'学生{i}', gender='M',
+                                   birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                                   grade=grade)
+
+    def login(self, username, password='secret', ip='10.0.0.1'):
+        return self.client.post(reverse('user_login'), {'username': username, 'password': password, 'role': 'student'},
+                                REMOTE_ADDR=ip)
+
+    def test_student_and_user_are_loaded_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login('20000000')
+        self.assertEqual(response.json()['status'], 'success')
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT') and 'django_session' not in query['sql']]
+        self.assertEqual(len(selects), 1)
+        self.assertIn(f'JOIN {connection.ops.quote_name(User._meta.db_table)}', selects[0])
+        self.assertEqual(self.client.session['user_name'], '学生0')
+
+    def test_failed_logins_send_the_login_failed_signal(self):
+        received = []
+
+        def receiver(sender, credentials, request, **kwargs):
+            received.append(credentials)
+
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+        self.login('20000000', 'wrong')
+        self.login('29999999')
+        self.login('20000001')
+        self.assertEqual(received, [{'username': '20000000'}, {'username': '29999999'}])
+
+    def test_failed_attempts_are_throttled_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login('20000000', 'wrong').status_code, 404)
+        with mock.patch.object(User, 'check_password') as check_password, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.login('20000000')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        check_password.assert_not_called()
+        self.assertEqual(len(queries), 0)
+        # 其它用户名不受影响
+        self.assertEqual(self.login('20000001').json()['status'], 'success')
+
+    def test_failed_attempts_from_one_ip_are_throttled(self):
+        for i in range(5):
+            self.login(f'{20000000 + i}', 'wrong')
+        self.assertEqual(self.login('20000009').status_code, 429)
+        self.assertEqual(self.login('20000009', ip='10.0.0.2').json()['status'], 'success')
+
+    def test_successful_logins_do_not_use_up_tokens(self):
+        # 同一个 IP 下登录的学生数量超过桶的容量
+        for i in range(10):
+            self.client.logout()
+            self.assertEqual(self.login(f'{20000000 + i}').json()['status'], 'success')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+                   INITIAL_PASSWORD_ITERATIONS=1000, PASSWORD_HASH_WORKERS=2,
+                   CACHES={'default': LOCMEM, 'sessions': {**LOCMEM, 'LOCATION': 'sessions'}})
+class InitialPasswordTests(TestCase):
+    def iterations(self, encoded):
+        return identify_hasher(encoded).decode(encoded)['iterations']
+
+    def test_hashes_verify_in_order(self):
+        for count in (3, PARALLEL_THRESHOLD + 50):
+            raw_passwords = [f'{i:06d}' for i in range(count)]
+            with self.subTest(count=count), \
+                    mock.patch('utils.passwords.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+                hashes = hash_passwords(raw_passwords)
+                # 数量超过阈值时才使用进程池
+                self.assertEqual(pool.called, count > PARALLEL_THRESHOLD)
+            self.assertEqual(len(hashes), count)
+            for raw_password, encoded in list(zip(raw_passwords, hashes))[::50]:
+                self.assertTrue(check_password(raw_password, encoded))
+                self.assertFalse(check_password('wrong', encoded))
+                self.assertEqual(self.iterations(encoded), 1000)
+
+    def test_provisioned_password_is_upgraded_on_login(self):
+        User.objects.create_user('20000001', password='kept')
+        user_ids = provision_users(['20000000', '20000001'])
+        # 已经存在的账号直接关联，不修改密码
+        self.assertTrue(User.objects.get(pk=user_ids['20000001']).check_password('kept'))
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        Student.objects.create(student_number='20000000', student_name='学生', gender='M',
+                               birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                               user_id=user_ids['20000000'], grade=grade)
+        user = User.objects.get(pk=user_ids['20000000'])
+        self.assertEqual(self.iterations(user.password), 1000)
+        response = self.client.post(reverse('user_login'),
+                                    {'username': '20000000', 'password': '000000', 'role': 'student'})
+        self.assertEqual(response.json()['status'], 'success')
+        user.refresh_from_db()
+        self.assertEqual(self.iterations(user.password), PBKDF2PasswordHasher.iterations)
+        self.assertTrue(user.check_password('000000'))
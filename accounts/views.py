@@ -1,11 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
+from django.contrib.auth import login, logout, update_session_auth_hash
+from django.contrib.auth.signals import user_login_failed
 from django.contrib.auth.forms import PasswordChangeForm
 
 from .forms import LoginForm
 from teachers.models import Teacher
 from students.models import Student
+from monitoring.metrics import metrics
+from utils.throttle import TokenBucket
+
+def _login_buckets(request, username):
+    """
+    按用户名和客户端 IP 限制登录失败的次数，部署在反向代理后面时 REMOTE_ADDR 需要由代理正确设置
+    """
+    rates = settings.LOGIN_THROTTLE_RATES
+    cache = settings.LOGIN_THROTTLE_CACHE
+    keys = {
+        'username': f'accounts:login:username:{username}',
+        'ip': f'accounts:login:ip:{request.META.get("REMOTE_ADDR", "")}',
+    }
+    return [TokenBucket(keys[name], capacity, period, cache) for name, (capacity, period) in rates.items()]
+
+
+def _get_login_user(role, username):
+    """
+    按角色查询登录用户，老师和学生通过一次 join 查询同时取出用户，返回 (user, 显示名称, 错误信息)
+    """
+    if role == 'teacher':
+        teacher = Teacher.objects.select_related('user').filter(phone_number=username).first()
+        if teacher is None:
+            return None, None, '教师信息不存在'
+        return teacher.user, teacher.teacher_name, None
+    if role == 'student':
+        student = Student.objects.select_related('user').filter(student_number=username).first()
+        if student is None:
+            return None, None, '学生信息不存在'
+        return student.user, student.student_name, None
+    return User.objects.filter(username=username).first(), username, None
+
+
+def _login_failed(request, role, username):
+    """
+    记录一次登录失败，没有经过 authenticate 验证密码，所以由这里发送 user_login_failed 信号
+    """
+    metrics.inc('login_attempts_total', {'role': role, 'result': 'failure'})
+    user_login_failed.send(sender=__name__, credentials={'username': username}, request=request)
+
 
 # Create your views here.
 def user_login(request):
@@ -20,49 +63,45 @@ def user_login(request):
         username = form.cleaned_data.get('username')
         password = form.cleaned_data.get('password')
         role = form.cleaned_data.get('role')
-        # 判断角色
-        if role == 'teacher':
-            try:
-                # 查询教师信息是否存在
-                teacher = Teacher.objects.get(phone_number=username)
-                # 使用 Django 自带的功能验证用户名和密码,构造 user 对象
-                user = authenticate(username=username, password=password)
-                # 为 username 重新赋值，便于页面显示
-                username = teacher.teacher_name
-            except Teacher.DoesNotExist:
-                return JsonResponse({'status': 'error', 'message': '教师信息不存在'}, status=404)
-        elif role == 'student':
-            try:
-                # 查询学生信息是否存在
-                student = Student.objects.get(student_number=username)
-                # 构造 user 对象
-                user = authenticate(username=username, password=password)
-                # 为 username 重新赋值，便于页面显示
-                username = student.student_name
-            except Student.DoesNotExist:
-                return JsonResponse({'status': 'error', 'message': '学生信息不存在'}, status=404)
-        else:
-            try:
-                # 对于管理员账户，直接构建对象
-                user = authenticate(username=username, password=password)
-            except:
-                return JsonResponse({'status': 'error', 'message': '管理员信息不存在'}, status=404)
-        # print(user)
-        # print('用户'+user)
-        # 验证成功，返回 Json 数据
-        if user is not None:
-            if user.is_active:
-                # 使用 Django 自带的功能实现登录
-                login(request, user)
-                # 登录成功后将信息存入 session
-                request.session['user_role'] = role
-                request.session['user_name'] = username
-                return JsonResponse({'status': 'success', 'message': '登录成功', 'role': role})
-            else:
-                return JsonResponse({'status': 'error', 'message': '账户已经被禁用'}, status=403)
-        else:
+        # 先取走令牌，令牌不足时直接拒绝，不再查询数据库和验证密码
+        buckets = _login_buckets(request, username)
+        consumed = []
+        for bucket in buckets:
+            if not bucket.consume():
+                for taken in consumed:
+                    taken.refund()
+                response = JsonResponse({
+                    'status': 'error',
+                    'message': f'登录失败次数过多，请 {bucket.retry_after()} 秒后再试'
+                }, status=429)
+                response['Retry-After'] = bucket.retry_after()
+                metrics.inc('login_attempts_total', {'role': role, 'result': 'throttled'})
+                return response
+            consumed.append(bucket)
+        # 查询老师或学生信息，同时取出关联的用户
+        user, name, error = _get_login_user(role, username)
+        if error:
+            _login_failed(request, role, username)
+            return JsonResponse({'status': 'error', 'message': error}, status=404)
+        # 直接验证密码，不再通过 authenticate 重新查询 auth_user 表
+        # 初始密码使用较少的迭代次数加密，验证成功时会自动使用默认的加密方式重新加密并保存
+        if user is None or not user.check_password(password):
             # 处理登录失败的情况
+            _login_failed(request, role, username)
             return JsonResponse({'status': 'error', 'message': '用户名或密码错误'}, status=404)
+        if not user.is_active:
+            _login_failed(request, role, username)
+            return JsonResponse({'status': 'error', 'message': '账户已经被禁用'}, status=403)
+        # 登录成功不计入失败次数，考试开始时大量学生在同一个 IP 下登录也不会被限制
+        for bucket in buckets:
+            bucket.refund()
+        # 使用 Django 自带的功能实现登录
+        login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+        # 登录成功后将信息存入 session，后续请求直接从 session 中读取角色和显示名称
+        request.session['user_role'] = role
+        request.session['user_name'] = name
+        metrics.inc('login_attempts_total', {'role': role, 'result': 'success'})
+        return JsonResponse({'status': 'success', 'message': '登录成功', 'role': role})
 
     return render(request, 'accounts/login.html')
 
@@ -0,0 +1,71 @@
+"""
+对比 ReadExcel 一次性读取（get_data）和只读模式逐行读取（iter_chunks）的耗时与内存峰值
+
+用法：python benchmarks/bench_read_excel.py 1000 20000 200000
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import openpyxl
+
+# 让脚本可以直接在项目根目录下运行
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.handle_excel import ReadExcel
+
+
+# 生成一个 rows 行的学生信息表
+def make_workbook(path, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['班级', '姓名', '学号', '性别', '出生日期', '联系电话', '家庭住址'])
+    for i in range(rows):
+        ws.append(['一班', f'学生{i}', f'{20000000 + i}', '男', datetime.datetime(2010, 1, 1), '13800000000', '地址'])
+    wb.save(path)
+
+
+# 运行 func 并返回 (处理行数, 耗时, 内存峰值MB)
+def measure(func, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = func(path)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak / 1024 / 1024
+
+
+def read_full(path):
+    data = ReadExcel(path).get_data()
+    return len(data) - 1
+
+
+def read_streaming(path):
+    count = 0
+    with ReadExcel(path, read_only=True) as read_excel:
+        for chunk in read_excel.iter_chunks(500):
+            count += len(chunk)
+    return count
+
+
+def main(sizes):
+    print(f'{"rows":>8} {"mode":>10} {"seconds":>9} {"peak MB":>9}')
+    for rows in sizes:
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            make_workbook(path, rows)
+            for name, func in (('get_data', read_full), ('streaming', read_streaming)):
+                count, elapsed, peak = measure(func, path)
+                assert count == rows
+                print(f'{rows:>8} {name:>10} {elapsed:>9.2f} {peak:>9.1f}')
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 20000])
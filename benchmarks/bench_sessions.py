@@ -0,0 +1,75 @@
+"""
+对比不同会话存储方式和认证后端下，请求学生列表的查询次数与耗时
+
+用法：python benchmarks/bench_sessions.py 100
+使用 DJANGO_SETTINGS_MODULE 指定的配置（默认 config.settings）连接数据库，以第一个超级管理员的身份登录
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import django
+
+# 让脚本可以直接在项目根目录下运行
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# 参与对比的会话存储方式和认证后端，第一项是改动前的默认配置
+BENCHMARKS = (
+    ('db', 'django.contrib.auth.backends.ModelBackend'),
+    ('cached_db', 'accounts.backends.CachedModelBackend'),
+    ('cache', 'accounts.backends.CachedModelBackend'),
+    ('signed_cookies', 'accounts.backends.CachedModelBackend'),
+)
+
+
+# 以 user 的身份请求 count 次 url，返回平均每个请求的查询次数和耗时（毫秒）
+def measure(user, url, store, backend, count):
+    with override_settings(SESSION_ENGINE=f'django.contrib.sessions.backends.{store}',
+                           AUTHENTICATION_BACKENDS=[backend], ALLOWED_HOSTS=['testserver']):
+        # SessionMiddleware 在创建时就确定了会话存储方式，所以每种配置使用新的客户端
+        client = Client()
+        client.force_login(user, backend=backend)
+        session = client.session
+        session['user_role'] = 'admin'
+        session['user_name'] = user.username
+        session.save()
+        # 签名 cookie 保存后 session_key 就是新的 cookie 内容，需要写回到客户端
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        try:
+            # 先请求一次，让各种缓存生效
+            client.get(url)
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(count):
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - start
+        finally:
+            client.logout()
+    return len(queries) / count, elapsed * 1000 / count
+
+
+def main(count):
+    user = User.objects.filter(is_superuser=True).order_by('id').first()
+    if user is None:
+        sys.exit('没有可以登录的超级管理员账号')
+    url = reverse('student_list')
+    print(f'{url}，每种配置请求 {count} 次')
+    print(f'{"store":>15} {"backend":>20} {"queries":>8} {"ms":>8}')
+    for store, backend in BENCHMARKS:
+        queries, elapsed = measure(user, url, store, backend, count)
+        print(f'{store:>15} {backend.rsplit(".", 1)[-1]:>20} {queries:>8.1f} {elapsed:>8.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -44,17 +44,24 @@ INSTALLED_APPS = [
     'scores',
     'students',
     'teachers',
-    'accounts'
+    'accounts',
+    'jobs',
+    'monitoring',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # 放在会话和认证中间件前面，会话和登录用户的查询也计入统计，
+    # 请求耗时和查询次数总是写入 /metrics，REQUEST_METRICS 中 enabled 为 True 时还会记录慢请求日志和按视图的百分位数
+    'monitoring.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # 放在最后，其它中间件的 process_view 先执行，只分析视图本身
+    'monitoring.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -116,6 +123,12 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# 批量创建学生、老师账号时的初始密码（学号或手机号后6位）使用较少迭代次数的 PBKDF2 加密，
+# 首次登录成功后会自动升级为默认的加密方式，设置为 None 时直接使用默认的加密方式
+INITIAL_PASSWORD_ITERATIONS = 20000
+# 批量加密密码时使用的进程数，为 None 时使用 CPU 核数
+PASSWORD_HASH_WORKERS = None
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
@@ -148,3 +161,84 @@ X_FRAME_OPTIONS = 'SAMEORIGIN'
 
 # 登录页面URL
 LOGIN_URL = '/login/'
+
+# 会话的存储方式，每个请求都要读取会话中的角色（user_role）和显示名称（user_name）
+# db：只保存在数据库中，每个请求查询一次 django_session 表
+# cached_db：先读缓存，缓存中没有时再查询数据库，写入时同时写入缓存和数据库
+# cache：只保存在缓存中，缓存清空后需要重新登录
+# signed_cookies：签名后保存在浏览器的 cookie 中，不占用服务端存储，但退出登录后旧的 cookie 在过期前仍然有效
+SESSION_STORE = 'cached_db'
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_STORE]
+# 会话和登录用户使用单独的缓存。本地内存缓存只在当前进程有效，退出登录后其它进程仍会读到旧的会话，
+# 所以默认使用同一台服务器上所有进程共享的文件缓存，有条件时可以换成 Redis、Memcached 等共享缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'sessions'),
+    },
+    # 后台任务的进度和心跳，web 进程和 run_jobs 进程都要能读到，所以不能使用 LocMemCache
+    'jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'jobs'),
+    },
+}
+SESSION_CACHE_ALIAS = 'sessions'
+# 从缓存中读取登录用户，不再每个请求查询一次 auth_user 表，用户保存或删除时自动清除
+AUTHENTICATION_BACKENDS = ['accounts.backends.CachedModelBackend']
+# 缓存登录用户的时间（秒）
+AUTH_USER_CACHE_TIMEOUT = 300
+# 登录限流：按用户名和客户端 IP 各用一个令牌桶，只有登录失败才消耗令牌，(容量, 补满所需秒数)
+# 同一个 IP 下可能有整个学校的学生，所以 IP 的容量要大一些；令牌不足时直接返回 429，不再验证密码
+LOGIN_THROTTLE_RATES = {'username': (5, 300), 'ip': (100, 60)}
+# 令牌桶使用的缓存，默认的本地内存缓存按进程计数，可以换成 sessions 或 Redis 等共享缓存
+LOGIN_THROTTLE_CACHE = 'default'
+# 后台任务：执行中的进度和心跳保存在 JOB_PROGRESS_CACHE 中，多台服务器部署时需要换成 Redis 等共享缓存；
+# 心跳超过 JOB_STALE_TIMEOUT 秒没有更新的任务视为 worker 异常退出，标记为失败；导出文件保留 JOB_RESULT_DAYS 天
+JOB_PROGRESS_CACHE = 'jobs'
+JOB_STALE_TIMEOUT = 600
+JOB_RESULT_DAYS = 7
+
+# 列表分页总条数的缓存时间（秒），游标分页只显示近似的总页数
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+# 班级目录的缓存时间（秒），班级保存或删除时会自动清除。
+# 多进程部署时建议在 CACHES 中配置 Redis、Memcached 等共享缓存，否则其它进程最多在超时后才能看到变化
+GRADE_CACHE_TIMEOUT = 300
+# 学生花名册索引版本号的缓存时间（秒），超时后各进程会重新加载索引
+ROSTER_CACHE_TIMEOUT = 300
+# 考试排名版本号的缓存时间（秒），每个进程最多缓存 RANKING_MAX_EXAMS 场考试的排名
+RANKING_CACHE_TIMEOUT = 300
+RANKING_MAX_EXAMS = 50
+# 考试成绩统计默认计算的百分位数，请求中可以通过 percentiles 参数覆盖
+SCORE_PERCENTILES = (10, 25, 75, 90)
+# 成绩分段报表默认的分段方式和缓存时间（秒），考试成绩变化时缓存会立即失效
+SCORE_BANDS = {'width': 10}
+SCORE_REPORT_CACHE_TIMEOUT = 3600
+# 请求统计：记录每个请求的视图、耗时、SQL 查询次数、SQL 耗时和重复查询次数，
+# 超过阈值（slow_ms 毫秒、max_queries 查询次数、max_duplicates 重复查询次数）时记录警告日志，
+# 每个视图保留最近 window 个请求计算 p50/p95/p99，各项的默认值见 monitoring/stats.py 中的 DEFAULTS，这里只写需要修改的项
+REQUEST_METRICS = {
+    'enabled': False,
+}
+# Prometheus 指标：各进程的计数最多每隔 METRICS_FLUSH_INTERVAL 秒写入 METRICS_DIR 下的文件，已经退出的进程的文件
+# 最多每隔 METRICS_ARCHIVE_INTERVAL 秒合并到一个文件中。/metrics 合并所有文件输出，请求头需要带上
+# Authorization: Bearer <METRICS_TOKEN>，或者以 staff 用户登录后访问；METRICS_TOKEN 为空时只允许 staff 用户访问
+METRICS_DIR = BASE_DIR / 'cache' / 'metrics'
+METRICS_FLUSH_INTERVAL = 1
+METRICS_ARCHIVE_INTERVAL = 60
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# 性能分析：staff 用户在请求中带上 ?profile=1，或者请求头 X-Profile 的值等于 secret 时，
+# 在 cProfile 下执行视图，结果和 SQL 保存在 MEDIA_ROOT/profiles 中，保留最近 keep 个，可以在 /admin/profiles/ 中查看；
+# 只保存 SELECT 语句的 SQL 参数，写入语句和查询 redact_tables 中的表（默认为会话表）时只记录参数个数
+PROFILING = {
+    'enabled': True,
+    'secret': os.environ.get('PROFILING_SECRET', ''),
+    'keep': 50,
+}
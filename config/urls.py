@@ -18,15 +18,20 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic.base import RedirectView
 from accounts.views import user_login, user_logout, change_password
+from monitoring.views import metrics_view, profile_list, profile_download
 
 urlpatterns = [
     path('', RedirectView.as_view(url='/students/', permanent=False)),
+    path('admin/profiles/', profile_list, name='profile_list'),
+    path('admin/profiles/<str:profile_id>.prof', profile_download, name='profile_download'),
     path('admin/', admin.site.urls),
     path('grades/', include('grades.urls')),
     path('students/', include('students.urls')),
     path('teachers/', include('teachers.urls')),
     path('scores/', include('scores.urls')),
+    path('jobs/', include('jobs.urls')),
     path('login/', user_login, name='user_login'),
     path('logout/', user_logout, name='user_logout'),
-    path('change_password/', change_password, name='change_password')
+    path('change_password/', change_password, name='change_password'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GradesConfig(AppConfig):
     name = 'grades'
     verbose_name = '班级管理'
+
+    def ready(self):
+        # 注册信号
+        from . import signals
@@ -0,0 +1,81 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.forms.models import ModelChoiceIterator
+
+from .models import Grade
+
+# 班级目录和版本号的缓存键
+CATALOGUE_KEY = 'grades:catalogue'
+VERSION_KEY = 'grades:catalogue:version'
+
+# 进程内的副本，版本号与共享缓存一致时直接使用
+_local = {'version': None, 'catalogue': ()}
+
+'''
+班级目录缓存
+班级很少变动，列表页、表单的下拉框和导入都从这里读取，不再每次查询数据库。
+共享缓存中保存目录和版本号，进程内再保存一份副本，班级保存或删除时通过信号清除缓存
+'''
+def get_catalogue():
+    """
+    返回按班级编号排序的 (id, grade_name, grade_number) 元组
+    """
+    version = cache.get(VERSION_KEY)
+    if version is not None and version == _local['version']:
+        return _local['catalogue']
+    catalogue = cache.get(CATALOGUE_KEY) if version is not None else None
+    if catalogue is None:
+        catalogue = tuple(Grade.objects.order_by('grade_number').values_list('id', 'grade_name', 'grade_number'))
+        version = uuid.uuid4().hex
+        # 多进程部署且使用本地内存缓存时，其它进程最多在超时后读取到新的班级
+        timeout = getattr(settings, 'GRADE_CACHE_TIMEOUT', 300)
+        cache.set_many({CATALOGUE_KEY: catalogue, VERSION_KEY: version}, timeout)
+    _local.update(version=version, catalogue=catalogue)
+    return catalogue
+
+
+def get_grades():
+    """
+    返回 Grade 对象列表，可以直接在模板和表单中使用
+    """
+    return [Grade(id=pk, grade_name=name, grade_number=number) for pk, name, number in get_catalogue()]
+
+
+def get_grade_ids():
+    """
+    返回 {班级名称: 班级 id}
+    """
+    return {name: pk for pk, name, _ in get_catalogue()}
+
+
+def invalidate():
+    cache.delete_many([VERSION_KEY, CATALOGUE_KEY])
+    _local.update(version=None, catalogue=())
+
+
+class CachedGradeIterator(ModelChoiceIterator):
+    """
+    从缓存中生成班级下拉框的选项
+    """
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for grade in get_grades():
+            yield self.choice(grade)
+
+    def __len__(self):
+        return len(get_catalogue()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(get_catalogue())
+
+
+def use_cached_grades(field):
+    """
+    让表单的班级字段从缓存中读取选项，提交时仍然通过数据库校验
+    """
+    field.queryset = Grade.objects.all().order_by('grade_number')
+    field.iterator = CachedGradeIterator
+    field.widget.choices = field.choices
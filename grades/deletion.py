@@ -0,0 +1,66 @@
+from django.db import transaction
+
+from scores.deletion import delete_scores
+from scores.models import Score
+from students.deletion import delete_students
+from students.models import Student
+from teachers.models import Teacher
+from utils.deletion import DELETE_CHUNK_SIZE
+from .models import Grade
+
+
+class GradeDeleteError(Exception):
+    """
+    班级不能删除，例如还有负责该班级的老师
+    """
+
+
+def check_teacher(grade_id):
+    """
+    Teacher.grade 是 DO_NOTHING，直接删除班级会留下指向不存在班级的老师，所以有负责老师时不允许删除
+    """
+    teacher = Teacher.objects.filter(grade_id=grade_id).values_list('teacher_name', flat=True).first()
+    if teacher is not None:
+        raise GradeDeleteError(f'老师【{teacher}】负责该班级，请先为老师更换负责班级')
+
+
+def _delete_chunks(queryset, delete, stage, chunk_size, on_progress):
+    """
+    每次取出 chunk_size 个 id 交给 delete 删除，每一批是一个单独的短事务，返回删除的数量
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += delete(queryset.model.objects.filter(id__in=ids))
+        if on_progress:
+            on_progress(stage, deleted)
+
+
+def delete_grade(grade_id, chunk_size=DELETE_CHUNK_SIZE, on_progress=None):
+    """
+    删除班级和班级下的成绩、学生及学生的登录用户
+    不使用 Grade.delete() 一次加载并删除全部关联数据，而是先按 chunk_size 分批删除成绩和学生，
+    每一批一个短事务，不会长时间锁表，on_progress(stage, processed) 用于报告进度，
+    最后在一个事务中锁定班级，删除分批期间新增的数据、考试和班级的关联以及班级本身
+    """
+    if not Grade.objects.filter(pk=grade_id).exists():
+        raise GradeDeleteError('班级不存在')
+    check_teacher(grade_id)
+    scores = _delete_chunks(Score.objects.filter(grade_id=grade_id), delete_scores, 'scores', chunk_size, on_progress)
+    students = _delete_chunks(Student.objects.filter(grade_id=grade_id), delete_students, 'students', chunk_size,
+                              on_progress)
+    with transaction.atomic():
+        grade = Grade.objects.select_for_update().filter(pk=grade_id).first()
+        if grade is None:
+            raise GradeDeleteError('班级不存在')
+        # 分批删除期间可能有老师改为负责该班级，锁定班级后再检查一次
+        check_teacher(grade_id)
+        scores += delete_scores(Score.objects.filter(grade_id=grade_id))
+        students += delete_students(Student.objects.filter(grade_id=grade_id))
+        # 剩下的只有考试和班级的关联，交给 Django 删除，同时发送信号清除班级目录缓存
+        grade.delete()
+    if on_progress:
+        on_progress('grade', scores + students)
+    return {'count': scores + students, 'scores': scores, 'students': students}
@@ -0,0 +1,43 @@
+from django.db.models import Avg, Count, Exists, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from scores.analytics import SUBJECTS
+from scores.models import Exam, Score
+from students.models import Student
+from .models import Grade
+
+
+def _student_count(**filters):
+    # 按班级统计学生人数的相关子查询，使用 (grade, student_number) 索引
+    students = Student.objects.filter(grade=OuterRef('pk'), **filters).order_by().values('grade')
+    return Coalesce(Subquery(students.annotate(count=Count('*')).values('count')), Value(0),
+                    output_field=IntegerField())
+
+
+def _latest_exam():
+    # 班级有成绩的最近一次考试，按考试排序逐个用 (exam, grade) 索引判断是否有成绩，不扫描班级的全部成绩
+    scores = Score.objects.filter(exam=OuterRef('pk'), grade=OuterRef(OuterRef('pk')))
+    exams = Exam.objects.filter(Exists(scores)).order_by(F('date').desc(nulls_last=True), '-id')
+    return Subquery(exams.values('id')[:1])
+
+
+def _latest_average(expression):
+    scores = Score.objects.filter(grade=OuterRef('pk'), exam=OuterRef('latest_exam_id')).order_by().values('grade')
+    return Subquery(scores.annotate(average=Avg(expression)).values('average'))
+
+
+def grade_overview():
+    """
+    返回班级概览，每个班级附带学生人数、男女人数、班主任姓名、最近一次考试和该考试各科及总分的平均分
+    全部由一条带相关子查询的 SQL 计算，不会逐个班级再查询
+    """
+    return Grade.objects.annotate(
+        student_count=_student_count(),
+        male_count=_student_count(gender='M'),
+        female_count=_student_count(gender='F'),
+        # Teacher.grade 是一对一关联，LEFT JOIN 老师表取出姓名
+        teacher_name=F('teacher__teacher_name'),
+        latest_exam_id=_latest_exam(),
+        latest_exam_name=Subquery(Exam.objects.filter(pk=OuterRef('latest_exam_id')).values('name')),
+        **{f'{subject}_average': _latest_average(expression) for subject, expression in SUBJECTS.items()},
+    ).order_by('grade_number')
@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Grade
+from . import cache
+
+
+# 班级保存或删除后清除班级目录缓存，
+# 事务提交后再清除一次，避免其它请求在提交前把旧的班级目录重新写入缓存
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def invalidate_grade_cache(sender, **kwargs):
+    cache.invalidate()
+    transaction.on_commit(cache.invalidate)
@@ -1,3 +1,195 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from jobs.handlers import run_job
+from jobs.models import Job
+from scores.models import Exam, Score
+from students.models import Student
+from teachers.models import Teacher
+from utils.query_plan import analyze, full_table_scans
+from .deletion import delete_grade, GradeDeleteError
+from .models import Grade
+from .overview import grade_overview
+from . import cache as grade_cache
+
 
 # Create your tests here.
+class GradeCacheTests(TestCase):
+    def setUp(self):
+        grade_cache.invalidate()
+        Grade.objects.create(grade_name='二班', grade_number='002')
+        Grade.objects.create(grade_name='一班', grade_number='001')
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def test_catalogue_is_ordered_and_cached(self):
+        self.assertEqual([name for _, name, _ in grade_cache.get_catalogue()], ['一班', '二班'])
+        with self.assertNumQueries(0):
+            grade_cache.get_catalogue()
+
+    def test_invalidated_on_save_and_delete(self):
+        grade_cache.get_catalogue()
+        grade = Grade.objects.create(grade_name='三班', grade_number='003')
+        self.assertIn('三班', grade_cache.get_grade_ids())
+        grade.delete()
+        self.assertNotIn('三班', grade_cache.get_grade_ids())
+
+    def test_invalidated_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.create(grade_name='三班', grade_number='003')
+            # 模拟其它请求在事务提交前读取到旧的班级目录并写入缓存
+            grade_cache.cache.set_many({grade_cache.CATALOGUE_KEY: (), grade_cache.VERSION_KEY: 'stale'})
+            self.assertEqual(grade_cache.get_grade_ids(), {})
+        self.assertIn('三班', grade_cache.get_grade_ids())
+
+    def test_list_pages_run_one_fewer_query(self):
+        for name in ('student_list', 'score_list', 'teacher_list'):
+            with self.subTest(page=name):
+                url = reverse(name)
+                # 先访问一次，缓存分页总数等其它数据
+                self.client.get(url)
+                grade_cache.invalidate()
+                with CaptureQueriesContext(connection) as cold:
+                    self.client.get(url)
+                with CaptureQueriesContext(connection) as warm:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(warm), len(cold) - 1)
+                self.assertEqual([grade.grade_name for grade in response.context['grades']], ['一班', '二班'])
+
+    def test_form_choices_come_from_cache(self):
+        from students.forms import StudentForm
+        grade_cache.get_catalogue()
+        with self.assertNumQueries(0):
+            choices = list(StudentForm().fields['grade'].choices)
+        self.assertEqual([label for _, label in choices], ['---------', '一班', '二班'])
+
+
+class GradeDeletionTests(TestCase):
+    def setUp(self):
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        self.exam = Exam.objects.create(name='期中考试')
+        self.exam.grades.set([self.grade, self.other])
+        for i in range(25):
+            user = User.objects.create_user(f'{20000000 + i}')
+            student = Student.objects.create(
+                student_number=user.username, student_name=f'学生{i}', gender='M', birthday=datetime.date(2010, 1, 1),
+                contact_number='1', address='a', user=user, grade=self.grade if i < 20 else self.other)
+            Score.objects.create(exam=self.exam, student=student, student_number=student.student_number,
+                                 student_name=student.student_name, grade_id=student.grade_id,
+                                 chinese_score=90, math_score=90, english_score=90)
+        self.admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def add_teacher(self):
+        user = User.objects.create_user('13800000000')
+        return Teacher.objects.create(user=user, teacher_name='王老师', phone_number='13800000000', gender='F',
+                                      birthday=datetime.date(1990, 1, 1), grade=self.grade)
+
+    def test_deletes_dependents_in_chunks(self):
+        user_ids = list(Student.objects.filter(grade=self.grade).values_list('user_id', flat=True))
+        progress = []
+        result = delete_grade(self.grade.pk, chunk_size=7, on_progress=lambda *args: progress.append(args))
+        self.assertEqual(result, {'count': 40, 'scores': 20, 'students': 20})
+        self.assertEqual(progress, [('scores', 7), ('scores', 14), ('scores', 20),
+                                    ('students', 7), ('students', 14), ('students', 20), ('grade', 40)])
+        self.assertFalse(Grade.objects.filter(pk=self.grade.pk).exists())
+        self.assertFalse(User.objects.filter(id__in=user_ids).exists())
+        self.assertEqual(list(self.exam.grades.all()), [self.other])
+        self.assertEqual(Student.objects.count(), 5)
+        self.assertEqual(Score.objects.count(), 5)
+
+    def test_grade_with_teacher_is_not_deleted(self):
+        self.add_teacher()
+        with self.assertRaises(GradeDeleteError):
+            delete_grade(self.grade.pk)
+        self.assertEqual(Student.objects.filter(grade=self.grade).count(), 20)
+        self.assertEqual(Score.objects.filter(grade=self.grade).count(), 20)
+
+    def test_view_enqueues_background_job(self):
+        response = self.client.post(reverse('grade_delete', args=[self.grade.pk]))
+        self.assertEqual(response.status_code, 202)
+        job = response.context['job']
+        self.assertEqual((job.kind, job.params), (Job.GRADE_DELETE, {'grade': self.grade.pk}))
+        # 提交任务时还没有删除
+        self.assertTrue(Grade.objects.filter(pk=self.grade.pk).exists())
+        self.assertTrue(job.claim())
+        run_job(job)
+        self.assertEqual((job.status, job.processed), (Job.SUCCESS, 40))
+        self.assertFalse(Grade.objects.filter(pk=self.grade.pk).exists())
+
+    def test_view_refuses_grade_with_teacher(self):
+        self.add_teacher()
+        response = self.client.post(reverse('grade_delete', args=[self.grade.pk]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('王老师', response.context['error'])
+        self.assertFalse(Job.objects.exists())
+
+
+class GradeOverviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Grade.objects.bulk_create([Grade(grade_name=f'{i}班', grade_number=f'{i:03d}') for i in range(20)])
+        grades = list(Grade.objects.order_by('grade_number'))
+        cls.grade, cls.empty = grades[0], grades[-1]
+        User.objects.bulk_create([User(username=f'{20000000 + i}') for i in range(190)])
+        Student.objects.bulk_create([
+            Student(student_number=user.username, student_name=f'学生{i}', gender='MF'[i % 2],
+                    birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                    grade=grades[i % 19])
+            for i, user in enumerate(User.objects.order_by('id'))
+        ])
+        old = Exam.objects.create(name='期中考试', date=datetime.date(2024, 4, 1))
+        new = Exam.objects.create(name='期末考试', date=datetime.date(2024, 7, 1))
+        students = list(Student.objects.order_by('id'))
+        Score.objects.bulk_create([
+            Score(exam=exam, student=student, student_number=student.student_number, student_name=student.student_name,
+                  grade_id=student.grade_id, chinese_score=base + i % 10, math_score=base, english_score=base)
+            for exam, base in ((old, 50), (new, 80)) for i, student in enumerate(students)
+        ])
+        user = User.objects.create_user('13800000000')
+        Teacher.objects.create(user=user, teacher_name='王老师', phone_number='13800000000', gender='F',
+                               birthday=datetime.date(1990, 1, 1), grade=cls.grade)
+        analyze(Score, Student)
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+
+    def test_overview_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            grades = {grade.pk: grade for grade in grade_overview()}
+        self.assertEqual(len(queries), 1)
+        scans = set(full_table_scans(queries[0]['sql'])) & {Score._meta.db_table, Student._meta.db_table}
+        self.assertFalse(scans, queries[0]['sql'])
+        grade = grades[self.grade.pk]
+        expected = Student.objects.filter(grade=self.grade)
+        self.assertEqual((grade.student_count, grade.male_count, grade.female_count),
+                         (10, expected.filter(gender='M').count(), expected.filter(gender='F').count()))
+        self.assertEqual((grade.teacher_name, grade.latest_exam_name), ('王老师', '期末考试'))
+        chinese = [score.chinese_score for score in Score.objects.filter(grade=self.grade, exam__name='期末考试')]
+        self.assertAlmostEqual(grade.chinese_score_average, sum(chinese) / len(chinese))
+        self.assertAlmostEqual(grade.total_average, sum(chinese) / len(chinese) + 160)
+        empty = grades[self.empty.pk]
+        self.assertEqual((empty.student_count, empty.male_count, empty.teacher_name, empty.latest_exam_name),
+                         (0, 0, None, None))
+        self.assertIsNone(empty.total_average)
+
+    def test_overview_page(self):
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+        response = self.client.get(reverse('grade_overview'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['grades']), 20)
+        self.assertContains(response, '王老师')
@@ -2,11 +2,16 @@
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.db.models import Q
 from django.urls import reverse_lazy
+from django.forms import Form
+
+from jobs.models import Job
 
 from utils.premissions import RoleRequiredMixin
 # 导入ListView使用时所需要提供的模型
 from .models import Grade
 from .forms import GradeForm
+from .deletion import check_teacher, GradeDeleteError
+from .overview import grade_overview
 
 # Create your views here.
 class GradeBaseView(RoleRequiredMixin):
@@ -50,6 +55,13 @@ class GradeListView(GradeBaseView, ListView):
         # 如果存在参数，则进行过滤，否则返回所有数据（父类方法）
         return queryset
 
+class GradeOverviewView(GradeBaseView, ListView):
+    # 班级概览：人数、男女人数、班主任和最近一次考试的平均分，一条查询取出全部班级
+    template_name = 'grades/overview.html'
+
+    def get_queryset(self):
+        return grade_overview()
+
 class GradeCreateView(GradeBaseView, CreateView):
     pass
 
@@ -57,4 +69,16 @@ class GradeUpdateView(GradeBaseView, UpdateView):
     pass
 
 class GradeDeleteView(GradeBaseView, DeleteView):
-    template_name = 'grades/delete_confirm.html'
\ No newline at end of file
+    template_name = 'grades/delete_confirm.html'
+    context_object_name = 'grade'
+    # 删除确认只需要空表单，不能使用基类的 GradeForm，否则表单校验不通过，班级永远不会被删除
+    form_class = Form
+
+    # 班级下的学生和成绩可能有很多，不在请求中删除，而是提交后台任务分批删除
+    def form_valid(self, form):
+        try:
+            check_teacher(self.object.pk)
+        except GradeDeleteError as e:
+            return self.render_to_response(self.get_context_data(error=str(e)), status=400)
+        job = Job.enqueue(Job.GRADE_DELETE, self.request.user, params={'grade': self.object.pk})
+        return self.render_to_response(self.get_context_data(job=job), status=202)
\ No newline at end of file
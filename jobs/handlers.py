@@ -0,0 +1,122 @@
+import tempfile
+import time
+
+from django.core.files import File
+
+from grades.models import Grade
+from grades import deletion as grade_deletion
+from students.models import Student
+from students.importer import StudentImporter, StudentImportError, STUDENT_HEADER
+from students.exporter import export_rows as student_export_rows
+from scores.models import Score
+from scores.importer import ScoreImporter, ScoreImportError, SCORE_HEADER
+from scores.exporter import export_rows as score_export_rows
+from monitoring.metrics import observe_export
+from utils.export import file_size
+from utils.handle_excel import ReadExcel, StreamWriteExcel
+from .models import Job
+
+
+class JobError(Exception):
+    """
+    任务执行失败，errors 中保存详细的错误信息
+    """
+    def __init__(self, message, errors=None):
+        self.errors = errors or []
+        super().__init__(message)
+
+
+def import_students(job):
+    with ReadExcel(job.file.path, read_only=True) as read_excel:
+        if not read_excel.check_header(STUDENT_HEADER):
+            raise JobError('Excel 中学生信息不是指定格式')
+        try:
+            return StudentImporter(read_excel.iter_rows(), on_progress=job.update_progress).run()
+        except StudentImportError as e:
+            raise JobError(str(e), e.errors)
+
+
+def import_scores(job):
+    with ReadExcel(job.file.path, read_only=True) as read_excel:
+        if not read_excel.check_header(SCORE_HEADER):
+            raise JobError('Excel 中成绩信息不是指定格式')
+        try:
+            return ScoreImporter(read_excel.iter_rows(), on_progress=job.update_progress).run()
+        except ScoreImportError as e:
+            raise JobError(str(e), e.errors)
+
+
+def _export(job, header, rows, filename):
+    # 统计写入的行数，用于显示进度
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            job.update_progress('export', count)
+            yield row
+
+    start = time.perf_counter()
+    writer = StreamWriteExcel(header, counted())
+    kind = filename
+    if job.params.get('format') == 'csv':
+        output = tempfile.TemporaryFile()
+        for chunk in writer.iter_csv():
+            output.write(chunk)
+        output.seek(0)
+        filename = f'{filename}.csv'
+    else:
+        output = writer.write_xlsx()
+        filename = f'{filename}.xlsx'
+    elapsed = time.perf_counter() - start
+    observe_export(kind, file_size(output), elapsed)
+    with output:
+        job.result_file.save(filename, File(output), save=False)
+    return {'count': count, 'rows_per_second': round(count / elapsed, 1) if elapsed else count}
+
+
+def export_students(job):
+    grade = Grade.objects.get(pk=job.params['grade'])
+    return _export(job, STUDENT_HEADER, student_export_rows(Student.objects.filter(grade=grade)), 'students')
+
+
+def export_scores(job):
+    grade = Grade.objects.get(pk=job.params['grade'])
+    scores = Score.objects.filter(grade=grade)
+    if job.params.get('exam'):
+        scores = scores.filter(exam_id=job.params['exam'])
+    return _export(job, SCORE_HEADER, score_export_rows(scores), 'scores')
+
+
+def delete_grade(job):
+    try:
+        return grade_deletion.delete_grade(job.params['grade'], on_progress=job.update_progress)
+    except grade_deletion.GradeDeleteError as e:
+        raise JobError(str(e))
+
+
+# 任务类型和处理函数的对应关系
+HANDLERS = {
+    Job.STUDENT_IMPORT: import_students,
+    Job.SCORE_IMPORT: import_scores,
+    Job.STUDENT_EXPORT: export_students,
+    Job.SCORE_EXPORT: export_scores,
+    Job.GRADE_DELETE: delete_grade,
+}
+
+
+def run_job(job):
+    """
+    执行任务并保存结果，任务需要已经通过 claim 领取
+    """
+    try:
+        result = HANDLERS[job.kind](job)
+    except JobError as e:
+        job.finish(Job.FAILED, str(e), errors=e.errors)
+    except Exception as e:
+        job.finish(Job.FAILED, '任务执行失败' + str(e))
+    else:
+        job.finish(Job.SUCCESS, '执行成功', processed=result['count'],
+                   rows_per_second=result.get('rows_per_second', 0))
+    return job
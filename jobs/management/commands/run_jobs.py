@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.models import Job
+from jobs.handlers import run_job
+
+
+class Command(BaseCommand):
+    help = '在后台执行导入、导出任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='执行完当前等待的任务后退出')
+        parser.add_argument('--interval', type=float, default=2, help='没有任务时的轮询间隔（秒）')
+
+    def handle(self, *args, **options):
+        while True:
+            # 长时间运行的进程需要主动清理失效的数据库连接
+            close_old_connections()
+            self.cleanup()
+            job = self.next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write(f'开始执行 {job}')
+            run_job(job)
+            self.stdout.write(f'{job} {job.get_status_display()}：{job.message}')
+
+    # 标记异常退出的 worker 留下的任务，删除过期的导出文件
+    def cleanup(self):
+        failed = Job.fail_stale()
+        if failed:
+            self.stdout.write(f'{failed} 个任务的 worker 已经退出，标记为失败')
+        Job.purge_results()
+
+    # 按创建顺序领取一个等待执行的任务
+    def next_job(self):
+        for job in Job.objects.filter(status=Job.PENDING).order_by('id')[:10]:
+            if job.claim():
+                return job
+        return None
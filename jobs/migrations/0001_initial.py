@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('student_import', '导入学生信息'), ('score_import', '导入成绩信息'), ('student_export', '导出学生信息'), ('score_export', '导出成绩信息')], max_length=30, verbose_name='任务类型')),
+                ('status', models.CharField(choices=[('pending', '等待执行'), ('running', '正在执行'), ('success', '执行成功'), ('failed', '执行失败')], db_index=True, default='pending', max_length=10, verbose_name='状态')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='任务参数')),
+                ('file', models.FileField(blank=True, upload_to='jobs/uploads/%Y%m%d/', verbose_name='上传文件')),
+                ('result_file', models.FileField(blank=True, upload_to='jobs/results/%Y%m%d/', verbose_name='结果文件')),
+                ('stage', models.CharField(blank=True, max_length=20, verbose_name='当前阶段')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='已处理行数')),
+                ('rows_per_second', models.FloatField(default=0, verbose_name='每秒处理行数')),
+                ('message', models.CharField(blank=True, max_length=255, verbose_name='结果信息')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='错误信息')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='结束时间')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to=settings.AUTH_USER_MODEL, verbose_name='创建人')),
+            ],
+            options={
+                'verbose_name': '后台任务',
+                'verbose_name_plural': '后台任务',
+                'db_table': 'job',
+            },
+        ),
+    ]
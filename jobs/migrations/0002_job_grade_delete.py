@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('student_import', '导入学生信息'), ('score_import', '导入成绩信息'), ('student_export', '导出学生信息'), ('score_export', '导出成绩信息'), ('grade_delete', '删除班级')], max_length=30, verbose_name='任务类型'),
+        ),
+    ]
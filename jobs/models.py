@@ -0,0 +1,215 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def progress_cache():
+    return caches[getattr(settings, 'JOB_PROGRESS_CACHE', 'default')]
+
+
+# Create your models here.
+class Job(models.Model):
+    """
+    后台任务表，由 run_jobs 命令在后台进程中执行
+    """
+    STUDENT_IMPORT = 'student_import'
+    SCORE_IMPORT = 'score_import'
+    STUDENT_EXPORT = 'student_export'
+    SCORE_EXPORT = 'score_export'
+    GRADE_DELETE = 'grade_delete'
+    KIND_CHOICES = (
+        (STUDENT_IMPORT, '导入学生信息'),
+        (SCORE_IMPORT, '导入成绩信息'),
+        (STUDENT_EXPORT, '导出学生信息'),
+        (SCORE_EXPORT, '导出成绩信息'),
+        (GRADE_DELETE, '删除班级'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, '等待执行'),
+        (RUNNING, '正在执行'),
+        (SUCCESS, '执行成功'),
+        (FAILED, '执行失败'),
+    )
+
+    kind = models.CharField('任务类型', max_length=30, choices=KIND_CHOICES)
+    status = models.CharField('状态', max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    params = models.JSONField('任务参数', default=dict, blank=True)
+    # 导入任务上传的文件
+    file = models.FileField('上传文件', upload_to='jobs/uploads/%Y%m%d/', blank=True)
+    # 导出任务生成的文件
+    result_file = models.FileField('结果文件', upload_to='jobs/results/%Y%m%d/', blank=True)
+    # 当前阶段，导入时先校验（validate）再写入（save）
+    stage = models.CharField('当前阶段', max_length=20, blank=True)
+    processed = models.PositiveIntegerField('已处理行数', default=0)
+    rows_per_second = models.FloatField('每秒处理行数', default=0)
+    message = models.CharField('结果信息', max_length=255, blank=True)
+    errors = models.JSONField('错误信息', default=list, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='创建人', related_name='jobs')
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    started_at = models.DateTimeField('开始时间', null=True, blank=True)
+    finished_at = models.DateTimeField('结束时间', null=True, blank=True)
+
+    # 两次保存进度之间的最小间隔（秒），避免逐行更新数据库
+    PROGRESS_INTERVAL = 1
+    # 最多保存的错误条数
+    MAX_ERRORS = 100
+
+    def __str__(self):
+        return f'{self.get_kind_display()}#{self.pk}'
+
+    @classmethod
+    def enqueue(cls, kind, user, file=None, params=None):
+        """
+        创建一个等待执行的任务
+        """
+        job = cls(kind=kind, created_by=user, params=params or {})
+        if file is not None:
+            job.file.save(file.name, file, save=False)
+        job.save()
+        return job
+
+    def claim(self):
+        """
+        将任务标记为正在执行，多个 worker 同时领取时只有一个能成功
+        """
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=self.pk, status=self.PENDING).update(status=self.RUNNING, started_at=now)
+        if claimed:
+            self.status = self.RUNNING
+            self.started_at = now
+            self._save_progress()
+        return bool(claimed)
+
+    @property
+    def progress_key(self):
+        return f'jobs:progress:{self.pk}'
+
+    def _save_progress(self):
+        # 导入在一个事务中执行，提交前其它连接看不到数据库中的修改，所以执行过程中的进度保存在缓存中，
+        # 同时作为 worker 的心跳，超过 JOB_STALE_TIMEOUT 秒没有更新说明 worker 已经异常退出
+        progress = {'stage': self.stage, 'processed': self.processed, 'heartbeat': time.time()}
+        progress_cache().set(self.progress_key, progress, settings.JOB_STALE_TIMEOUT * 2)
+
+    def get_progress(self):
+        """
+        执行过程中的进度，任务没有在执行或者 worker 已经退出时返回 None
+        """
+        if self.status != self.RUNNING:
+            return None
+        return progress_cache().get(self.progress_key)
+
+    def update_progress(self, stage, processed):
+        """
+        保存进度，阶段变化或距离上次保存超过 PROGRESS_INTERVAL 秒时才写入缓存
+        """
+        now = time.monotonic()
+        if stage == self.stage and now - getattr(self, '_progress_saved_at', 0) < self.PROGRESS_INTERVAL:
+            return
+        self._progress_saved_at = now
+        self.stage = stage
+        self.processed = processed
+        self._save_progress()
+
+    def _cleanup(self):
+        # 上传的文件只在执行时使用，任务结束后删除
+        if self.file:
+            self.file.delete(save=False)
+        progress_cache().delete(self.progress_key)
+
+    def finish(self, status, message='', errors=None, processed=None, rows_per_second=0):
+        """
+        保存任务的结果，只修改仍然处于执行中的任务。任务已经被 fail_stale 标记为失败时不覆盖，
+        删除这次生成的导出文件，返回是否保存成功
+        """
+        self._cleanup()
+        fields = {
+            'status': status,
+            'message': message[:255],
+            'errors': (errors or [])[:self.MAX_ERRORS],
+            'stage': self.stage,
+            'processed': self.processed if processed is None else processed,
+            'rows_per_second': rows_per_second,
+            'finished_at': timezone.now(),
+            'file': '',
+            'result_file': self.result_file.name or '',
+        }
+        updated = Job.objects.filter(pk=self.pk, status=self.RUNNING).update(**fields)
+        if not updated:
+            if self.result_file:
+                self.result_file.delete(save=False)
+            self.refresh_from_db()
+            return False
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+
+    @classmethod
+    def fail_stale(cls):
+        """
+        worker 异常退出时任务会一直处于执行中，将心跳超过 JOB_STALE_TIMEOUT 秒没有更新的任务标记为失败，
+        返回标记的任务数量。导入在一个事务中执行，worker 退出时已经回滚，可以重新提交
+        """
+        now = time.time()
+        failed = 0
+        for job in cls.objects.filter(status=cls.RUNNING):
+            progress = progress_cache().get(job.progress_key)
+            heartbeat = progress['heartbeat'] if progress else job.started_at.timestamp()
+            if now - heartbeat <= settings.JOB_STALE_TIMEOUT:
+                continue
+            # 只修改仍然处于执行中的任务，避免覆盖刚刚完成的结果
+            updated = cls.objects.filter(pk=job.pk, status=cls.RUNNING).update(
+                status=cls.FAILED, message='任务执行中断，请重新提交', finished_at=timezone.now(),
+                stage=progress['stage'] if progress else job.stage,
+                processed=progress['processed'] if progress else job.processed,
+            )
+            if updated:
+                job._cleanup()
+                cls.objects.filter(pk=job.pk).update(file='')
+                failed += 1
+        return failed
+
+    @classmethod
+    def purge_results(cls):
+        """
+        删除结束超过 JOB_RESULT_DAYS 天的任务的导出文件，返回删除的文件数量
+        """
+        before = timezone.now() - datetime.timedelta(days=settings.JOB_RESULT_DAYS)
+        jobs = cls.objects.filter(finished_at__lt=before).exclude(result_file='')
+        count = 0
+        for job in jobs:
+            job.result_file.delete(save=False)
+            cls.objects.filter(pk=job.pk).update(result_file='')
+            count += 1
+        return count
+
+    def to_dict(self):
+        progress = self.get_progress() or {}
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': progress.get('stage', self.stage),
+            'processed': progress.get('processed', self.processed),
+            'rows_per_second': self.rows_per_second,
+            'message': self.message,
+            'errors': self.errors,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'download': bool(self.result_file),
+        }
+
+    class Meta:
+        db_table = 'job'
+        verbose_name = '后台任务'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,170 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from students.importer import STUDENT_HEADER
+from students.models import Student
+from .handlers import run_job
+from .models import Job
+
+LOCMEM = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+
+# Create your tests here.
+@override_settings(CACHES={'default': LOCMEM, 'sessions': {**LOCMEM, 'LOCATION': 'sessions'},
+                           'jobs': {**LOCMEM, 'LOCATION': 'jobs'}},
+                   JOB_STALE_TIMEOUT=60, JOB_RESULT_DAYS=7)
+class JobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = self.settings(MEDIA_ROOT=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        caches['jobs'].clear()
+        grade_cache.invalidate()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.admin = User.objects.create_superuser('admin', password='admin')
+
+    def upload(self, rows, header=STUDENT_HEADER):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(header)
+        for row in rows:
+            workbook.active.append(row)
+        output = io.BytesIO()
+        workbook.save(output)
+        return SimpleUploadedFile('students.xlsx', output.getvalue())
+
+    def rows(self, count):
+        return [['一班', f'学生{i}', f'{20000000 + i}', '男', datetime.datetime(2010, 1, 1), '1', 'a']
+                for i in range(count)]
+
+    def run_jobs(self):
+        # 测试在事务中执行，close_old_connections 会关闭测试使用的连接
+        with mock.patch('jobs.management.commands.run_jobs.close_old_connections'):
+            call_command('run_jobs', '--once', stdout=io.StringIO())
+
+    def enqueue_import(self, rows):
+        return Job.enqueue(Job.STUDENT_IMPORT, self.admin, file=self.upload(rows))
+
+    def test_claim_succeeds_once(self):
+        job = self.enqueue_import(self.rows(1))
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertTrue(os.path.exists(job.file.path))
+        other = Job.objects.get(pk=job.pk)
+        self.assertTrue(job.claim())
+        self.assertFalse(other.claim())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+    def test_run_jobs_imports_and_removes_the_upload(self):
+        job = self.enqueue_import(self.rows(5))
+        path = job.file.path
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.stage), (Job.SUCCESS, 5, 'save'))
+        self.assertEqual(Student.objects.count(), 5)
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(caches['jobs'].get(job.progress_key))
+
+    def test_failed_import_keeps_errors(self):
+        rows = self.rows(3)
+        rows[2][0] = '二班'
+        job = self.enqueue_import(rows)
+        job.claim()
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.errors, ['第4行：班级 二班 不存在'])
+        self.assertFalse(job.file)
+        self.assertEqual(Student.objects.count(), 0)
+
+    def test_progress_is_visible_before_the_import_commits(self):
+        job = self.enqueue_import(self.rows(5))
+        job.claim()
+        seen = []
+
+        def update_progress(stage, processed):
+            Job.update_progress(job, stage, processed)
+            # 模拟另一个进程查询任务状态：数据库中的进度没有变化，进度从缓存中读取
+            other = Job.objects.get(pk=job.pk)
+            seen.append((other.stage, other.to_dict()['stage'], other.to_dict()['processed']))
+
+        job.update_progress = update_progress
+        run_job(job)
+        self.assertEqual(job.status, Job.SUCCESS)
+        self.assertIn(('', 'save', 5), seen)
+
+    def test_stale_running_jobs_are_failed(self):
+        stale = self.enqueue_import(self.rows(1))
+        stale.claim()
+        stale.update_progress('validate', 1)
+        alive = self.enqueue_import(self.rows(1))
+        alive.claim()
+        # worker 异常退出后心跳不再更新
+        progress = caches['jobs'].get(stale.progress_key)
+        caches['jobs'].set(stale.progress_key, {**progress, 'heartbeat': time.time() - 120})
+        # 缓存中的心跳已经过期时按开始时间判断
+        lost = self.enqueue_import(self.rows(1))
+        lost.claim()
+        Job.objects.filter(pk=lost.pk).update(started_at=timezone.now() - datetime.timedelta(minutes=5))
+        caches['jobs'].delete(lost.progress_key)
+
+        self.assertEqual(Job.fail_stale(), 2)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.stage, stale.processed), (Job.FAILED, 'validate', 1))
+        self.assertFalse(stale.file)
+        self.assertEqual(Job.objects.get(pk=lost.pk).status, Job.FAILED)
+        self.assertEqual(Job.objects.get(pk=alive.pk).status, Job.RUNNING)
+
+    def test_slow_worker_does_not_overwrite_a_failed_job(self):
+        job = self.enqueue_import(self.rows(2))
+        job.claim()
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - datetime.timedelta(minutes=5))
+        caches['jobs'].delete(job.progress_key)
+        self.assertEqual(Job.fail_stale(), 1)
+        # worker 在被标记为失败后才执行完成
+        self.assertFalse(job.finish(Job.SUCCESS, '执行成功', processed=2))
+        self.assertEqual((job.status, job.message), (Job.FAILED, '任务执行中断，请重新提交'))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+
+    def test_export_result_is_downloaded_and_purged(self):
+        user = User.objects.create_user('20000000')
+        Student.objects.create(student_number='20000000', student_name='学生', gender='M',
+                               birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                               grade=self.grade)
+        job = Job.enqueue(Job.STUDENT_EXPORT, self.admin, params={'grade': self.grade.pk, 'format': 'csv'})
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (Job.SUCCESS, 1))
+        self.assertGreater(job.rows_per_second, 0)
+
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.pk])).json()['job']['download'], True)
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        self.assertIn('学生', b''.join(response.streaming_content).decode('utf-8-sig'))
+
+        path = job.result_file.path
+        self.assertEqual(Job.purge_results(), 0)
+        Job.objects.filter(pk=job.pk).update(finished_at=timezone.now() - datetime.timedelta(days=8))
+        self.assertEqual(Job.purge_results(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.client.get(reverse('job_download', args=[job.pk])).status_code, 404)
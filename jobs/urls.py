@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import job_status, job_download
+
+urlpatterns = [
+    path('<int:pk>/', job_status, name='job_status'),
+    path('<int:pk>/download/', job_download, name='job_download'),
+]
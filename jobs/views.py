@@ -0,0 +1,30 @@
+from django.http import JsonResponse, FileResponse
+from django.shortcuts import get_object_or_404
+
+from utils.premissions import role_required
+from .models import Job
+
+
+def _get_job(request, pk):
+    # 只能查看自己创建的任务，超级管理员可以查看全部
+    jobs = Job.objects.all()
+    if not request.user.is_superuser:
+        jobs = jobs.filter(created_by=request.user)
+    return get_object_or_404(jobs, pk=pk)
+
+
+@role_required('admin', 'teacher')
+def job_status(request, pk):
+    job = _get_job(request, pk)
+    return JsonResponse({'status': 'success', 'job': job.to_dict()})
+
+
+@role_required('admin', 'teacher')
+def job_download(request, pk):
+    job = _get_job(request, pk)
+    if job.status != Job.SUCCESS or not job.result_file:
+        return JsonResponse({
+            'status': 'error',
+            'message': '导出文件不存在'
+        }, status=404)
+    return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=job.result_file.name.split('/')[-1])
@@ -0,0 +1,263 @@
+import atexit
+import glob
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不合并已退出进程的文件
+    fcntl = None
+
+# 指标的类型、说明和直方图的分桶上限
+DEFINITIONS = {
+    'http_request_duration_seconds': ('histogram', '请求耗时（秒），按视图和状态码统计',
+                                      (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'http_request_queries': ('histogram', '每个请求执行的 SQL 查询次数，按视图统计',
+                             (1, 2, 5, 10, 20, 50, 100, 200)),
+    'import_rows_total': ('counter', '导入的行数', None),
+    'import_seconds_total': ('counter', '导入花费的时间（秒）', None),
+    'import_rows_per_second': ('histogram', '每次导入每秒处理的行数',
+                               (10, 50, 100, 500, 1000, 5000, 10000, 50000)),
+    'export_bytes_total': ('counter', '导出文件的字节数', None),
+    'export_duration_seconds': ('histogram', '每次导出花费的时间（秒）',
+                                (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)),
+    'login_attempts_total': ('counter', '登录次数，按角色和结果（success、failure、throttled）统计', None),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+
+def _add(total, value):
+    if isinstance(value, list):
+        return [a + b for a, b in zip(total or [0] * len(value), value)]
+    return (total or 0) + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OverflowError):
+        # 进程存在但属于其它用户
+        return True
+    return True
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+'''
+多进程共享的指标存储
+每个进程在内存中累加自己的计数，最多每隔 METRICS_FLUSH_INTERVAL 秒写入 METRICS_DIR 下以 "进程号-启动时间" 命名的文件，
+进程号被新的进程重新使用时也不会覆盖已退出进程的文件。读取指标时合并目录下所有文件，
+并且最多每隔 METRICS_ARCHIVE_INTERVAL 秒把已经退出的进程的文件累加到 archive.json 中后删除，
+计数不会因为 worker 重启而减少，文件数量也不会随重启次数增长；
+空闲的进程在下一次更新或退出时才会写入最后一秒内的变化
+'''
+class MetricsStore:
+    ARCHIVE = 'archive.json'
+    LOCK = 'archive.lock'
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._archived_at = 0
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # 计数器为数值，直方图为 [各分桶的计数..., 总和, 次数]
+        self._values = {}
+        self._pid = os.getpid()
+        self._id = f'{self._pid}-{time.time_ns()}'
+        self._flushed_at = 0
+        self._dirty = False
+
+    @property
+    def directory(self):
+        return self._directory or getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'cache', 'metrics'))
+
+    def _check_fork(self):
+        # gunicorn 等在加载应用后 fork 出 worker，子进程从空的计数开始，写入自己的文件
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def inc(self, name, labels=None, value=1):
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+        self.flush(force=False)
+
+    def observe(self, name, value, labels=None):
+        buckets = DEFINITIONS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            histogram = self._values.setdefault(key, [0] * len(buckets) + [0, 0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+            self._dirty = True
+        self.flush(force=False)
+
+    def flush(self, force=True):
+        """
+        将当前进程的计数写入文件，先写临时文件再替换，读取时不会读到写了一半的文件
+        """
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)
+        with self._lock:
+            self._check_fork()
+            now = time.monotonic()
+            if not self._dirty or (not force and now - self._flushed_at < interval):
+                return
+            data = [[name, dict(labels), value] for (name, labels), value in self._values.items()]
+            self._flushed_at = now
+            self._dirty = False
+        self._write(f'{self._id}.json', data)
+
+    def _write(self, filename, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(path, os.path.join(self.directory, filename))
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _archive_lock(self, operation):
+        # 合并文件时加排它锁，读取时加共享锁，读取时不会在合并的中途重复或遗漏计数
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.LOCK), 'a') as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def archive(self, force=False):
+        """
+        把已经退出的进程的文件累加到 archive.json 中并删除，返回合并的文件数量
+        多个进程同时合并时通过文件锁串行执行，不会重复累加
+        """
+        interval = getattr(settings, 'METRICS_ARCHIVE_INTERVAL', 60)
+        now = time.monotonic()
+        if fcntl is None or (not force and now - self._archived_at < interval):
+            return 0
+        self._archived_at = now
+        with self._archive_lock(fcntl.LOCK_EX):
+            dead = []
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                # 文件名为 "进程号-启动时间.json"，旧版本的文件名只有进程号
+                pid = os.path.basename(path)[:-len('.json')].split('-', 1)[0]
+                if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                    dead.append(path)
+            if not dead:
+                return 0
+            archived = {_key(name, labels): value
+                        for name, labels, value in self._read(os.path.join(self.directory, self.ARCHIVE)) or []}
+            for path in dead:
+                for name, labels, value in self._read(path) or []:
+                    key = _key(name, labels)
+                    archived[key] = _add(archived.get(key), value)
+            self._write(self.ARCHIVE, [[name, dict(labels), value] for (name, labels), value in archived.items()])
+            for path in dead:
+                os.remove(path)
+        return len(dead)
+
+    def collect(self):
+        """
+        合并所有进程和 archive.json 中的计数，返回 {(name, labels): value}
+        """
+        self.flush()
+        self.archive()
+        merged = {}
+        with self._archive_lock(fcntl and fcntl.LOCK_SH):
+            files = [self._read(path) for path in glob.glob(os.path.join(self.directory, '*.json'))]
+        for data in files:
+            for name, labels, value in data or []:
+                if name not in DEFINITIONS:
+                    continue
+                key = _key(name, labels)
+                merged[key] = _add(merged.get(key), value)
+        return merged
+
+    def render(self):
+        """
+        以 Prometheus 文本格式输出所有指标
+        """
+        merged = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in DEFINITIONS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(merged.items()):
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                for bound, count in zip(list(buckets) + [math.inf], value[:-2] + [value[-1]]):
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_value(bound))])} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """
+        清空当前进程的计数并删除所有进程的文件，用于测试
+        """
+        with self._lock:
+            self._reset()
+        self._archived_at = 0
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            os.remove(path)
+
+
+metrics = MetricsStore()
+
+
+def observe_import(kind, count, elapsed):
+    metrics.inc('import_rows_total', {'kind': kind}, count)
+    metrics.inc('import_seconds_total', {'kind': kind}, elapsed)
+    if elapsed:
+        metrics.observe('import_rows_per_second', count / elapsed, {'kind': kind})
+
+
+def observe_export(kind, size, elapsed):
+    metrics.inc('export_bytes_total', {'kind': kind}, size)
+    metrics.observe('export_duration_seconds', elapsed, {'kind': kind})
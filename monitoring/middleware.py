@@ -0,0 +1,94 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .metrics import metrics
+from .stats import get_config, request_stats
+
+logger = logging.getLogger('monitoring.requests')
+
+class QueryCollector:
+    """
+    通过 execute_wrapper 统计每条 SQL 的执行次数和耗时，不依赖 DEBUG
+    相同的 SQL 语句（参数不同也算）重复执行时计为重复查询，N+1 查询会表现为大量重复
+    """
+    def __init__(self):
+        self.statements = Counter()
+        self.time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.statements[sql] += 1
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+
+def view_name(request):
+    """
+    请求对应的视图名称，url 有 name 时为 name（带命名空间），否则为视图函数的路径，没有匹配到 url 时返回 <unresolved>
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name
+
+
+'''
+记录每个请求的视图名称、耗时、SQL 查询次数、SQL 耗时和重复查询次数
+耗时和查询次数总是写入多进程共享的指标，通过 /metrics 输出；
+REQUEST_METRICS 中 enabled 为 True 时，还会在超过阈值时记录警告日志，并按视图保存最近请求的耗时，用于计算 p50/p95/p99。
+流式响应只统计生成响应对象的时间，不包括逐块发送内容的时间
+'''
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.config = get_config()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        collector = QueryCollector()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+        duration = (time.perf_counter() - start) * 1000
+        name = view_name(request)
+        metrics.observe('http_request_duration_seconds', duration / 1000,
+                        {'view': name, 'status': str(response.status_code)})
+        metrics.observe('http_request_queries', collector.count, {'view': name})
+        if self.config['enabled']:
+            sample = {
+                'duration': duration,
+                'queries': collector.count,
+                'sql_time': collector.time * 1000,
+                'duplicates': collector.duplicates,
+            }
+            request_stats.record(name, sample)
+            self.check_thresholds(request, name, response, sample, collector)
+        return response
+
+    def check_thresholds(self, request, name, response, sample, collector):
+        config = self.config
+        if (sample['duration'] <= config['slow_ms'] and sample['queries'] <= config['max_queries']
+                and sample['duplicates'] <= config['max_duplicates']):
+            return
+        # 重复次数最多的语句，便于定位 N+1 查询
+        repeated = [(sql[:200], count) for sql, count in collector.statements.most_common(3) if count > 1]
+        logger.warning(
+            '%s %s view=%s status=%s duration=%.1fms queries=%d sql_time=%.1fms duplicates=%d repeated=%s',
+            request.method, request.path, name, response.status_code, sample['duration'], sample['queries'],
+            sample['sql_time'], sample['duplicates'], repeated,
+        )
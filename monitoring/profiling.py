@@ -0,0 +1,227 @@
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+from .middleware import QueryCollector, view_name
+
+# 默认配置，可以在 settings.PROFILING 中覆盖
+DEFAULTS = {
+    'enabled': True,
+    # 请求中带有该查询参数或请求头时进行性能分析
+    'param': 'profile',
+    'header': 'X-Profile',
+    # 请求头的值等于 secret 时不需要登录也可以触发，secret 为空时只允许 staff 用户触发
+    'secret': '',
+    # 保存在 MEDIA_ROOT 下的目录，只保留最近 keep 个分析结果
+    'dir': 'profiles',
+    'keep': 50,
+    # 列表页面显示的函数数量
+    'top': 20,
+    # SQL 参数中可能包含敏感数据的表，查询这些表时不保存参数
+    'redact_tables': ('django_session',),
+}
+
+
+# 同一个进程中只能有一个 cProfile 在运行（Python 3.12 起同时启用第二个会抛出 ValueError），
+# 多线程部署时同一时间只分析一个请求，其它请求不进行分析
+_profile_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def profile_dir():
+    return os.path.join(settings.MEDIA_ROOT, get_config()['dir'])
+
+
+class QueryLog(QueryCollector):
+    """
+    在统计次数的基础上保存每条 SQL 的参数和耗时
+    只保存 SELECT 语句的参数，INSERT / UPDATE 的参数中可能有密码摘要、会话数据等，
+    查询 redact_tables 中的表（如会话表的 session_key）时也不保存，只记录参数的个数
+    """
+    def __init__(self, redact_tables=()):
+        super().__init__()
+        self.queries = []
+        self.redact = [re.compile(rf'\b{re.escape(table)}\b') for table in redact_tables]
+
+    def format_params(self, sql, params, many):
+        if params is None:
+            return ''
+        if many:
+            return '<已隐藏批量参数>'
+        if not sql.lstrip().upper().startswith('SELECT') or any(table.search(sql) for table in self.redact):
+            return f'<已隐藏 {len(params)} 个参数>'
+        return repr(params)[:1000]
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return super().__call__(execute, sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': self.format_params(sql, params, many),
+                'many': many,
+                'time': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+def top_functions(profiler, limit):
+    """
+    按累计耗时排序的前 limit 个函数
+    """
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'total': round(total * 1000, 3),
+            'cumulative': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative'], reverse=True)
+    return rows[:limit]
+
+
+def save_profile(request, name, response, profiler, query_log, duration):
+    """
+    保存 .prof 文件和包含请求信息、SQL、耗时最多的函数的 .json 文件，返回分析结果的 id
+    """
+    config = get_config()
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    # 以时间开头，按文件名排序即为按时间排序
+    profile_id = f'{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}'
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    info = {
+        'id': profile_id,
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': name,
+        'user': request.user.get_username() if getattr(request, 'user', None) else '',
+        'status': response.status_code,
+        'duration': round(duration * 1000, 3),
+        'query_count': query_log.count,
+        'duplicates': query_log.duplicates,
+        'sql_time': round(query_log.time * 1000, 3),
+        'top': top_functions(profiler, config['top']),
+        'queries': query_log.queries,
+    }
+    path = os.path.join(directory, f'{profile_id}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(info, f, ensure_ascii=False)
+    os.replace(f'{path}.tmp', path)
+    rotate(directory, config['keep'])
+    return profile_id
+
+
+def rotate(directory, keep):
+    # 删除较早的分析结果，只保留最近 keep 个
+    for filename in sorted(list_ids(directory), reverse=True)[keep:]:
+        for ext in ('json', 'prof'):
+            path = os.path.join(directory, f'{filename}.{ext}')
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_ids(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [filename[:-5] for filename in os.listdir(directory) if filename.endswith('.json')]
+
+
+def load_profiles(limit=None):
+    """
+    最近的分析结果，按时间倒序
+    """
+    directory = profile_dir()
+    profiles = []
+    for profile_id in sorted(list_ids(directory), reverse=True)[:limit]:
+        info = load_profile(profile_id)
+        if info:
+            profiles.append(info)
+    return profiles
+
+
+def load_profile(profile_id):
+    # id 只能由时间和十六进制字符组成，避免读取目录以外的文件
+    if not re.fullmatch(r'\d{14}-[0-9a-f]{8}', profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f'{profile_id}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+'''
+按需对单个请求进行性能分析
+staff 用户在请求中带上 ?profile=1（或者请求头 X-Profile），或者请求头 X-Profile 的值等于配置的 secret 时，
+在 cProfile 下执行视图并记录执行的 SQL，结果保存到 MEDIA_ROOT/profiles，响应头 X-Profile-Id 为分析结果的 id。
+在 process_view 中调用视图，类视图（as_view 返回的函数）和函数视图的处理方式相同；
+TemplateResponse 在分析过程中渲染，流式响应只分析生成响应对象的过程
+'''
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.config = get_config()
+        if not self.config['enabled']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def should_profile(self, request):
+        config = self.config
+        header = request.headers.get(config['header'])
+        if header is None and config['param'] not in request.GET:
+            return False
+        if config['secret'] and header and hmac.compare_digest(header.encode(), config['secret'].encode()):
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_active and user.is_staff)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.should_profile(request):
+            return None
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        try:
+            return self.profile_view(request, view_func, view_args, view_kwargs)
+        finally:
+            _profile_lock.release()
+
+    def profile_view(self, request, view_func, view_args, view_kwargs):
+        query_log = QueryLog(self.config['redact_tables'])
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profiler.enable()
+            try:
+                response = view_func(request, *view_args, **view_kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+        profile_id = save_profile(request, view_name(request), response, profiler, query_log, duration)
+        response['X-Profile-Id'] = profile_id
+        return response
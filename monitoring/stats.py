@@ -0,0 +1,82 @@
+import math
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+# 请求统计的默认配置，可以在 settings.REQUEST_METRICS 中覆盖
+DEFAULTS = {
+    # 是否启用，默认不启用
+    'enabled': False,
+    # 超过以下任意一项时记录一条警告日志
+    'slow_ms': 500,
+    'max_queries': 50,
+    'max_duplicates': 5,
+    # 每个视图保留最近多少个请求用于计算百分位数
+    'window': 1000,
+}
+PERCENTILES = (50, 95, 99)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+def nearest_rank(values, p):
+    """
+    已经排好序的 values 的第 p 百分位数（最近秩法）
+    """
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+
+'''
+按视图统计请求的耗时和 SQL 查询次数
+每个视图只保留最近 window 个请求，百分位数按这些请求计算；
+只保存在当前进程的内存中，多进程部署时每个进程各自统计
+'''
+class RequestStats:
+    def __init__(self, window=None):
+        # 为 None 时使用 settings.REQUEST_METRICS 中的 window
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = defaultdict(self._new_window)
+        self._counts = defaultdict(int)
+
+    def _new_window(self):
+        return deque(maxlen=self.window or get_config()['window'])
+
+    def record(self, view_name, sample):
+        """
+        sample 为一个请求的统计结果，包含 duration、queries、sql_time、duplicates
+        """
+        with self._lock:
+            self._samples[view_name].append(sample)
+            self._counts[view_name] += 1
+
+    def summary(self, view_name=None):
+        """
+        返回 {视图名称: 统计结果}，包含请求总数、最近请求的耗时百分位数（毫秒）和平均查询次数
+        """
+        with self._lock:
+            views = {name: list(samples) for name, samples in self._samples.items()
+                     if view_name is None or name == view_name}
+            counts = dict(self._counts)
+        result = {}
+        for name, samples in views.items():
+            durations = sorted(sample['duration'] for sample in samples)
+            result[name] = {
+                'count': counts[name],
+                **{f'p{p}': round(nearest_rank(durations, p), 2) for p in PERCENTILES},
+                'queries': round(sum(sample['queries'] for sample in samples) / len(samples), 1),
+                'sql_time': round(sum(sample['sql_time'] for sample in samples) / len(samples), 2),
+                'duplicates': max(sample['duplicates'] for sample in samples),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+request_stats = RequestStats()
@@ -0,0 +1,298 @@
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import ResolverMatch, resolve, reverse
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from scores.models import Exam, Score
+from students.importer import StudentImporter
+from students.models import Student
+from utils.export import stream_export
+from .metrics import metrics
+from .middleware import RequestMetricsMiddleware, view_name
+from .profiling import QueryLog, _profile_lock, load_profile, load_profiles, profile_dir
+from .stats import DEFAULTS, RequestStats, request_stats
+
+ENABLED = {'enabled': True, 'slow_ms': 1000, 'max_queries': 20, 'max_duplicates': 5, 'window': 100}
+
+
+# Create your tests here.
+@override_settings(REQUEST_METRICS=ENABLED)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        request_stats.reset()
+        self.grades = [Grade.objects.create(grade_name=f'{i}班', grade_number=f'{i:03d}') for i in range(10)]
+
+    def run_middleware(self, view):
+        request = RequestFactory().get('/grades/')
+        return RequestMetricsMiddleware(lambda request: view(request))(request)
+
+    def test_stats_and_logs_are_disabled_by_default(self):
+        def view(request):
+            for grade in self.grades:
+                Grade.objects.get(pk=grade.pk)
+            return HttpResponse()
+
+        with self.settings(REQUEST_METRICS={}), self.assertNoLogs('monitoring.requests', 'WARNING'):
+            self.run_middleware(view)
+        self.assertEqual(request_stats.summary(), {})
+
+    def test_n_plus_one_is_logged(self):
+        def view(request):
+            for grade in self.grades:
+                Grade.objects.get(pk=grade.pk)
+            return HttpResponse()
+
+        with self.assertLogs('monitoring.requests', 'WARNING') as logs:
+            self.run_middleware(view)
+        self.assertIn('queries=10', logs.output[0])
+        self.assertIn('duplicates=9', logs.output[0])
+        stats = request_stats.summary('<unresolved>')['<unresolved>']
+        self.assertEqual((stats['count'], stats['queries'], stats['duplicates']), (1, 10, 9))
+
+    def test_fast_request_is_not_logged(self):
+        def view(request):
+            list(Grade.objects.all())
+            return HttpResponse()
+
+        with self.assertNoLogs('monitoring.requests', 'WARNING'):
+            self.run_middleware(view)
+
+    def test_requests_are_recorded_by_view_name(self):
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('student_list')).status_code, 200)
+        stats = request_stats.summary()['student_list']
+        self.assertEqual(stats['count'], 3)
+        self.assertGreater(stats['queries'], 0)
+        self.assertLessEqual(stats['p50'], stats['p99'])
+
+
+class RequestStatsTests(TestCase):
+    def test_percentiles_use_the_latest_window(self):
+        stats = RequestStats(window=100)
+        for duration in range(1, 201):
+            stats.record('view', {'duration': duration, 'queries': 1, 'sql_time': 0, 'duplicates': 0})
+        summary = stats.summary()['view']
+        self.assertEqual((summary['count'], summary['p50'], summary['p95'], summary['p99']), (200, 150, 195, 199))
+
+    def test_window_comes_from_settings(self):
+        for config, window in (({}, DEFAULTS['window']), ({'window': 2}, 2)):
+            with self.subTest(config=config), self.settings(REQUEST_METRICS=config):
+                stats = RequestStats()
+                for duration in range(5):
+                    stats.record('view', {'duration': duration, 'queries': 1, 'sql_time': 0, 'duplicates': 0})
+                self.assertEqual(len(stats._samples['view']), min(window, 5))
+
+    def test_view_name(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(view_name(request), '<unresolved>')
+        request.resolver_match = resolve(reverse('student_list'))
+        self.assertEqual(view_name(request), 'student_list')
+        request.resolver_match = ResolverMatch(RequestStatsTests, (), {})
+        self.assertEqual(view_name(request), 'monitoring.tests.RequestStatsTests')
+
+
+def dead_pid():
+    # 已经退出的子进程的进程号
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # 不启用 REQUEST_METRICS 时也记录请求耗时和查询次数
+        settings = self.settings(METRICS_DIR=directory, METRICS_TOKEN='token', REQUEST_METRICS={})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory
+        metrics.clear()
+
+    def scrape(self, token='token'):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def write(self, filename, data):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump(data, f)
+
+    def test_counters_are_merged_across_processes(self):
+        # 另一个 worker 进程写入的文件
+        other = [
+            ['login_attempts_total', {'role': 'student', 'result': 'success'}, 2],
+            ['export_duration_seconds', {'kind': 'scores'}, [0, 1, 1, 1, 1, 1, 1, 1, 1, 0.3, 1]],
+        ]
+        self.write(f'{os.getppid()}-1.json', other)
+        metrics.inc('login_attempts_total', {'role': 'student', 'result': 'success'})
+        metrics.observe('export_duration_seconds', 3, {'kind': 'scores'})
+        text = self.scrape().content.decode()
+        self.assertIn('login_attempts_total{result="success",role="student"} 3', text)
+        self.assertIn('export_duration_seconds_bucket{kind="scores",le="0.5"} 1', text)
+        self.assertIn('export_duration_seconds_bucket{kind="scores",le="5"} 2', text)
+        self.assertIn('export_duration_seconds_bucket{kind="scores",le="+Inf"} 2', text)
+        self.assertIn('export_duration_seconds_sum{kind="scores"} 3.3', text)
+        self.assertIn('export_duration_seconds_count{kind="scores"} 2', text)
+
+    def test_requests_logins_and_exports_are_recorded(self):
+        User.objects.create_superuser('admin', password='admin')
+        for password in ('wrong', 'admin'):
+            self.client.post(reverse('user_login'), {'username': 'admin', 'password': password, 'role': 'admin'})
+        response = stream_export(['班级'], [['一班']], 'grades', 'csv')
+        size = len(b''.join(response.streaming_content))
+        self.client.get(reverse('student_list'))
+        grade_cache.invalidate()
+        Grade.objects.create(grade_name='一班', grade_number='001')
+        StudentImporter([['一班', '学生', '20000000', '男', datetime.datetime(2010, 1, 1), '1', 'a']]).run()
+        text = self.scrape().content.decode()
+        # 导入和导出使用相同的 kind
+        self.assertIn('import_rows_total{kind="students"} 1', text)
+        self.assertIn('login_attempts_total{result="failure",role="admin"} 1', text)
+        self.assertIn('login_attempts_total{result="success",role="admin"} 1', text)
+        self.assertIn(f'export_bytes_total{{kind="grades"}} {size}', text)
+        self.assertIn('http_request_duration_seconds_count{status="200",view="student_list"} 1', text)
+        self.assertIn('http_request_queries_count{view="student_list"} 1', text)
+
+    def test_dead_processes_are_archived(self):
+        pid = dead_pid()
+        # 同一个进程号先后被两个进程使用，文件不会互相覆盖
+        self.write(f'{pid}-1.json', [['login_attempts_total', {'role': 'admin', 'result': 'success'}, 2]])
+        self.write(f'{pid}-2.json', [['login_attempts_total', {'role': 'admin', 'result': 'success'}, 3]])
+        self.write(f'{os.getppid()}-1.json', [['login_attempts_total', {'role': 'admin', 'result': 'success'}, 4]])
+        metrics.inc('login_attempts_total', {'role': 'admin', 'result': 'success'})
+        line = 'login_attempts_total{result="success",role="admin"} 10'
+        self.assertIn(line, self.scrape().content.decode())
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['archive.json', 'archive.lock', f'{os.getppid()}-1.json', f'{metrics._id}.json']))
+
+        # 再次合并时累加到已有的 archive.json 中
+        self.write(f'{dead_pid()}-3.json', [['login_attempts_total', {'role': 'admin', 'result': 'success'}, 5]])
+        self.assertEqual(metrics.archive(force=True), 1)
+        self.assertEqual(metrics.archive(force=True), 0)
+        self.assertIn('login_attempts_total{result="success",role="admin"} 15', self.scrape().content.decode())
+
+    def test_token_or_staff_is_required(self):
+        self.assertEqual(self.scrape().status_code, 200)
+        self.assertEqual(self.scrape('wrong').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape('').status_code, 403)
+        self.client.force_login(User.objects.create_user('teacher'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = self.settings(MEDIA_ROOT=directory, PROFILING={'secret': 'secret', 'keep': 3})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        exam = Exam.objects.create(name='期中')
+        for i in range(3):
+            user = User.objects.create_user(f'{20000000 + i}')
+            student = Student.objects.create(user=user, student_number=f'{20000000 + i}', student_name=f'学生{i}', gender='M',
+                                             birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                                             grade=grade)
+            Score.objects.create(exam=exam, student=student, student_number=student.student_number,
+                                 student_name=student.student_name, grade=grade, chinese_score=90, math_score=90,
+                                 english_score=90)
+        self.admin = User.objects.create_superuser('admin', password='admin')
+
+    def login(self, user):
+        self.client.force_login(user)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def test_class_based_view_is_profiled_with_rendering(self):
+        self.login(self.admin)
+        response = self.client.get(reverse('score_list'), {'profile': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '学生0')
+        profile = load_profile(response['X-Profile-Id'])
+        self.assertEqual((profile['view'], profile['status'], profile['user']), ('score_list', 200, 'admin'))
+        self.assertTrue(profile['top'])
+        # 模板渲染在分析过程中完成，渲染时执行的查询也被记录
+        self.assertTrue(any('render' in row['function'] for row in profile['top']))
+        table = connection.ops.quote_name(Score._meta.db_table)
+        self.assertTrue(any(f'FROM {table}' in query['sql'] for query in profile['queries']))
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+
+    def test_write_and_session_params_are_redacted(self):
+        self.login(self.admin)
+        response = self.client.post(reverse('change_password') + '?profile=1', {
+            'old_password': 'admin', 'new_password1': 'Changed-2024', 'new_password2': 'Changed-2024'})
+        self.assertEqual(response.json()['status'], 'success')
+        self.admin.refresh_from_db()
+        with open(os.path.join(profile_dir(), f'{response["X-Profile-Id"]}.json')) as f:
+            content = f.read()
+        self.assertNotIn(self.admin.password, content)
+        self.assertNotIn(self.client.session.session_key, content)
+        queries = load_profile(response['X-Profile-Id'])['queries']
+        update = next(query for query in queries if query['sql'].startswith('UPDATE'))
+        self.assertRegex(update['params'], r'^<已隐藏 \d+ 个参数>$')
+        # 修改密码后更换会话 key，查询会话表的参数中有 session_key
+        sessions = [query for query in queries if query['sql'].startswith('SELECT') and 'django_session' in query['sql']]
+        self.assertTrue(sessions)
+        self.assertTrue(all(query['params'].startswith('<已隐藏') for query in sessions))
+
+    def test_query_log_params(self):
+        log = QueryLog(['django_session'])
+        self.assertEqual(log.format_params('SELECT * FROM "score" WHERE "id" = %s', (1,), False), '(1,)')
+        self.assertEqual(log.format_params('DELETE FROM "score" WHERE "id" = %s', (1,), False), '<已隐藏 1 个参数>')
+        self.assertEqual(log.format_params('SELECT * FROM "django_session" WHERE "session_key" = %s', ('key',), False),
+                         '<已隐藏 1 个参数>')
+        self.assertEqual(log.format_params('INSERT INTO "score" VALUES (%s)', iter([(1,), (2,)]), True), '<已隐藏批量参数>')
+        self.assertEqual(log.format_params('SELECT 1', None, False), '')
+
+    def test_function_view_is_profiled(self):
+        self.login(self.admin)
+        response = self.client.post(reverse('score_import') + '?profile=1')
+        profile = load_profile(response['X-Profile-Id'])
+        self.assertEqual((profile['view'], profile['method']), ('score_import', 'POST'))
+
+    def test_request_is_not_profiled_while_another_profile_is_running(self):
+        self.login(self.admin)
+        with _profile_lock:
+            response = self.client.get(reverse('score_list'), {'profile': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertIn('X-Profile-Id', self.client.get(reverse('score_list'), {'profile': 1}))
+
+    def test_only_staff_or_secret_header_can_profile(self):
+        user = User.objects.create_user('teacher', password='teacher')
+        self.login(user)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('score_list'), {'profile': 1}))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('score_list'), HTTP_X_PROFILE='wrong'))
+        self.assertIn('X-Profile-Id', self.client.get(reverse('score_list'), HTTP_X_PROFILE='secret'))
+        self.login(self.admin)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('score_list')))
+
+    def test_old_profiles_are_rotated_and_listed(self):
+        self.login(self.admin)
+        ids = [self.client.get(reverse('score_list'), {'profile': 1})['X-Profile-Id'] for _ in range(5)]
+        self.assertEqual([profile['id'] for profile in load_profiles()], sorted(ids, reverse=True)[:3])
+        response = self.client.get(reverse('profile_list'))
+        self.assertContains(response, '/scores/?profile=1', count=3)
+        response = self.client.get(reverse('profile_download', args=[sorted(ids)[-1]]))
+        self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(self.client.get(reverse('profile_download', args=[sorted(ids)[0]])).status_code, 404)
@@ -0,0 +1,52 @@
+import os
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from .metrics import metrics
+from .profiling import get_config, load_profile, load_profiles, profile_dir
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def can_scrape(request):
+    """
+    请求头 Authorization: Bearer <METRICS_TOKEN> 正确，或者已登录的 staff 用户才能读取指标。
+    部署在反向代理后面时 REMOTE_ADDR 总是代理的地址，所以不按 IP 判断
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, value = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and constant_time_compare(value.strip(), token):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+
+# 以 Prometheus 文本格式输出所有进程合并后的指标
+def metrics_view(request):
+    if not can_scrape(request):
+        return JsonResponse({'status': 'error', 'message': '没有权限访问'}, status=403)
+    return HttpResponse(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# 最近的性能分析结果及耗时最多的函数
+@staff_member_required
+def profile_list(request):
+    context = {
+        **admin.site.each_context(request),
+        'title': '性能分析',
+        'profiles': load_profiles(get_config()['keep']),
+    }
+    return render(request, 'monitoring/profiles.html', context)
+
+
+# 下载 .prof 文件，可以用 snakeviz 等工具查看
+@staff_member_required
+def profile_download(request, profile_id):
+    if load_profile(profile_id) is None:
+        raise Http404('性能分析结果不存在')
+    path = os.path.join(profile_dir(), f'{profile_id}.prof')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
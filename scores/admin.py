@@ -1,3 +1,9 @@
 from django.contrib import admin
+from .models import Exam
 
 # Register your models here.
+@admin.register(Exam)
+class ExamAdmin(admin.ModelAdmin):
+    list_display = ['name', 'date', 'term']
+    search_fields = ['name']
+    filter_horizontal = ['grades']
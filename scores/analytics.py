@@ -0,0 +1,234 @@
+import hashlib
+import json
+import math
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Case, Count, F, FloatField, IntegerField, Max, Min, StdDev, Value, When
+from django.db.models.functions import Floor
+from django.db.models.lookups import LessThan
+
+from grades.cache import get_catalogue
+from .models import Score
+
+# 参与统计的科目，total 为三科总分
+SUBJECTS = {
+    'chinese_score': F('chinese_score'),
+    'math_score': F('math_score'),
+    'english_score': F('english_score'),
+    'total': F('chinese_score') + F('math_score') + F('english_score'),
+}
+# 总分分段时分数线乘以科目数，即按平均分分段
+SUBJECT_COUNT = 3
+# 默认计算的百分位数，可以在 settings 中通过 SCORE_PERCENTILES 修改
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+
+
+def get_percentiles(value=None):
+    """
+    解析百分位数参数，如 "10,25,75,90"，为空时使用默认值，格式错误时抛出 ValueError
+    """
+    if not value:
+        return tuple(getattr(settings, 'SCORE_PERCENTILES', DEFAULT_PERCENTILES))
+    percentiles = []
+    for item in value.split(','):
+        p = float(item)
+        if not 0 <= p <= 100:
+            raise ValueError(f'percentile {item} is not between 0 and 100')
+        percentiles.append(p)
+    return tuple(percentiles)
+
+
+def percentile(values, p):
+    """
+    计算已经排好序的 values 的第 p 百分位数，使用线性插值（与 numpy 的默认算法相同）
+    """
+    position = (len(values) - 1) * p / 100
+    low = math.floor(position)
+    high = math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _round(value):
+    return None if value is None else round(float(value), 2)
+
+
+def exam_statistics(exam_id, grade_id=None, percentiles=None):
+    """
+    统计一场考试（可以只统计一个班级）各科和总分的人数、平均分、最低分、最高分、标准差、中位数和百分位数
+    人数、平均分、最值和标准差由数据库聚合计算，中位数和百分位数通过一次 values_list 查询取出分数后排序计算，
+    不会创建模型实例，没有成绩时返回 None
+    """
+    percentiles = get_percentiles() if percentiles is None else percentiles
+    scores = Score.objects.filter(exam_id=exam_id)
+    if grade_id is not None:
+        scores = scores.filter(grade_id=grade_id)
+
+    aggregates = {}
+    for name, expression in SUBJECTS.items():
+        aggregates[f'{name}__count'] = Count(expression)
+        aggregates[f'{name}__mean'] = Avg(expression)
+        aggregates[f'{name}__min'] = Min(expression)
+        aggregates[f'{name}__max'] = Max(expression)
+        aggregates[f'{name}__std'] = StdDev(expression)
+    summary = scores.aggregate(**aggregates)
+    if not summary['total__count']:
+        return None
+
+    # 一次取出所有分数，按列拆分后排序
+    rows = scores.values_list('chinese_score', 'math_score', 'english_score')
+    columns = [list(map(float, column)) for column in zip(*rows)]
+    # 总分在排序前按行相加
+    columns.append(list(map(sum, zip(*columns))))
+
+    statistics = {}
+    for name, values in zip(SUBJECTS, columns):
+        values.sort()
+        statistics[name] = {
+            'count': summary[f'{name}__count'],
+            'mean': _round(summary[f'{name}__mean']),
+            'min': _round(summary[f'{name}__min']),
+            'max': _round(summary[f'{name}__max']),
+            'std': _round(summary[f'{name}__std']),
+            'median': _round(percentile(values, 50)),
+            'percentiles': {f'{p:g}': _round(percentile(values, p)) for p in percentiles},
+        }
+    return statistics
+
+
+# 默认的分段方式，可以在 settings 中通过 SCORE_BANDS 修改
+DEFAULT_BANDS = {'width': 10}
+
+
+def get_bands(width=None, thresholds=None, labels=None):
+    """
+    解析分段参数，width 为每段的分数（如 10），thresholds 为分数线（如 "60,80,90"），labels 为各段名称（如 "不及格,及格,良好,优秀"），
+    都为空时使用默认值，格式错误时抛出 ValueError
+    """
+    if thresholds:
+        values = [float(item) for item in thresholds.split(',')]
+        if values != sorted(set(values)):
+            raise ValueError('thresholds must be strictly increasing')
+        bands = {'thresholds': values}
+        if labels:
+            names = labels.split(',')
+            if len(names) != len(values) + 1:
+                raise ValueError('labels must have one more item than thresholds')
+            bands['labels'] = names
+        return bands
+    if width:
+        value = float(width)
+        if not value > 0:
+            raise ValueError('width must be positive')
+        return {'width': value}
+    return dict(getattr(settings, 'SCORE_BANDS', DEFAULT_BANDS))
+
+
+def _bucket(expression, bands, scale):
+    """
+    返回分数所在分段序号的表达式，按固定分数分段时为 floor(分数 / width)，按分数线分段时为 CASE WHEN
+    """
+    if 'width' in bands:
+        return Floor(expression / Value(bands['width'] * scale), output_field=FloatField())
+    return Case(
+        *[When(LessThan(expression, threshold * scale), then=Value(index))
+          for index, threshold in enumerate(bands['thresholds'])],
+        default=Value(len(bands['thresholds'])),
+        output_field=IntegerField(),
+    )
+
+
+def _band_labels(bands, scale, buckets):
+    """
+    返回各分段的名称和分数范围
+    """
+    if 'width' in bands:
+        width = bands['width'] * scale
+        return [{'label': f'{index * width:g}-{(index + 1) * width:g}', 'lower': index * width, 'upper': (index + 1) * width}
+                for index in buckets]
+    edges = [None] + [threshold * scale for threshold in bands['thresholds']] + [None]
+    labels = bands.get('labels')
+    result = []
+    for index in buckets:
+        lower, upper = edges[index], edges[index + 1]
+        if labels:
+            label = labels[index]
+        elif lower is None:
+            label = f'<{upper:g}'
+        elif upper is None:
+            label = f'>={lower:g}'
+        else:
+            label = f'{lower:g}-{upper:g}'
+        result.append({'label': label, 'lower': lower, 'upper': upper})
+    return result
+
+
+def _report_version_key(exam_id):
+    return f'scores:report:version:{exam_id}'
+
+
+def invalidate_reports(*exam_ids):
+    """
+    考试成绩变化后调用，这场考试已经缓存的分段报表全部失效
+    """
+    cache.delete_many([_report_version_key(exam_id) for exam_id in exam_ids])
+
+
+def band_report(exam_id, grade_id=None, bands=None):
+    """
+    统计一场考试（可以只统计一个班级）各科和总分在每个分数段、每个班级的人数，总分按 SUBJECT_COUNT 倍的分数线分段。
+    所有科目通过 UNION ALL 合并成一次分组查询，结果按 (考试, 班级, 分段方式) 缓存，
+    考试成绩变化时通过 invalidate_reports 让缓存失效，没有成绩时返回 None
+    """
+    bands = get_bands() if bands is None else bands
+    timeout = getattr(settings, 'SCORE_REPORT_CACHE_TIMEOUT', 3600)
+    # 缓存键中包含考试的版本号，版本号被删除后旧的缓存不会再被使用
+    version = cache.get_or_set(_report_version_key(exam_id), uuid.uuid4().hex, timeout)
+    config = hashlib.md5(json.dumps([exam_id, grade_id, bands], sort_keys=True).encode('utf-8')).hexdigest()
+    key = f'scores:report:{version}:{config}'
+    report = cache.get(key)
+    if report is None:
+        report = _band_report(exam_id, grade_id, bands)
+        cache.set(key, report, timeout)
+    return report or None
+
+
+def _band_report(exam_id, grade_id, bands):
+    scores = Score.objects.filter(exam_id=exam_id)
+    if grade_id is not None:
+        scores = scores.filter(grade_id=grade_id)
+    queries = [
+        scores.order_by().annotate(
+            subject=Value(name), bucket=_bucket(expression, bands, SUBJECT_COUNT if name == 'total' else 1)
+        ).values('subject', 'grade_id', 'bucket').annotate(count=Count('id'))
+        for name, expression in SUBJECTS.items()
+    ]
+    rows = list(queries[0].union(*queries[1:], all=True))
+    if not rows:
+        # 空结果也缓存，避免反复查询没有成绩的考试
+        return {}
+
+    grade_names = {grade_id: grade_name for grade_id, grade_name, _ in get_catalogue()}
+    counts = {name: {} for name in SUBJECTS}
+    for row in rows:
+        counts[row['subject']][(row['grade_id'], int(row['bucket']))] = row['count']
+
+    report = {}
+    for name, subject_counts in counts.items():
+        if 'width' in bands:
+            # 只返回最低分到最高分之间的分段
+            indexes = [bucket for _, bucket in subject_counts]
+            buckets = list(range(min(indexes), max(indexes) + 1))
+        else:
+            buckets = list(range(len(bands['thresholds']) + 1))
+        grades = {}
+        for (row_grade_id, bucket), count in subject_counts.items():
+            grade_counts = grades.setdefault(grade_names.get(row_grade_id, str(row_grade_id)), [0] * len(buckets))
+            grade_counts[bucket - buckets[0]] += count
+        report[name] = {
+            'bands': _band_labels(bands, SUBJECT_COUNT if name == 'total' else 1, buckets),
+            'grades': grades,
+            'all': [sum(values) for values in zip(*grades.values())],
+        }
+    return report
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ScoresConfig(AppConfig):
     name = 'scores'
+
+    def ready(self):
+        # 注册信号
+        from . import signals
@@ -0,0 +1,23 @@
+from django.db import transaction
+
+from utils.deletion import delete_in
+from .analytics import invalidate_reports
+from .models import Score
+from .ranking import ranking, TOTAL
+
+
+def delete_scores(scores):
+    """
+    批量删除成绩，返回删除的数量
+    先用一次查询取出 id 和排名需要的考试、班级、总分，再按 id 分批 DELETE，
+    事务提交后一起更新排名并让分段报表缓存失效，不会逐条发送删除信号
+    """
+    rows = list(scores.order_by().annotate(total=TOTAL).values_list('id', 'exam_id', 'grade_id', 'total'))
+    if not rows:
+        return 0
+    removed = [(exam_id, grade_id, float(total)) for _, exam_id, grade_id, total in rows]
+    with transaction.atomic():
+        deleted = delete_in(Score, [row[0] for row in rows])
+        transaction.on_commit(lambda: ranking.apply(removed=removed))
+        transaction.on_commit(lambda: invalidate_reports(*{exam_id for exam_id, _, _ in removed}))
+    return deleted
@@ -0,0 +1,12 @@
+from utils.export import EXPORT_CHUNK_SIZE
+from .importer import SCORE_HEADER
+
+
+def export_rows(scores):
+    """
+    生成导出的数据行，只查询需要导出的字段，并通过 join 获取考试和班级名称，分批从数据库中读取
+    scores 可以通过 grade_id、exam_id 或 student_id 过滤，都是整数外键上的索引查询
+    """
+    return scores.values_list(
+        'exam__name', 'student_name', 'grade__grade_name', 'student_number', 'chinese_score', 'math_score', 'english_score'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
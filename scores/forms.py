@@ -3,15 +3,18 @@ from django.core.exceptions import ValidationError
 import datetime
 
 from students.models import Student
+from students.roster import roster
 from .models import Score
-from grades.models import Grade
+from grades.cache import use_cached_grades
 
 class ScoreForm(forms.ModelForm):
     # 重写父类方法，对象属性grade进行排序
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['grade'].queryset = Grade.objects.all().order_by('grade_number')
+        # 班级选项从缓存中读取
+        use_cached_grades(self.fields['grade'])
         self.fields['grade'].empty_label = '请选择班级'
+        self.fields['exam'].empty_label = '请选择考试'
 
     # 验证学生姓名,方法名格式固定的，为 clean_+字段名
     def clean_student_name(self):
@@ -19,8 +22,6 @@ class ScoreForm(forms.ModelForm):
         # 只是简单的验证一下长度
         if len(student_name) < 2 or len(student_name) > 20:
             raise ValidationError('请填写正确的学生姓名')
-        if not Student.objects.filter(student_name=student_name).exists():
-            raise ValidationError('该学生姓名不存在')
         return student_name
 
     # 验证学号,方法名格式固定的，为 clean_+字段名
@@ -29,7 +30,8 @@ class ScoreForm(forms.ModelForm):
         # 同样的也是验证一下长度
         if len(student_number) != 8:
             raise ValidationError('学号长度必须为8位数字')
-        if not Student.objects.filter(student_number=student_number).exists():
+        # 先从花名册索引中查找，没有命中时再查询数据库
+        if roster.get(student_number) is None and not Student.objects.filter(student_number=student_number).exists():
             raise ValidationError('该学号不存在')
         return student_number
 
@@ -39,15 +41,23 @@ class ScoreForm(forms.ModelForm):
         student_name = cleaned_data.get('student_name')
         student_number = cleaned_data.get('student_number')
         grade = cleaned_data.get('grade')
+        exam = cleaned_data.get('exam')
+        # 考试指定了参加的班级时，班级必须在其中
+        if exam and grade:
+            scope = set(exam.grades.values_list('pk', flat=True))
+            if scope and grade.pk not in scope:
+                raise ValidationError('该班级没有参加这场考试')
         if student_name and student_number and grade:
-            try:
-                student = Student.objects.get(student_name=student_name, student_number=student_number, grade=grade)
-                cleaned_data['student'] = student
-            except Student.DoesNotExist:
+            # 通过花名册索引校验，姓名、学号、班级都匹配时返回学生 id
+            student_id = roster.resolve(student_number, student_name, grade.pk)
+            if student_id is None:
                 raise ValidationError('该学生信息不存在')
+            cleaned_data['student_id'] = student_id
+            # student 不在表单字段中，直接设置到实例上，保存时一起写入
+            self.instance.student_id = student_id
         return cleaned_data
 
 
     class Meta:
         model = Score
-        fields = ['title', 'student_name', 'student_number', 'grade', 'chinese_score', 'math_score', 'english_score']
+        fields = ['exam', 'student_name', 'student_number', 'grade', 'chinese_score', 'math_score', 'english_score']
@@ -0,0 +1,222 @@
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from grades.cache import get_grade_ids
+from monitoring.metrics import observe_import
+from students.roster import roster
+from .models import Exam, Score
+from .ranking import ranking, total_of
+from .analytics import invalidate_reports
+
+# Excel 标题行，导入和导出共用
+SCORE_HEADER = ['考试名称', '姓名', '班级', '学号', '语文', '数学', '英语']
+# 每次 bulk_create 写入的行数
+BATCH_SIZE = 1000
+# 返回给前端的最多错误条数
+MAX_ERRORS = 20
+# 成绩字段为 max_digits=5, decimal_places=2
+MAX_SCORE = Decimal('999.99')
+# 考试名称的最大长度，与 Exam.name 一致
+EXAM_NAME_LENGTH = 20
+# 重复导入时需要比较和更新的字段
+UPDATE_FIELDS = ['student_id', 'student_name', 'grade_id', 'chinese_score', 'math_score', 'english_score']
+
+
+class ScoreImportError(Exception):
+    """
+    导入数据校验失败，errors 中保存所有出错行的信息
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('；'.join(errors[:MAX_ERRORS]))
+
+
+def to_score(value):
+    """
+    转换成绩，格式错误或超出范围时返回 None
+    """
+    try:
+        score = Decimal(str(value)).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    if score < 0 or score > MAX_SCORE:
+        return None
+    return score
+
+
+'''
+批量导入学生成绩
+先在内存中校验整张表并收集所有错误，学生信息通过花名册索引一次性校验，
+全部通过后在一个事务中分批写入 score 表，以考试和学号为键，新成绩 bulk_create，有变化的成绩 bulk_update，
+表中的考试名称不存在时自动创建考试
+'''
+class ScoreImporter:
+    def __init__(self, rows, batch_size=BATCH_SIZE, on_progress=None):
+        # rows 为不含标题行的数据行
+        self.rows = rows
+        self.batch_size = batch_size
+        # 进度回调，参数为当前阶段（validate 或 save）和该阶段已经处理的行数
+        self.on_progress = on_progress
+        # 校验通过后待写入的成绩数据
+        self.scores = []
+        # 考试名称 -> 考试 id
+        self.exams = {}
+
+    # 校验整张表，出错时抛出 ScoreImportError
+    def validate(self):
+        # 班级从缓存中读取
+        grades = get_grade_ids()
+        # [(行号, 错误信息)]
+        errors = []
+        # [(行号, 班级名称, 成绩数据)]
+        parsed = []
+        # 因为第一行是标题行，所以数据从第二行开始
+        for line, row in enumerate(self.rows, start=2):
+            if self.on_progress and (line - 1) % self.batch_size == 0:
+                self.on_progress('validate', line - 1)
+            # 跳过空行
+            if not any(row):
+                continue
+            title, student_name, grade, student_number, chinese_score, math_score, english_score = (list(row) + [None] * 7)[:7]
+            student_number = str(student_number) if student_number is not None else ''
+            # 检测主要字段
+            title = str(title).strip() if title is not None else ''
+            if not title:
+                errors.append((line, '考试名称不能为空'))
+                continue
+            if len(title) > EXAM_NAME_LENGTH:
+                errors.append((line, f'考试名称不能超过{EXAM_NAME_LENGTH}个字'))
+                continue
+            if not student_name:
+                errors.append((line, '学生姓名不能为空'))
+                continue
+            if len(student_number) != 8:
+                errors.append((line, '学号不能为空，且长度必须为8位'))
+                continue
+            if not grade:
+                errors.append((line, '班级不能为空'))
+                continue
+            grade_id = grades.get(grade)
+            if not grade_id:
+                errors.append((line, f'班级 {grade} 不存在'))
+                continue
+            values = [to_score(value) for value in (chinese_score, math_score, english_score)]
+            if None in values:
+                errors.append((line, f'成绩必须为 0 - {MAX_SCORE} 之间的数字'))
+                continue
+            parsed.append((line, grade, {
+                'title': title,
+                'student_name': student_name,
+                'student_number': student_number,
+                'grade_id': grade_id,
+                'chinese_score': values[0],
+                'math_score': values[1],
+                'english_score': values[2],
+            }))
+
+        # 一次查询出表中已经存在的考试和参加考试的班级
+        titles = {item['title'] for _, _, item in parsed}
+        self.exams = dict(Exam.objects.filter(name__in=titles).values_list('name', 'id'))
+        scopes = {}
+        for exam_id, grade_id in Exam.grades.through.objects.filter(exam_id__in=self.exams.values()).values_list(
+                'exam_id', 'grade_id'):
+            scopes.setdefault(exam_id, set()).add(grade_id)
+        # 一次性校验所有学生的姓名、学号、班级是否匹配
+        students = roster.resolve_many(
+            (item['student_number'], item['student_name'], item['grade_id']) for _, _, item in parsed
+        )
+        self.scores = []
+        # 同一场考试同一个学生在表格中只能出现一次
+        keys = {}
+        for line, grade, item in parsed:
+            student_id = students.get((item['student_number'], item['student_name'], item['grade_id']))
+            if student_id is None:
+                errors.append((line, f'班级为 {grade}, 学号为 {item["student_number"]} 的学生 {item["student_name"]} 不存在'))
+                continue
+            item['student_id'] = student_id
+            scope = scopes.get(self.exams.get(item['title']))
+            if scope and item['grade_id'] not in scope:
+                errors.append((line, f'班级 {grade} 没有参加考试 {item["title"]}'))
+                continue
+            key = (item['title'], item['student_number'])
+            if key in keys:
+                errors.append((line, f'与第{keys[key]}行重复，考试 {item["title"]} 中学号 {item["student_number"]} 的成绩只能填写一次'))
+                continue
+            keys[key] = line
+            self.scores.append(item)
+        if errors:
+            raise ScoreImportError([f'第{line}行：{message}' for line, message in sorted(errors)])
+        return self.scores
+
+    # 写入数据库，已经存在的成绩（考试和学号相同）有变化时更新，没有变化时跳过，返回处理的成绩数量
+    def save(self):
+        self.created = self.updated = self.unchanged = 0
+        # 排名的变化，事务提交后一起更新
+        self.ranking_added = []
+        self.ranking_removed = []
+        with transaction.atomic():
+            self._create_exams()
+            for start in range(0, len(self.scores), self.batch_size):
+                batch = self.scores[start:start + self.batch_size]
+                self._save_batch(batch)
+                if self.on_progress:
+                    self.on_progress('save', start + len(batch))
+            transaction.on_commit(lambda: ranking.apply(self.ranking_added, self.ranking_removed))
+            transaction.on_commit(lambda: invalidate_reports(*{exam_id for exam_id, _, _ in self.ranking_added}))
+        return len(self.scores)
+
+    # 创建表中新出现的考试，并把考试名称替换为考试 id
+    def _create_exams(self):
+        names = {item['title'] for item in self.scores} - self.exams.keys()
+        if names:
+            Exam.objects.bulk_create([Exam(name=name) for name in names])
+            # MySQL 的 bulk_create 不会返回主键，重新查询一次
+            self.exams.update(Exam.objects.filter(name__in=names).values_list('name', 'id'))
+        for item in self.scores:
+            item['exam_id'] = self.exams[item.pop('title')]
+
+    def _save_batch(self, batch):
+        # 一次查询出这一批中已经存在的成绩
+        existing = Score.objects.filter(
+            exam_id__in={item['exam_id'] for item in batch},
+            student_number__in={item['student_number'] for item in batch},
+        ).only('id', 'exam_id', 'student_number', *UPDATE_FIELDS)
+        existing = {(score.exam_id, score.student_number): score for score in existing}
+        to_create = []
+        to_update = []
+        for item in batch:
+            score = existing.get((item['exam_id'], item['student_number']))
+            if score is None:
+                score = Score(**item)
+                to_create.append(score)
+            elif any(getattr(score, field) != item[field] for field in UPDATE_FIELDS):
+                self.ranking_removed.append((score.exam_id, score.grade_id, total_of(score)))
+                for field in UPDATE_FIELDS:
+                    setattr(score, field, item[field])
+                to_update.append(score)
+            else:
+                self.unchanged += 1
+                continue
+            self.ranking_added.append((score.exam_id, score.grade_id, total_of(score)))
+        Score.objects.bulk_create(to_create)
+        Score.objects.bulk_update(to_update, UPDATE_FIELDS)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+    # 校验并写入，返回导入结果
+    def run(self):
+        start = time.perf_counter()
+        self.validate()
+        count = self.save()
+        elapsed = time.perf_counter() - start
+        observe_import('scores', count, elapsed)
+        return {
+            'count': count,
+            'elapsed': round(elapsed, 3),
+            'rows_per_second': round(count / elapsed, 1) if elapsed else count,
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+        }
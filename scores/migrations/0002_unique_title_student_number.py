@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:10
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_scores(apps, schema_editor):
+    """
+    同一场考试同一个学生有多条成绩时，只保留最后导入（id 最大）的一条
+    """
+    Score = apps.get_model('scores', 'Score')
+    duplicates = list(
+        Score.objects.values('title', 'student_number')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for item in duplicates:
+        Score.objects.filter(
+            title=item['title'], student_number=item['student_number']
+        ).exclude(id=item['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0001_initial'),
+        ('scores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_scores, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='score',
+            constraint=models.UniqueConstraint(fields=('title', 'student_number'), name='score_title_student_number_uniq'),
+        ),
+    ]
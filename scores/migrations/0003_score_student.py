@@ -0,0 +1,67 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:20
+
+import logging
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# 每批回填的成绩数量
+BATCH_SIZE = 1000
+# 最多输出的未匹配成绩数量
+MAX_REPORTED = 20
+
+logger = logging.getLogger('scores.migrations')
+
+
+def backfill_student(apps, schema_editor):
+    """
+    按学号和班级为已有的成绩关联学生，分批处理，没有匹配到学生的成绩记录警告日志
+    """
+    Score = apps.get_model('scores', 'Score')
+    Student = apps.get_model('students', 'Student')
+    last_id = 0
+    unmatched = []
+    while True:
+        rows = list(
+            Score.objects.filter(id__gt=last_id, student__isnull=True)
+            .order_by('id').values_list('id', 'student_number', 'grade_id')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        students = {
+            (student_number, grade_id): student_id
+            for student_number, grade_id, student_id in Student.objects.filter(
+                student_number__in={student_number for _, student_number, _ in rows}
+            ).values_list('student_number', 'grade_id', 'id')
+        }
+        matched = []
+        for score_id, student_number, grade_id in rows:
+            student_id = students.get((student_number, grade_id))
+            if student_id is None:
+                unmatched.append((score_id, student_number))
+            else:
+                matched.append(Score(id=score_id, student_id=student_id))
+        Score.objects.bulk_update(matched, ['student'])
+    if unmatched:
+        logger.warning(
+            '%d 条成绩没有匹配到学号和班级相同的学生：%s', len(unmatched),
+            '，'.join(f'成绩 id {score_id} 学号 {student_number}' for score_id, student_number in unmatched[:MAX_REPORTED])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scores', '0002_unique_title_student_number'),
+        ('students', '0002_student_student_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='student',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scores', to='students.student', verbose_name='学生'),
+        ),
+        migrations.RunPython(backfill_student, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_exams(apps, schema_editor):
+    """
+    为已有成绩中每个不同的考试名称创建一场考试，并关联到成绩
+    """
+    Exam = apps.get_model('scores', 'Exam')
+    Score = apps.get_model('scores', 'Score')
+    titles = Score.objects.order_by().values_list('title', flat=True).distinct()
+    for title in titles:
+        exam = Exam.objects.create(name=title)
+        Score.objects.filter(title=title).update(exam=exam)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grades', '0001_initial'),
+        ('scores', '0003_score_student'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exam',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='name/考试名称', max_length=20, unique=True, verbose_name='考试名称')),
+                ('date', models.DateField(blank=True, help_text='date/考试日期，格式：2023-01-01', null=True, verbose_name='考试日期')),
+                ('term', models.CharField(blank=True, help_text='term/学期，如 2023-2024学年第一学期', max_length=20, verbose_name='学期')),
+                ('grades', models.ManyToManyField(blank=True, related_name='exams', to='grades.grade', verbose_name='参加班级')),
+            ],
+            options={
+                'verbose_name': '考试信息',
+                'verbose_name_plural': '考试信息',
+                'db_table': 'exam',
+                'ordering': ['-date', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='exam',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='scores.exam', verbose_name='考试'),
+        ),
+        migrations.RunPython(create_exams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scores', '0004_exam'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='score',
+            name='score_title_student_number_uniq',
+        ),
+        migrations.AlterField(
+            model_name='score',
+            name='exam',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='scores.exam', verbose_name='考试'),
+        ),
+        migrations.RemoveField(
+            model_name='score',
+            name='title',
+        ),
+        migrations.AddConstraint(
+            model_name='score',
+            constraint=models.UniqueConstraint(fields=('exam', 'student_number'), name='score_exam_student_number_uniq'),
+        ),
+    ]
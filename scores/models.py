@@ -1,13 +1,35 @@
 from django.db import models
 
 from grades.models import Grade
+from students.models import Student
 
 # Create your models here.
+class Exam(models.Model):
+    """
+    考试表
+    """
+    name = models.CharField('考试名称', max_length=20, unique=True, help_text="name/考试名称")
+    date = models.DateField('考试日期', null=True, blank=True, help_text="date/考试日期，格式：2023-01-01")
+    term = models.CharField('学期', max_length=20, blank=True, help_text="term/学期，如 2023-2024学年第一学期")
+    # 参加考试的班级，为空时表示全校
+    grades = models.ManyToManyField(Grade, blank=True, verbose_name='参加班级', related_name='exams')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = 'exam'
+        verbose_name = '考试信息'
+        verbose_name_plural = verbose_name
+        ordering = ['-date', '-id']
+
+
 class Score(models.Model):
     """
     成绩表
     """
-    title = models.CharField('考试名称', max_length=20, help_text="title/考试名称")
+    # 与考试表一对多关联，按考试查询和分组时使用整数外键
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, verbose_name='考试', related_name='scores')
     student_number = models.CharField('学号', max_length=20, help_text="student_number/学号")
     student_name = models.CharField('姓名', max_length=20, help_text="student_name/姓名")
     chinese_score = models.DecimalField('语文成绩', max_digits=5, decimal_places=2, help_text="chinese_score/语文成绩")
@@ -15,11 +37,42 @@ class Score(models.Model):
     english_score = models.DecimalField('英语成绩', max_digits=5, decimal_places=2, help_text="english_score/英语成绩")
     # 与班级表一对多关联
     grade = models.ForeignKey(Grade, on_delete=models.CASCADE, verbose_name='班级', related_name='score')
+    # 与学生表一对多关联，按学生查询成绩时使用整数外键，删除学生时保留成绩；学号和姓名保留考试时的信息
+    student = models.ForeignKey(Student, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='学生',
+                                related_name='scores')
 
     def __str__(self):
-        return self.title
+        return self.exam.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录从数据库读取时的考试、班级和总分，修改成绩后用于从排名中移除原来的总分，保存时不需要再查询一次
+        loaded = dict(zip(field_names, values))
+        names = ('exam_id', 'grade_id', 'chinese_score', 'math_score', 'english_score')
+        if all(name in loaded for name in names):
+            instance._loaded_ranking = (
+                loaded['exam_id'], loaded['grade_id'],
+                float(loaded['chinese_score'] + loaded['math_score'] + loaded['english_score']),
+            )
+        return instance
 
     class Meta:
         db_table = 'score'
         verbose_name = '成绩信息'
-        verbose_name_plural = verbose_name
\ No newline at end of file
+        verbose_name_plural = verbose_name
+        constraints = [
+            # 同一场考试每个学生只有一条成绩，重复导入时更新原来的成绩
+            models.UniqueConstraint(fields=['exam', 'student_number'], name='score_exam_student_number_uniq'),
+        ]
+        indexes = [
+            # 成绩列表按班级筛选、按 id 倒序，导出按班级筛选
+            models.Index(fields=['grade', 'id'], name='score_grade_id_idx'),
+            # 成绩列表按学号或姓名搜索、按 id 倒序
+            models.Index(fields=['student_number', 'id'], name='score_number_id_idx'),
+            models.Index(fields=['student_name', 'id'], name='score_name_id_idx'),
+            # 考试统计、分段报表和排名按考试和班级筛选
+            models.Index(fields=['exam', 'grade'], name='score_exam_grade_idx'),
+            # 我的成绩按学生筛选、按 id 倒序
+            models.Index(fields=['student', 'id'], name='score_student_id_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,180 @@
+import threading
+import uuid
+from array import array
+from bisect import bisect_right, insort
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import Score
+
+# 总分的计算表达式
+TOTAL = F('chinese_score') + F('math_score') + F('english_score')
+# 每个进程最多缓存的考试数量，超过后淘汰最久没有使用的考试
+MAX_EXAMS = 50
+# 一次修改的成绩超过考试人数的这个比例（并且超过 REBUILD_MIN 条）时不再逐条更新，直接让所有进程重新加载
+REBUILD_RATIO = 0.25
+REBUILD_MIN = 100
+
+
+def total_of(score):
+    return float(score.chinese_score + score.math_score + score.english_score)
+
+
+class ExamRanking:
+    """
+    一场考试的排名，全校和每个班级的总分分别保存在升序排列的 array 中，
+    名次 = 总分比自己高的人数 + 1（并列时名次相同），通过二分查找得到，每次查询 O(log n)
+    """
+    __slots__ = ('school', 'grades')
+
+    def __init__(self):
+        self.school = array('d')
+        self.grades = defaultdict(lambda: array('d'))
+
+    def __len__(self):
+        return len(self.school)
+
+    def add(self, grade_id, total):
+        insort(self.school, total)
+        insort(self.grades[grade_id], total)
+
+    def remove(self, grade_id, total):
+        for totals in (self.school, self.grades.get(grade_id)):
+            if totals is None:
+                continue
+            index = bisect_right(totals, total) - 1
+            if index >= 0 and totals[index] == total:
+                del totals[index]
+
+    @staticmethod
+    def _rank(totals, total):
+        return len(totals) - bisect_right(totals, total) + 1
+
+    def rank(self, grade_id, total):
+        """
+        返回 (班级排名, 全校排名)
+        """
+        return self._rank(self.grades.get(grade_id, ()), total), self._rank(self.school, total)
+
+
+'''
+考试排名索引
+每个进程按考试缓存 ExamRanking，共享缓存中保存每场考试的版本号。
+本进程修改成绩时在原来的基础上增减总分并更新版本号，其它进程发现版本变化后重新加载这场考试
+'''
+class RankingIndex:
+    __slots__ = ('exams', 'lock')
+
+    def __init__(self):
+        self.exams = OrderedDict()
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _version_key(exam_id):
+        return f'scores:ranking:{exam_id}'
+
+    @staticmethod
+    def _timeout():
+        return getattr(settings, 'RANKING_CACHE_TIMEOUT', 300)
+
+    def _load(self, exam_id):
+        ranking = ExamRanking()
+        rows = Score.objects.filter(exam_id=exam_id).annotate(total=TOTAL).values_list('grade_id', 'total')
+        for grade_id, total in rows.iterator(chunk_size=5000):
+            ranking.school.append(float(total))
+            ranking.grades[grade_id].append(float(total))
+        ranking.school = array('d', sorted(ranking.school))
+        for grade_id, totals in ranking.grades.items():
+            ranking.grades[grade_id] = array('d', sorted(totals))
+        return ranking
+
+    def get(self, exam_id):
+        """
+        返回考试的 ExamRanking，第一次使用或其它进程修改了这场考试的成绩时从数据库加载
+        """
+        key = self._version_key(exam_id)
+        version = cache.get(key)
+        with self.lock:
+            entry = self.exams.get(exam_id)
+            if entry is not None and version is not None and entry[0] == version:
+                self.exams.move_to_end(exam_id)
+                return entry[1]
+            if version is None:
+                version = uuid.uuid4().hex
+                cache.set(key, version, self._timeout())
+            ranking = self._load(exam_id)
+            self.exams[exam_id] = (version, ranking)
+            self.exams.move_to_end(exam_id)
+            while len(self.exams) > getattr(settings, 'RANKING_MAX_EXAMS', MAX_EXAMS):
+                self.exams.popitem(last=False)
+            return ranking
+
+    def rank(self, score):
+        """
+        返回成绩的 (班级排名, 全校排名)
+        """
+        return self.get(score.exam_id).rank(score.grade_id, total_of(score))
+
+    def annotate(self, scores):
+        """
+        为一组成绩设置 total、class_rank 和 school_rank 属性，供列表和详情页显示
+        """
+        for score in scores:
+            score.total = total_of(score)
+            score.class_rank, score.school_rank = self.get(score.exam_id).rank(score.grade_id, score.total)
+        return scores
+
+    # 以下方法在成绩修改的事务提交后调用
+    def apply(self, added=(), removed=()):
+        """
+        added / removed 为 (考试 id, 班级 id, 总分) 的列表，按考试分别增减
+        """
+        changes = defaultdict(lambda: ([], []))
+        for exam_id, grade_id, total in added:
+            changes[exam_id][0].append((grade_id, total))
+        for exam_id, grade_id, total in removed:
+            changes[exam_id][1].append((grade_id, total))
+        for exam_id, (exam_added, exam_removed) in changes.items():
+            self._apply(exam_id, exam_added, exam_removed)
+
+    def saved(self, score, old=None):
+        """
+        old 为修改前的 (考试 id, 班级 id, 总分)，新增成绩时为 None
+        """
+        self.apply(added=[(score.exam_id, score.grade_id, total_of(score))], removed=[old] if old else [])
+
+    def deleted(self, score):
+        self.apply(removed=[(score.exam_id, score.grade_id, total_of(score))])
+
+    def changed(self, exam_id):
+        """
+        让所有进程下次使用这场考试时重新加载
+        """
+        with self.lock:
+            self.exams.pop(exam_id, None)
+        cache.delete(self._version_key(exam_id))
+
+    def _apply(self, exam_id, added, removed):
+        key = self._version_key(exam_id)
+        with self.lock:
+            entry = self.exams.get(exam_id)
+            # 本进程的排名是最新的并且修改量不大时才逐条更新，否则让所有进程重新加载
+            if (entry is None or cache.get(key) != entry[0]
+                    or len(added) + len(removed) > max(len(entry[1]) * REBUILD_RATIO, REBUILD_MIN)):
+                self.changed(exam_id)
+                return
+            ranking = entry[1]
+            for grade_id, total in removed:
+                ranking.remove(grade_id, total)
+            for grade_id, total in added:
+                ranking.add(grade_id, total)
+            version = uuid.uuid4().hex
+            self.exams[exam_id] = (version, ranking)
+            cache.set(key, version, self._timeout())
+
+
+# 每个进程一个索引
+ranking = RankingIndex()
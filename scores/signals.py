@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Score
+from .ranking import ranking, total_of
+from .analytics import invalidate_reports
+
+
+# 事务提交后再更新排名和分段报表缓存，避免回滚后残留数据
+@receiver(post_save, sender=Score)
+def update_ranking(sender, instance, created, **kwargs):
+    exam_id = instance.exam_id
+    if created:
+        old = None
+    elif hasattr(instance, '_loaded_ranking'):
+        # 从数据库读取时的考试、班级和总分，从排名中移除
+        old = instance._loaded_ranking
+    else:
+        # 没有从数据库读取的对象不知道原来的总分，让所有进程下次使用时重新加载
+        transaction.on_commit(lambda: ranking.changed(exam_id))
+        transaction.on_commit(lambda: invalidate_reports(exam_id))
+        instance._loaded_ranking = (exam_id, instance.grade_id, total_of(instance))
+        return
+    instance._loaded_ranking = (exam_id, instance.grade_id, total_of(instance))
+    transaction.on_commit(lambda: ranking.saved(instance, old))
+    exam_ids = {exam_id, old[0]} if old else {exam_id}
+    transaction.on_commit(lambda: invalidate_reports(*exam_ids))
+
+
+@receiver(post_delete, sender=Score)
+def remove_from_ranking(sender, instance, **kwargs):
+    transaction.on_commit(lambda: ranking.deleted(instance))
+    transaction.on_commit(lambda: invalidate_reports(instance.exam_id))
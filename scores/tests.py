@@ -1,3 +1,747 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import logging
+import math
+from decimal import Decimal
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from students.models import Student
+from utils.pagination import CURSOR_SALT, LAST_CURSOR, CursorPaginator, CursorSerializer
+from utils.query_plan import analyze, full_table_scans
+from tests.query_plan import QueryPlanTestMixin
+from .analytics import band_report, exam_statistics, get_bands, get_percentiles, invalidate_reports, percentile
+from .importer import SCORE_HEADER, ScoreImporter, ScoreImportError
+from .models import Exam, Score
+from .ranking import REBUILD_MIN, ExamRanking, RankingIndex, ranking
+
 
 # Create your tests here.
+class ScoreQueryPlanTests(QueryPlanTestMixin, TestCase):
+    """
+    成绩列表、搜索、导出和统计的查询不能全表扫描 score 和 student 表
+    """
+    EXAMS = 4
+    scanned_tables = (Score._meta.db_table, Student._meta.db_table)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Exam.objects.bulk_create([Exam(name=f'考试{i}') for i in range(cls.EXAMS)])
+        exams = list(Exam.objects.order_by('id'))
+        Score.objects.bulk_create([
+            Score(exam=exam, student=student, student_number=student.student_number, student_name=student.student_name,
+                  grade_id=student.grade_id, chinese_score=i % 100, math_score=i % 90, english_score=i % 80)
+            for exam in exams for i, student in enumerate(cls.students)
+        ])
+        analyze(Score)
+        cls.exam = exams[0]
+
+    def test_list_filtered_by_grade(self):
+        self.assertNoFullScan(lambda: self.client.get(reverse('score_list'), {'grade': self.grade.pk}))
+
+    def test_list_filtered_by_exam(self):
+        self.assertNoFullScan(lambda: self.client.get(reverse('score_list'), {'exam': self.exam.pk}))
+
+    def test_list_search(self):
+        for keywords in (self.student.student_number, self.student.student_name):
+            with self.subTest(search=keywords):
+                self.assertNoFullScan(lambda: self.client.get(reverse('score_list'), {'search': keywords}))
+
+    def test_my_scores(self):
+        self.client.force_login(self.student.user)
+        self.assertNoFullScan(lambda: self.client.get(reverse('my_score')))
+
+    def test_export(self):
+        self.assertNoFullScan(lambda: self.client.post(
+            reverse('score_export'), json.dumps({'grade': self.grade.pk, 'format': 'csv'}),
+            content_type='application/json'))
+
+    def test_statistics_and_bands(self):
+        for name in ('score_statistics', 'score_bands'):
+            for params in ({'exam': self.exam.pk}, {'exam': self.exam.pk, 'grade': self.grade.pk}):
+                with self.subTest(url=name, params=params):
+                    self.assertNoFullScan(lambda: self.client.get(reverse(name), params))
+
+    def test_detects_full_scan(self):
+        # 没有索引的字段上的查询应该被识别为全表扫描
+        sql, params = Score.objects.filter(chinese_score=1).query.sql_with_params()
+        self.assertIn(Score._meta.db_table, full_table_scans(sql, params))
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # 部分考试没有日期，用于检查 NULL 的排序
+        Exam.objects.bulk_create([
+            Exam(name=f'考试{i}', date=None if i % 4 == 0 else datetime.date(2024, 1, 1 + i % 7)) for i in range(23)
+        ])
+        cls.exams = list(Exam.objects.all())
+
+    def setUp(self):
+        cache.clear()
+
+    def expected(self):
+        # 按日期倒序、NULL 排在最后，日期相同时按 id 倒序
+        exams = sorted(self.exams, key=lambda exam: (exam.date is not None, exam.date or datetime.date.min, exam.pk),
+                       reverse=True)
+        return [exam.pk for exam in exams]
+
+    def paginator(self):
+        return CursorPaginator(Exam.objects.all(), 5, ['-date'])
+
+    def test_next_pages_cover_every_row_once(self):
+        paginator = self.paginator()
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        ids = [exam.pk for exam in page]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            self.assertTrue(page.has_previous())
+            ids += [exam.pk for exam in page]
+        self.assertEqual(ids, self.expected())
+
+    def test_previous_pages_from_the_last_page(self):
+        paginator = self.paginator()
+        page = paginator.page(LAST_CURSOR)
+        self.assertFalse(page.has_next())
+        # 最后一页是最后的 5 条，向前翻到第一页时只剩下 3 条
+        self.assertEqual(len(page), 5)
+        ids = [exam.pk for exam in page]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            self.assertTrue(page.has_next())
+            ids = [exam.pk for exam in page] + ids
+        self.assertEqual(len(page), 3)
+        self.assertEqual(ids, self.expected())
+
+    def test_previous_after_next_returns_the_same_page(self):
+        paginator = self.paginator()
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(list(paginator.page(third.previous_cursor)), list(second))
+        self.assertEqual(list(paginator.page(second.previous_cursor)), list(first))
+
+    def test_tampered_cursor_returns_the_first_page(self):
+        paginator = self.paginator()
+        first = list(paginator.page())
+        cursor = paginator.page().next_cursor
+        forged = signing.dumps({'k': [None, 0], 'd': 'n'}, salt='other', compress=True)
+        for value in (cursor[:-2] + ('AA' if cursor[-2:] != 'AA' else 'BB'), forged, 'garbage'):
+            with self.subTest(cursor=value):
+                page = paginator.page(value)
+                self.assertEqual(list(page), first)
+                self.assertFalse(page.has_previous())
+
+    def test_cursor_contains_only_the_sort_key(self):
+        paginator = self.paginator()
+        page = paginator.page()
+        last = page.object_list[-1]
+        self.assertEqual(signing.loads(page.next_cursor, salt=CURSOR_SALT, serializer=CursorSerializer),
+                         {'k': [str(last.date) if last.date else None, last.pk], 'd': 'n'})
+
+    def test_count_is_approximate(self):
+        paginator = self.paginator()
+        self.assertEqual((paginator.count, paginator.num_pages), (23, math.ceil(23 / 5)))
+        Exam.objects.create(name='新考试')
+        # 总条数在缓存过期前不变，翻页本身不受影响
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.paginator().count, 23)
+        self.assertEqual(len(queries), 0)
+        cache.clear()
+        self.assertEqual(self.paginator().num_pages, 5)
+        self.assertEqual(CursorPaginator(Exam.objects.none(), 5, ['-date']).num_pages, 1)
+
+
+class ScoreImportTests(TestCase):
+    STUDENTS = 30
+
+    def setUp(self):
+        cache.clear()
+        grade_cache.invalidate()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        for i in range(self.STUDENTS):
+            user = User.objects.create_user(f'{20000000 + i}')
+            Student.objects.create(student_number=user.username, student_name=f'学生{i}', gender='M',
+                                   birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                                   grade=self.grade)
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def rows(self, count, exam='期中', start=0):
+        return [[exam, f'学生{i}', '一班', f'{20000000 + i}', 90, 80.5, i] for i in range(start, start + count)]
+
+    def upload(self, rows):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(SCORE_HEADER)
+        for row in rows:
+            workbook.active.append(row)
+        output = io.BytesIO()
+        workbook.save(output)
+        return self.client.post(reverse('score_import'),
+                                {'excel_file': SimpleUploadedFile('scores.xlsx', output.getvalue())})
+
+    def test_all_row_errors_are_reported(self):
+        exam = Exam.objects.create(name='期末')
+        exam.grades.add(self.other)
+        rows = self.rows(8)
+        rows[0][0] = ''
+        rows[1][4] = 1000
+        rows[2][1] = '错名'
+        rows[3][2] = '三班'
+        rows[4][3] = '2000'
+        rows[6] = list(rows[5])
+        rows[7][0] = '期末'
+        response = self.upload(rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            '第2行：考试名称不能为空',
+            '第3行：成绩必须为 0 - 999.99 之间的数字',
+            '第4行：班级为 一班, 学号为 20000002 的学生 错名 不存在',
+            '第5行：班级 三班 不存在',
+            '第6行：学号不能为空，且长度必须为8位',
+            '第8行：与第7行重复，考试 期中 中学号 20000005 的成绩只能填写一次',
+            '第9行：班级 一班 没有参加考试 期末',
+        ])
+        self.assertFalse(Score.objects.exists())
+        self.assertFalse(Exam.objects.filter(name='期中').exists())
+
+    def test_import_creates_exams_and_scores(self):
+        response = self.upload(self.rows(3) + self.rows(2, exam='期末'))
+        self.assertEqual((response.json()['count'], response.json()['created']), (5, 5))
+        score = Score.objects.select_related('exam', 'student').get(exam__name='期末', student_number='20000001')
+        self.assertEqual((score.grade_id, score.student.student_name, score.chinese_score, score.math_score,
+                          score.english_score), (self.grade.pk, '学生1', Decimal('90'), Decimal('80.5'), Decimal('1')))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # 先导入一次，让班级目录和花名册索引加载完成
+        self.upload(self.rows(1, exam='预热'))
+        counts = []
+        for exam, count in (('期中', 5), ('期末', 25)):
+            with CaptureQueriesContext(connection) as queries:
+                ScoreImporter(self.rows(count, exam)).run()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Score.objects.filter(exam__name='期末').count(), 25)
+
+    def test_failed_batch_rolls_back_scores_and_exams(self):
+        importer = ScoreImporter(self.rows(6), batch_size=2)
+        importer.validate()
+        original = Score.objects.bulk_create
+        calls = []
+
+        def bulk_create(objs, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError('写入失败')
+            return original(objs, **kwargs)
+
+        with mock.patch.object(Score.objects, 'bulk_create', side_effect=bulk_create), \
+                self.assertRaises(RuntimeError):
+            importer.save()
+        self.assertEqual(calls, [2, 2])
+        self.assertFalse(Score.objects.exists())
+        self.assertFalse(Exam.objects.exists())
+
+    def test_reimport_is_idempotent(self):
+        rows = self.rows(10)
+        self.assertEqual(self.upload(rows).json()['created'], 10)
+        ids = set(Score.objects.values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            result = ScoreImporter(rows).run()
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (0, 0, 10))
+        # 成绩没有变化时不执行 INSERT 和 UPDATE
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith(('INSERT', 'UPDATE'))])
+
+        rows[3][5] = 60
+        result = ScoreImporter(rows + self.rows(2, start=10)).run()
+        self.assertEqual((result['created'], result['updated'], result['unchanged']), (2, 1, 9))
+        self.assertTrue(ids < set(Score.objects.values_list('id', flat=True)))
+        self.assertEqual(Score.objects.count(), 12)
+        self.assertEqual(Score.objects.get(student_number='20000003').math_score, Decimal('60'))
+
+    def test_validation_error_keeps_every_row(self):
+        rows = self.rows(30)
+        for row in rows:
+            row[4] = -1
+        with self.assertRaises(ScoreImportError) as context:
+            ScoreImporter(rows).validate()
+        self.assertEqual(len(context.exception.errors), 30)
+
+
+class ScoreStatisticsTests(TestCase):
+    # 一班 4 人、二班 1 人的语文、数学、英语成绩
+    SCORES = {
+        '一班': [(60, 100, 0), (70, 90, 50), (80, 80, 50), (90, 70, 100)],
+        '二班': [(100, 0, 25.5)],
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.exam = Exam.objects.create(name='期中')
+        cls.empty = Exam.objects.create(name='期末')
+        cls.grades = {}
+        number = 20000000
+        for grade_name, rows in cls.SCORES.items():
+            grade = cls.grades[grade_name] = Grade.objects.create(grade_name=grade_name, grade_number=grade_name)
+            for chinese, math_score, english in rows:
+                number += 1
+                Score.objects.create(exam=cls.exam, grade=grade, student_number=str(number), student_name='学生',
+                                     chinese_score=chinese, math_score=math_score, english_score=english)
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def test_percentile_matches_linear_interpolation(self):
+        values = [60, 70, 80, 90, 100]
+        self.assertEqual([percentile(values, p) for p in (0, 10, 25, 50, 75, 90, 100)],
+                         [60, 64, 70, 80, 90, 96, 100])
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(percentile([7], 90), 7)
+
+    def test_get_percentiles(self):
+        self.assertEqual(get_percentiles(), (10, 25, 75, 90))
+        self.assertEqual(get_percentiles('5,50,99.5'), (5, 50, 99.5))
+        for value in ('a', '10,', '-1', '101'):
+            with self.assertRaises(ValueError):
+                get_percentiles(value)
+
+    def test_exam_statistics(self):
+        with self.assertNumQueries(2):
+            statistics = exam_statistics(self.exam.pk)
+        self.assertEqual(statistics['chinese_score'], {
+            'count': 5, 'mean': 80.0, 'min': 60.0, 'max': 100.0, 'std': round(math.sqrt(200), 2), 'median': 80.0,
+            'percentiles': {'10': 64.0, '25': 70.0, '75': 90.0, '90': 96.0},
+        })
+        # 总分按行相加后再排序：125.5, 160, 210, 210, 260
+        total = statistics['total']
+        self.assertEqual((total['count'], total['mean'], total['min'], total['max'], total['median']),
+                         (5, 193.1, 125.5, 260.0, 210.0))
+        self.assertEqual(total['percentiles'], {'10': 139.3, '25': 160.0, '75': 210.0, '90': 240.0})
+
+    def test_exam_statistics_by_grade(self):
+        statistics = exam_statistics(self.exam.pk, self.grades['一班'].pk, (50,))
+        self.assertEqual((statistics['math_score']['count'], statistics['math_score']['mean'],
+                          statistics['math_score']['median']), (4, 85.0, 85.0))
+        self.assertEqual(statistics['english_score']['percentiles'], {'50': 50.0})
+        self.assertIsNone(exam_statistics(self.empty.pk))
+
+    def test_view(self):
+        url = reverse('score_statistics')
+        response = self.client.get(url, {'exam': self.exam.pk, 'grade': self.grades['二班'].pk, 'percentiles': '50'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['exam'], data['grade']), ({'id': self.exam.pk, 'name': '期中'}, self.grades['二班'].pk))
+        self.assertEqual(data['statistics']['english_score']['percentiles'], {'50': 25.5})
+        self.assertEqual(self.client.get(url, {'exam': self.empty.pk}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'exam': 0}).status_code, 404)
+        for params in ({}, {'exam': 'a'}, {'exam': self.exam.pk, 'grade': 'a'},
+                       {'exam': self.exam.pk, 'percentiles': '200'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class ScoreBandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        grade_cache.invalidate()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        self.exam = Exam.objects.create(name='期中')
+        self.scores = [
+            Score.objects.create(exam=self.exam, grade=grade, student_number=str(20000000 + i), student_name='学生',
+                                 chinese_score=chinese, math_score=math_score, english_score=english)
+            for i, (grade, chinese, math_score, english) in enumerate((
+                (self.grade, 0, 100, Decimal('59.99')), (self.grade, 60, Decimal('99.99'), 60), (self.other, 100, 0, 90)))
+        ]
+
+    def test_get_bands(self):
+        self.assertEqual(get_bands(), {'width': 10})
+        self.assertEqual(get_bands('5'), {'width': 5})
+        self.assertEqual(get_bands('5', '60,90', '差,中,好'), {'thresholds': [60, 90], 'labels': ['差', '中', '好']})
+        for args in (('0',), ('-5',), (None, '90,60'), (None, '60,60'), (None, '60,90', '差,好'), (None, 'a')):
+            with self.assertRaises(ValueError):
+                get_bands(*args)
+
+    def test_width_edges(self):
+        report = band_report(self.exam.pk, bands={'width': 10})
+        chinese = report['chinese_score']
+        # 分段包含下限、不包含上限：0 分在第一段，100 分单独在 100-110 段
+        self.assertEqual(len(chinese['bands']), 11)
+        self.assertEqual((chinese['bands'][0]['label'], chinese['bands'][-1]['label']), ('0-10', '100-110'))
+        self.assertEqual(chinese['all'], [1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(chinese['grades'], {'一班': [1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0],
+                                             '二班': [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1]})
+        math_bands = report['math_score']
+        self.assertEqual([band['label'] for band, count in zip(math_bands['bands'], math_bands['all']) if count],
+                         ['0-10', '90-100', '100-110'])
+        # 总分按 3 倍的宽度分段
+        self.assertEqual(report['total']['bands'][0], {'label': '150-180', 'lower': 150, 'upper': 180})
+
+    def test_threshold_edges(self):
+        bands = {'thresholds': [60, 90], 'labels': ['不及格', '及格', '优秀']}
+        report = band_report(self.exam.pk, bands=bands)
+        # 等于分数线时属于上一段
+        self.assertEqual(report['chinese_score']['grades'], {'一班': [1, 1, 0], '二班': [0, 0, 1]})
+        self.assertEqual(report['english_score']['all'], [1, 1, 1])
+        self.assertEqual([band['label'] for band in report['total']['bands']], ['不及格', '及格', '优秀'])
+        self.assertEqual(report['total']['all'], [1, 2, 0])
+        report = band_report(self.exam.pk, self.other.pk, {'thresholds': [60]})
+        self.assertEqual(report['math_score']['bands'], [{'label': '<60', 'lower': None, 'upper': 60},
+                                                         {'label': '>=60', 'lower': 60, 'upper': None}])
+        self.assertEqual(report['math_score']['grades'], {'二班': [1, 0]})
+
+    def test_cache_is_invalidated_when_scores_change(self):
+        bands = {'width': 50}
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [1, 1, 1])
+        with self.assertNumQueries(0):
+            band_report(self.exam.pk, bands=bands)
+
+        score = self.scores[1]
+        score.chinese_score = 10
+        with self.captureOnCommitCallbacks(execute=True):
+            score.save()
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [2, 0, 1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Score.objects.create(exam=self.exam, grade=self.grade, student_number='20000003', student_name='学生',
+                                 chinese_score=70, math_score=70, english_score=70)
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [2, 1, 1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scores[2].delete()
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [2, 1])
+
+        # QuerySet.update 不发送信号，需要手动让缓存失效
+        Score.objects.filter(pk=score.pk).update(chinese_score=60)
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [2, 1])
+        invalidate_reports(self.exam.pk)
+        self.assertEqual(band_report(self.exam.pk, bands=bands)['chinese_score']['all'], [1, 2])
+
+    def test_empty_exam(self):
+        exam = Exam.objects.create(name='期末')
+        self.assertIsNone(band_report(exam.pk))
+        # 空结果也会缓存
+        with self.assertNumQueries(0):
+            self.assertIsNone(band_report(exam.pk))
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ranking.exams.clear()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        self.exam = Exam.objects.create(name='期中')
+        self.number = 20000000
+
+    def score(self, total, grade=None, exam=None):
+        self.number += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            return Score.objects.create(exam=exam or self.exam, grade=grade or self.grade, student_number=str(self.number),
+                                        student_name='学生', chinese_score=total, math_score=0, english_score=0)
+
+    def test_ties_share_a_rank(self):
+        exam_ranking = ExamRanking()
+        for grade_id, total in ((1, 90), (1, 80), (2, 90), (1, 70), (2, 60)):
+            exam_ranking.add(grade_id, total)
+        self.assertEqual([exam_ranking.rank(1, total) for total in (90, 80, 70)], [(1, 1), (2, 3), (3, 4)])
+        self.assertEqual(exam_ranking.rank(2, 60), (2, 5))
+        exam_ranking.remove(2, 90)
+        exam_ranking.remove(2, 55)
+        self.assertEqual((len(exam_ranking), exam_ranking.rank(1, 80)), (4, (2, 2)))
+        self.assertEqual(exam_ranking.rank(3, 100), (1, 1))
+
+    def test_save_updates_the_loaded_ranking(self):
+        first, second = self.score(90), self.score(80, self.other)
+        ranking.annotate([first, second])
+        self.assertEqual((second.class_rank, second.school_rank), (1, 2))
+
+        third = self.score(95)
+        second.chinese_score = 100
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        # 本进程的排名逐条更新，不需要重新查询
+        with self.assertNumQueries(0):
+            ranks = [ranking.rank(score) for score in (first, second, third)]
+        self.assertEqual(ranks, [(2, 3), (1, 1), (1, 2)])
+
+        # 修改班级和考试时从原来的班级和考试中移除
+        later = Exam.objects.create(name='期末')
+        ranking.get(later.pk)
+        second.grade, second.exam = self.grade, later
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.rank(first), (2, 2))
+            self.assertEqual(ranking.rank(second), (1, 1))
+        self.assertEqual(len(ranking.get(self.exam.pk).grades[self.other.pk]), 0)
+
+    def test_saving_a_loaded_score_runs_only_the_update(self):
+        first, second = self.score(90), self.score(80)
+        self.assertEqual(ranking.rank(second), (2, 2))
+        score = Score.objects.get(pk=second.pk)
+        score.chinese_score = 95
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            score.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.rank(score), (1, 1))
+            self.assertEqual(ranking.rank(first), (2, 2))
+
+        # 没有从数据库读取的对象不知道原来的总分，重新加载这场考试
+        unloaded = Score(pk=first.pk, exam=self.exam, grade=self.grade, student_number=first.student_number,
+                         student_name='学生', chinese_score=99, math_score=0, english_score=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            unloaded.save()
+        self.assertNotIn(self.exam.pk, ranking.exams)
+        self.assertEqual(ranking.rank(unloaded), (1, 1))
+
+    def test_delete_removes_from_the_ranking(self):
+        first, second = self.score(90), self.score(80)
+        self.assertEqual(ranking.rank(second), (2, 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.rank(second), (1, 1))
+
+    def test_rollback_leaves_the_ranking_unchanged(self):
+        first = self.score(90)
+        self.assertEqual(ranking.rank(first), (1, 1))
+        # 事务没有提交时不执行 on_commit 回调
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Score.objects.create(exam=self.exam, grade=self.grade, student_number='30000000', student_name='学生',
+                                 chinese_score=100, math_score=0, english_score=0)
+        self.assertTrue(callbacks)
+        self.assertEqual(ranking.rank(first), (1, 1))
+
+    def test_other_process_reloads_after_a_change(self):
+        first, second = self.score(90), self.score(80)
+        other = RankingIndex()
+        self.assertEqual(other.rank(second), (2, 2))
+        with self.assertNumQueries(0):
+            other.rank(second)
+
+        ranking.get(self.exam.pk)
+        second.chinese_score = 95
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        # 版本号变化后其它进程重新加载这场考试
+        with self.assertNumQueries(1):
+            self.assertEqual(other.rank(second), (1, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(other.rank(first), (2, 2))
+
+        # 本进程没有加载这场考试时只让其它进程的缓存失效
+        ranking.exams.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertNotIn(self.exam.pk, ranking.exams)
+        with self.assertNumQueries(1):
+            self.assertEqual(other.rank(second), (1, 1))
+
+    def test_large_change_rebuilds(self):
+        self.score(90)
+        ranking.get(self.exam.pk)
+        ranking.apply(added=[(self.exam.pk, self.grade.pk, 50)] * (REBUILD_MIN + 1))
+        self.assertNotIn(self.exam.pk, ranking.exams)
+        self.assertIsNone(cache.get(RankingIndex._version_key(self.exam.pk)))
+
+    @override_settings(RANKING_MAX_EXAMS=2)
+    def test_least_recently_used_exam_is_evicted(self):
+        exams = [self.exam] + [Exam.objects.create(name=f'考试{i}') for i in range(2)]
+        ranking.get(exams[0].pk)
+        ranking.get(exams[1].pk)
+        ranking.get(exams[0].pk)
+        ranking.get(exams[2].pk)
+        self.assertEqual(list(ranking.exams), [exams[0].pk, exams[2].pk])
+
+
+class MyScoreListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        exam = Exam.objects.create(name='期中')
+        self.students = []
+        for i in range(2):
+            user = User.objects.create_user(f'{20000000 + i}', password='123456')
+            student = Student.objects.create(student_number=user.username, student_name=f'学生{i}', gender='M',
+                                             birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                                             user=user, grade=grade)
+            self.students.append(student)
+            Score.objects.create(exam=exam, grade=grade, student=student, student_number=student.student_number,
+                                 student_name=student.student_name, chinese_score=90 - i, math_score=90,
+                                 english_score=90)
+        # 学号相同但没有关联学生的成绩（如学生删除后保留的成绩）不显示
+        Score.objects.create(exam=Exam.objects.create(name='期末'), grade=grade, student_number='20000000',
+                             student_name='学生0', chinese_score=1, math_score=1, english_score=1)
+
+    def test_only_the_students_own_scores(self):
+        student = self.students[1]
+        self.client.force_login(student.user)
+        session = self.client.session
+        session['user_role'] = 'student'
+        session.save()
+        response = self.client.get(reverse('my_score'))
+        self.assertEqual(response.status_code, 200)
+        scores = list(response.context['scores'])
+        self.assertEqual([score.student_id for score in scores], [student.pk])
+        self.assertEqual((scores[0].class_rank, scores[0].school_rank), (2, 2))
+
+
+class ExamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        grade_cache.invalidate()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        user = User.objects.create_user('20000000')
+        Student.objects.create(student_number='20000000', student_name='学生', gender='M',
+                               birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                               grade=self.grade)
+        self.exam = Exam.objects.create(name='期中', date=datetime.date(2024, 4, 20), term='2023-2024学年第二学期')
+        Score.objects.create(exam=self.exam, grade=self.grade, student_number='20000000', student_name='学生',
+                             chinese_score=90, math_score=90, english_score=90)
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def test_model(self):
+        later = Exam.objects.create(name='期末', date=datetime.date(2024, 7, 1))
+        self.assertEqual(str(later), '期末')
+        self.assertEqual(str(Score.objects.get()), '期中')
+        self.assertEqual(list(Exam.objects.exclude(date=None)), [later, self.exam])
+        with transaction.atomic(), self.assertRaises(IntegrityError):
+            Exam.objects.create(name='期中')
+        # 删除考试时删除这场考试的成绩
+        self.exam.delete()
+        self.assertFalse(Score.objects.exists())
+
+    def test_create_exams_reuses_existing_exams(self):
+        rows = [[title, '学生', '一班', '20000000', 80, 80, 80] for title in ('期中', '期末', '月考')]
+        importer = ScoreImporter(rows)
+        importer.validate()
+        with self.assertNumQueries(2):
+            importer._create_exams()
+        exams = dict(Exam.objects.values_list('name', 'id'))
+        self.assertEqual(set(exams), {'期中', '期末', '月考'})
+        self.assertEqual(exams['期中'], self.exam.pk)
+        self.assertEqual([item['exam_id'] for item in importer.scores], [exams['期中'], exams['期末'], exams['月考']])
+        self.assertTrue(all('title' not in item for item in importer.scores))
+
+        # 考试都已存在时不再查询
+        importer = ScoreImporter(rows[1:3])
+        importer.validate()
+        with self.assertNumQueries(0):
+            importer._create_exams()
+
+    def test_invalid_exam_parameter(self):
+        response = self.client.get(reverse('score_list'), {'exam': 'abc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['scores'])
+        self.assertEqual(len(self.client.get(reverse('score_list'), {'exam': self.exam.pk}).context['scores']), 1)
+        self.assertFalse(self.client.get(reverse('score_list'), {'grade': '1 OR 1'}).context['scores'])
+
+        # 删除筛选结果时不会忽略错误的参数而删除所有成绩
+        response = self.client.post(reverse('score_delete_multiple'), {'all': '1', 'exam': 'abc'})
+        self.assertEqual(response.json()['count'], 0)
+        self.assertTrue(Score.objects.exists())
+
+        response = self.client.post(reverse('score_export'), json.dumps({'grade': self.grade.pk, 'exam': 'abc'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('score_export'), json.dumps({'grade': self.grade.pk, 'exam': self.exam.pk,
+                                                                         'format': 'csv'}),
+                                    content_type='application/json')
+        self.assertIn('期中', b''.join(response.streaming_content).decode('utf-8-sig'))
+
+
+class ScoreMigrationTests(TransactionTestCase):
+    """
+    在迁移前的表结构中写入数据，执行迁移后检查数据
+    """
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        # 恢复到最新的迁移，测试留下的成绩没有关联学生，不输出回填的警告
+        executor = MigrationExecutor(connection)
+        with mock.patch.object(logging.getLogger('scores.migrations'), 'disabled', True):
+            executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_0002_keeps_the_last_duplicate(self):
+        apps = self.migrate(('scores', '0001_initial'))
+        Score = apps.get_model('scores', 'Score')
+        grade = apps.get_model('grades', 'Grade').objects.create(grade_name='一班', grade_number='001')
+        fields = {'grade': grade, 'student_name': '学生', 'chinese_score': 1, 'english_score': 1}
+        for title, student_number, math_score in (('期中', '20000000', 1), ('期中', '20000000', 2),
+                                                  ('期中', '20000001', 3), ('期末', '20000000', 4),
+                                                  ('期中', '20000000', 5), ('期中', '20000001', 6)):
+            Score.objects.create(title=title, student_number=student_number, math_score=math_score, **fields)
+
+        Score = self.migrate(('scores', '0002_unique_title_student_number')).get_model('scores', 'Score')
+        self.assertEqual(
+            sorted(Score.objects.values_list('title', 'student_number', 'math_score')),
+            [('期中', '20000000', 5), ('期中', '20000001', 6), ('期末', '20000000', 4)])
+
+    def test_0003_links_scores_by_number_and_grade(self):
+        Score = self.migrate(('scores', '0002_unique_title_student_number')).get_model('scores', 'Score')
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        other = Grade.objects.create(grade_name='二班', grade_number='002')
+        user = User.objects.create_user('20000000')
+        student = Student.objects.create(student_number='20000000', student_name='学生', gender='M',
+                                         birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                                         user=user, grade=grade)
+        fields = {'student_name': '学生', 'chinese_score': 1, 'math_score': 1, 'english_score': 1}
+        matched = Score.objects.create(title='期中', student_number='20000000', grade_id=grade.pk, **fields)
+        # 学号相同但班级不同、学号不存在的成绩不关联学生
+        moved = Score.objects.create(title='期末', student_number='20000000', grade_id=other.pk, **fields)
+        missing = Score.objects.create(title='期中', student_number='20000001', grade_id=grade.pk, **fields)
+
+        with self.assertLogs('scores.migrations', 'WARNING') as logs:
+            Score = self.migrate(('scores', '0003_score_student')).get_model('scores', 'Score')
+        self.assertEqual(dict(Score.objects.values_list('id', 'student_id')),
+                         {matched.pk: student.pk, moved.pk: None, missing.pk: None})
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('2 条成绩', logs.output[0])
+        self.assertIn(f'成绩 id {missing.pk} 学号 20000001', logs.output[0])
+
+    def test_0004_creates_an_exam_per_title(self):
+        Score = self.migrate(('scores', '0003_score_student')).get_model('scores', 'Score')
+        grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        fields = {'grade_id': grade.pk, 'student_name': '学生', 'chinese_score': 1, 'math_score': 1, 'english_score': 1}
+        scores = {(title, number): Score.objects.create(title=title, student_number=number, **fields).pk
+                  for title, number in (('期中', '20000000'), ('期中', '20000001'), ('期末', '20000000'))}
+
+        apps = self.migrate(('scores', '0005_remove_score_title'))
+        Exam, Score = apps.get_model('scores', 'Exam'), apps.get_model('scores', 'Score')
+        exams = dict(Exam.objects.values_list('name', 'id'))
+        self.assertEqual(set(exams), {'期中', '期末'})
+        self.assertEqual(dict(Score.objects.values_list('id', 'exam_id')),
+                         {pk: exams[title] for (title, _), pk in scores.items()})
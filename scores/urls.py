@@ -1,7 +1,7 @@
 from django.urls import path
 
 from .views import (ScoreListView, ScoreCreateView, ScoreUpdateView, ScoreDeleteView, ScoreDeleteMultipleView,
-                    score_export, score_import, ScoreDetailView, MyScoreListView)
+                    score_export, score_import, score_statistics, score_bands, ScoreDetailView, MyScoreListView)
 
 urlpatterns = [
     path('', ScoreListView.as_view(), name='score_list'),
@@ -12,5 +12,7 @@ urlpatterns = [
     path('<int:pk>/detail', ScoreDetailView.as_view(), name='score_detail'),
     path('export/', score_export, name='score_export'),
     path('import/', score_import, name='score_import'),
+    path('statistics/', score_statistics, name='score_statistics'),
+    path('bands/', score_bands, name='score_bands'),
     path('my_score/', MyScoreListView.as_view(), name='my_score'),
  ]
\ No newline at end of file
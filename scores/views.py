@@ -1,21 +1,49 @@
 import json
-import openpyxl
 from pathlib import Path
-from io import BytesIO
 
 from django.views.generic import ListView, UpdateView, CreateView, DeleteView, DetailView
 from django.urls import reverse_lazy
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse
 from django.db.models import Q
 
+from utils.pagination import CursorPaginationMixin
 from utils.premissions import RoleRequiredMixin, role_required
-from .models import Score
+from .models import Exam, Score
 from .forms import ScoreForm
 from grades.models import Grade
-from students.models import Student
+from grades.cache import get_grades
+from .importer import ScoreImporter, ScoreImportError, SCORE_HEADER
+from jobs.models import Job
 from utils.handle_excel import ReadExcel
+from .exporter import export_rows
+from .analytics import exam_statistics, get_percentiles, band_report, get_bands
+from .ranking import ranking
+from .deletion import delete_scores
+from utils.export import stream_export
 
 # Create your views here.
+def filter_scores(queryset, params):
+    """
+    按班级、考试和姓名/学号筛选成绩，列表页和删除筛选结果共用
+    班级或考试参数不是数字时没有匹配的成绩，删除筛选结果时不会因为忽略了错误的参数而多删
+    """
+    grade_id = params.get('grade')
+    exam_id = params.get('exam')
+    keywords = params.get('search')
+    if (grade_id and not grade_id.isdigit()) or (exam_id and not exam_id.isdigit()):
+        return queryset.none()
+    if grade_id:
+        queryset = queryset.filter(grade__pk=grade_id)
+    if exam_id:
+        queryset = queryset.filter(exam_id=exam_id)
+    if keywords:
+        queryset = queryset.filter(
+            Q(student_number=keywords) |
+            Q(student_name=keywords)
+        )
+    return queryset
+
+
 class ScoreBasicView(RoleRequiredMixin):
     model = Score
     form_class = ScoreForm
@@ -25,33 +53,28 @@ class ScoreBasicView(RoleRequiredMixin):
     allowed_roles = ['teacher', 'admin']
     context_object_name = 'scores'
 
-class ScoreListView(ScoreBasicView, ListView):
+class ScoreListView(ScoreBasicView, CursorPaginationMixin, ListView):
     template_name = 'scores/list.html'
     paginate_by = 9
     ordering = ['-id']
 
     # 重写get_queryset 方法，添加搜索功能
     def get_queryset(self):
-        # 使用父类的方法，获取所有成绩
-        queryset = super().get_queryset()
-        grade_id = self.request.GET.get('grade')
-        keywords = self.request.GET.get('search')
-
-        if grade_id:
-            queryset = queryset.filter(grade__pk=grade_id)
-        if keywords:
-            queryset = queryset.filter(
-                Q(student_number=keywords) |
-                Q(student_name=keywords)
-            )
-        return queryset
+        # 使用父类的方法，获取所有成绩，班级和考试名称通过 join 一起查询
+        queryset = super().get_queryset().select_related('grade', 'exam')
+        return filter_scores(queryset, self.request.GET)
     # 默认的 context 返回的 score 对象，由于我们还要在页面中使用 grade 对象，所以可以重写 get_context_data 方法
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # 获取所有班级并添加到上下文对象
-        context['grades'] = Grade.objects.all().order_by('grade_number')
+        # 从缓存中获取所有班级并添加到上下文对象
+        context['grades'] = get_grades()
         # 判断当前选中的班级，并添加到上下文对象中
         context['current_grade'] = self.request.GET.get('grade', '')
+        # 所有考试和当前选中的考试，考试表很小，直接查询
+        context['exams'] = Exam.objects.only('id', 'name')
+        context['current_exam'] = self.request.GET.get('exam', '')
+        # 从排名索引中查询当前页成绩的总分和排名
+        ranking.annotate(context['scores'])
         return context
 
 class ScoreUpdateView(ScoreBasicView, UpdateView):
@@ -115,21 +138,29 @@ class ScoreDeleteView(ScoreBasicView, DeleteView):
 
 class ScoreDeleteMultipleView(ScoreBasicView, DeleteView):
     def post(self, request, *args, **kwargs):
-        score_ids = request.POST.getlist('score_ids')
-        print(score_ids)
-        if not score_ids:
-            return JsonResponse({
-                'status': 'error',
-                'message': '请选择要删除的成绩信息'
-            }, status=400)
-        self.object_list = self.get_queryset().filter(id__in=score_ids)
+        # all 为真时删除当前筛选条件下的所有成绩，不需要提交成绩 id
+        if request.POST.get('all'):
+            if not (request.POST.get('grade') or request.POST.get('exam') or request.POST.get('search')):
+                return JsonResponse({
+                    'status': 'error',
+                    'message': '请先选择班级、考试或输入搜索条件'
+                }, status=400)
+            self.object_list = filter_scores(self.get_queryset(), request.POST)
+        else:
+            score_ids = request.POST.getlist('score_ids')
+            if not score_ids:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': '请选择要删除的成绩信息'
+                }, status=400)
+            self.object_list = self.get_queryset().filter(id__in=score_ids)
         try:
-            for score in self.object_list:
-                # 删除 score 表中的数据
-                self.object_list.delete()
+            # 按 id 分批执行 DELETE ... WHERE id IN (...)，事务提交后更新排名
+            count = delete_scores(self.object_list)
             return JsonResponse({
                 'status': 'success',
-                'message': '删除成功'
+                'message': f'删除成功，共删除 {count} 条成绩信息',
+                'count': count
             }, status=200)
         except Exception as e:
             return JsonResponse({
@@ -141,6 +172,11 @@ class ScoreDetailView(DetailView):
     model =  Score
     template_name = 'scores/detail.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ranking.annotate([self.object])
+        return context
+
 @role_required('teacher', 'admin')
 def score_export(request):
     if request.method == 'POST':
@@ -160,52 +196,45 @@ def score_export(request):
                 'status': 'error',
                 'message': '班级不存在'
             }, status=404)
-        # 从数据库中查询学生成绩数据
+        # 从数据库中查询学生成绩数据，可以只导出一场考试
         scores = Score.objects.filter(grade=grade)
+        exam_id = data.get('exam')
+        if exam_id:
+            if not str(exam_id).isdigit():
+                return JsonResponse({
+                    'status': 'error',
+                    'message': '考试参数错误'
+                }, status=400)
+            scores = scores.filter(exam_id=exam_id)
         if not scores.exists():
             return JsonResponse({
                 'status': 'error',
                 'message': '没有该班级的成绩信息'
             }, status=404)
 
-        # 操作 excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        # 添加标题行
-        ws.append (['考试名称', '姓名', '班级', '学号', '语文', '数学', '英语'])
-        for score in scores:
-            ws.append([
-                score.title,
-                score.student_name,
-                score.grade.grade_name,
-                score.student_number,
-                score.chinese_score,
-                score.math_score,
-                score.english_score
-            ])
-        # 将 excel 数据保存到内存中
-        output = BytesIO()
-        wb.save(output)
-        wb.close()
-        # 重置文件指针(游标)
-        output.seek(0)
-        # 设置响应
-        response = HttpResponse(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="scores.xlsx"'
-        return response
+        # 数据量较大时放到后台任务中执行，返回任务 id
+        if data.get('background'):
+            job = Job.enqueue(Job.SCORE_EXPORT, request.user, params={'grade': grade.pk, 'exam': exam_id, 'format': data.get('format', 'xlsx')})
+            return JsonResponse({'status': 'success', 'message': '已提交后台导出', 'job_id': job.pk}, status=202)
+        # 以流的方式返回 excel 文件，format 为 csv 时导出 csv 文件
+        return stream_export(SCORE_HEADER, export_rows(scores), 'scores', data.get('format', 'xlsx'))
 
 
 @role_required('admin', 'teacher')
 def score_import(request):
     # 导入成绩的功能使用POST请求
-    if request.method == 'POST':
-        file = request.FILES.get('excel_file')
-        # 判断文件是否上传
-        if not file:
-            return JsonResponse({
-                'status': 'error',
-                'message': '请上传Excel文件'
-            }, status=400)
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': '请求方式错误'
+        }, status=405)
+    file = request.FILES.get('excel_file')
+    # 判断文件是否上传
+    if not file:
+        return JsonResponse({
+            'status': 'error',
+            'message': '请上传Excel文件'
+        }, status=400)
     # 判断文件类型是否是Excel文件
     ext = Path(file.name).suffix
     if ext.lower() != '.xlsx':
@@ -213,55 +242,27 @@ def score_import(request):
             'status': 'error',
             'message': '文件类型错误，请上传.xlsx格式的文件'
         }, status=400)
+    # 数据量较大时放到后台任务中执行，返回任务 id
+    if request.POST.get('background'):
+        job = Job.enqueue(Job.SCORE_IMPORT, request.user, file=file)
+        return JsonResponse({'status': 'success', 'message': '已提交后台导入', 'job_id': job.pk}, status=202)
 
-    # 使用之前定义的ReadExcel类读取Excel文件
-    read_excel = ReadExcel(file)
-    data = read_excel.get_data()
-    if data[0] != ['考试名称', '姓名', '班级', '学号', '语文', '数学', '英语']:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Excel 中成绩信息不是指定格式'
-        }, status=400)
-    # 写入到数据库，因为第一行是标题行，所以从第二行开始写入数据库
-    for row in data[1:]:
-        # 解析数据
-        title, student_name, grade, student_number, chinese_score, math_score, english_score = row
-        # 检测主要字段
-        if not student_name:
-            return JsonResponse({
-                'status': 'error',
-                'message': '学生姓名不能为空'
-            }, status=400)
-        if not student_number or len(student_number) != 8:
+    # 使用之前定义的ReadExcel类以只读模式逐行读取Excel文件
+    with ReadExcel(file, read_only=True) as read_excel:
+        if not read_excel.check_header(SCORE_HEADER):
             return JsonResponse({
                 'status': 'error',
-                'message': '学号不能为空，且长度必须为8位'
+                'message': 'Excel 中成绩信息不是指定格式'
             }, status=400)
-        if not grade:
-            return JsonResponse({
-                'status': 'error',
-                'message': '班级不能为空'
-            }, status=400)
-        # 检查学生姓名，班级，学号是否匹配
-        grade = Grade.objects.get(grade_name=grade)
-        student = Student.objects.get(student_name=student_name, student_number=student_number, grade=grade)
-        if not student:
+        # 先校验整张表，全部通过后在一个事务中批量写入，因为第一行是标题行，所以从第二行开始
+        try:
+            result = ScoreImporter(read_excel.iter_rows()).run()
+        except ScoreImportError as e:
             return JsonResponse({
                 'status': 'error',
-                'message': f'班级为 {grade}, 学号为 {student_number} 的学生 {student_name} 不存在'
+                'message': str(e),
+                'errors': e.errors
             }, status=400)
-        # 写入到数据库中
-        try:
-            # 在 score 表中写入数据
-            Score.objects.create(
-                title=title,
-                student_name=student_name,
-                student_number=student_number,
-                grade=grade,
-                chinese_score=chinese_score,
-                math_score=math_score,
-                english_score=english_score,
-            )
         except Exception as e:
             return JsonResponse({
                 'status': 'error',
@@ -270,7 +271,99 @@ def score_import(request):
     # 全部导入成功，返回成功信息
     return JsonResponse({
         'status': 'success',
-        'message': '导入成功'
+        'message': f'导入成功，新增 {result["created"]} 条，更新 {result["updated"]} 条，未变化 {result["unchanged"]} 条成绩信息',
+        **result
+    }, status=200)
+
+
+def _get_exam(request):
+    """
+    从请求参数 exam 中获取考试，返回 (考试, None)，参数错误时返回 (None, 错误响应)
+    """
+    exam_id = request.GET.get('exam', '')
+    if not exam_id.isdigit():
+        return None, JsonResponse({
+            'status': 'error',
+            'message': '考试参数缺失或错误'
+        }, status=400)
+    exam = Exam.objects.filter(pk=exam_id).first()
+    if exam is None:
+        return None, JsonResponse({
+            'status': 'error',
+            'message': '考试不存在'
+        }, status=404)
+    return exam, None
+
+
+@role_required('teacher', 'admin')
+def score_statistics(request):
+    """
+    考试成绩统计，参数：exam 考试 id，grade 班级 id（可选），percentiles 百分位数（可选，如 10,25,75,90）
+    """
+    exam, error = _get_exam(request)
+    if error:
+        return error
+    grade_id = request.GET.get('grade') or None
+    if grade_id is not None and not grade_id.isdigit():
+        return JsonResponse({
+            'status': 'error',
+            'message': '班级参数错误'
+        }, status=400)
+    try:
+        percentiles = get_percentiles(request.GET.get('percentiles'))
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': '百分位数参数错误，应为 0 - 100 之间用逗号分隔的数字'
+        }, status=400)
+    statistics = exam_statistics(exam.pk, grade_id and int(grade_id), percentiles)
+    if statistics is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': '没有该考试的成绩信息'
+        }, status=404)
+    return JsonResponse({
+        'status': 'success',
+        'exam': {'id': exam.pk, 'name': exam.name},
+        'grade': grade_id and int(grade_id),
+        'statistics': statistics
+    }, status=200)
+
+
+@role_required('teacher', 'admin')
+def score_bands(request):
+    """
+    考试成绩分段统计，参数：exam 考试 id，grade 班级 id（可选），
+    width 每段分数（如 10）或 thresholds 分数线（如 60,80,90）和 labels 各段名称（可选）
+    """
+    exam, error = _get_exam(request)
+    if error:
+        return error
+    grade_id = request.GET.get('grade') or None
+    if grade_id is not None and not grade_id.isdigit():
+        return JsonResponse({
+            'status': 'error',
+            'message': '班级参数错误'
+        }, status=400)
+    try:
+        bands = get_bands(request.GET.get('width'), request.GET.get('thresholds'), request.GET.get('labels'))
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': '分段参数错误，width 应为正数，thresholds 应为递增的分数线，labels 应比分数线多一个'
+        }, status=400)
+    report = band_report(exam.pk, grade_id and int(grade_id), bands)
+    if report is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': '没有该考试的成绩信息'
+        }, status=404)
+    return JsonResponse({
+        'status': 'success',
+        'exam': {'id': exam.pk, 'name': exam.name},
+        'grade': grade_id and int(grade_id),
+        'bands': bands,
+        'report': report
     }, status=200)
 
 
@@ -281,6 +374,12 @@ class MyScoreListView(ListView):
     ordering = ['-id']
 
     def get_queryset(self):
-        # 仅返回当前登录用户的数据
-        student_number = self.request.user.username
-        return Score.objects.filter(student_number=student_number)
\ No newline at end of file
+        # 仅返回当前登录用户的数据，通过学生外键关联用户，都是整数比较
+        # 重写 get_queryset 后 ordering 不会自动生效，需要手动排序
+        return Score.objects.filter(student__user_id=self.request.user.pk).select_related(
+            'grade', 'exam').order_by(*self.ordering)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ranking.annotate(context['scores'])
+        return context
\ No newline at end of file
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StudentsConfig(AppConfig):
     name = 'students'
+
+    def ready(self):
+        # 注册信号
+        from . import signals
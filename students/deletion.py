@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from scores.models import Score
+from utils.deletion import delete_in, DELETE_CHUNK_SIZE
+from .models import Student
+from .roster import roster
+
+
+def delete_students(students):
+    """
+    批量删除学生和登录用户，返回删除的学生数量
+    学生的成绩保留（与 Score.student 的 SET_NULL 一致），成绩中的学号和姓名不变，只把学生外键置空，
+    一次查询取出学生 id 和用户 id，然后在一个事务中按 id 分批 UPDATE 成绩、DELETE 学生和用户，
+    事务提交后让花名册索引重新加载，不会逐个学生加载和发送删除信号
+    """
+    rows = list(students.order_by().values_list('id', 'user_id'))
+    if not rows:
+        return 0
+    student_ids = [student_id for student_id, _ in rows]
+    user_ids = [user_id for _, user_id in rows]
+    with transaction.atomic():
+        for start in range(0, len(student_ids), DELETE_CHUNK_SIZE):
+            Score.objects.filter(student_id__in=student_ids[start:start + DELETE_CHUNK_SIZE]).update(student=None)
+        deleted = delete_in(Student, student_ids)
+        # 学生已经删除，用户表剩下的关联（用户组、权限、操作日志等）由 Django 按 id 批量删除
+        for start in range(0, len(user_ids), DELETE_CHUNK_SIZE):
+            User.objects.filter(id__in=user_ids[start:start + DELETE_CHUNK_SIZE]).delete()
+        transaction.on_commit(roster.changed)
+    return deleted
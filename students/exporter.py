@@ -0,0 +1,13 @@
+from utils.export import EXPORT_CHUNK_SIZE
+from .importer import STUDENT_HEADER
+
+
+def export_rows(students):
+    """
+    生成导出的数据行，只查询需要导出的字段，并通过 join 获取班级名称，分批从数据库中读取
+    """
+    rows = students.values_list(
+        'grade__grade_name', 'student_name', 'student_number', 'gender', 'birthday', 'contact_number', 'address'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for grade_name, student_name, student_number, gender, birthday, contact_number, address in rows:
+        yield [grade_name, student_name, student_number, '男' if gender == 'M' else '女', birthday, contact_number, address]
@@ -2,13 +2,14 @@ from django import forms
 from django.core.exceptions import ValidationError
 import datetime
 from .models import Student
-from grades.models import Grade
+from grades.cache import use_cached_grades
 
 class StudentForm(forms.ModelForm):
     # 重写父类方法，对象属性grade进行排序
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['grade'].queryset = Grade.objects.all().order_by('grade_number')
+        # 班级选项从缓存中读取
+        use_cached_grades(self.fields['grade'])
 
     # 验证学生姓名,方法名格式固定的，为 clean_+字段名
     def clean_student_name(self):
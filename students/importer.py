@@ -0,0 +1,124 @@
+import datetime
+import time
+
+from django.db import transaction
+
+from accounts.provisioning import provision_users
+
+from grades.cache import get_grade_ids
+from monitoring.metrics import observe_import
+from .models import Student
+from .roster import roster
+
+# Excel 标题行，导入和导出共用
+STUDENT_HEADER = ['班级', '姓名', '学号', '性别', '出生日期', '联系电话', '家庭住址']
+# 每次 bulk_create 写入的行数
+BATCH_SIZE = 500
+# 返回给前端的最多错误条数
+MAX_ERRORS = 20
+
+
+class StudentImportError(Exception):
+    """
+    导入数据校验失败，errors 中保存所有出错行的信息
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('；'.join(errors[:MAX_ERRORS]))
+
+
+'''
+批量导入学生信息
+先一次性加载班级和已存在的学号，在内存中校验整张表，
+全部通过后在一个事务中分批 bulk_create 写入 user 表和 student 表
+'''
+class StudentImporter:
+    def __init__(self, rows, batch_size=BATCH_SIZE, on_progress=None):
+        # rows 为不含标题行的数据行
+        self.rows = rows
+        self.batch_size = batch_size
+        # 进度回调，参数为当前阶段（validate 或 save）和该阶段已经处理的行数
+        self.on_progress = on_progress
+        # 校验通过后待写入的学生数据
+        self.students = []
+
+    # 校验整张表，出错时抛出 StudentImportError
+    def validate(self):
+        # 1.一次性加载班级（从缓存中读取）和已存在的学号
+        grades = get_grade_ids()
+        numbers = set(Student.objects.values_list('student_number', flat=True))
+        errors = []
+        self.students = []
+        # 因为第一行是标题行，所以数据从第二行开始
+        for line, row in enumerate(self.rows, start=2):
+            if self.on_progress and (line - 1) % self.batch_size == 0:
+                self.on_progress('validate', line - 1)
+            # 跳过空行
+            if not any(row):
+                continue
+            grade_name, student_name, student_number, gender, birthday, contact_number, address = (list(row) + [None] * 7)[:7]
+            student_number = str(student_number) if student_number is not None else ''
+            grade_id = grades.get(grade_name)
+            if not grade_id:
+                errors.append(f'第{line}行：班级 {grade_name} 不存在')
+                continue
+            if not student_name:
+                errors.append(f'第{line}行：学生姓名不能为空')
+                continue
+            if len(student_number) != 8:
+                errors.append(f'第{line}行：学号不能为空，且长度必须为8位')
+                continue
+            # 检查日期格式
+            if not isinstance(birthday, datetime.datetime):
+                errors.append(f'第{line}行：出生日期格式错误')
+                continue
+            # 学号在数据库或者表格中已经存在
+            if student_number in numbers:
+                errors.append(f'第{line}行：学号 {student_number} 已经存在')
+                continue
+            numbers.add(student_number)
+            self.students.append({
+                'grade_id': grade_id,
+                'student_name': student_name,
+                'student_number': student_number,
+                'gender': 'M' if gender == '男' else 'F',
+                'birthday': birthday.date(),
+                'contact_number': str(contact_number or ''),
+                'address': address or '',
+            })
+        if errors:
+            raise StudentImportError(errors)
+        return self.students
+
+    # 写入数据库，返回写入的学生数量
+    def save(self):
+        with transaction.atomic():
+            for start in range(0, len(self.students), self.batch_size):
+                batch = self.students[start:start + self.batch_size]
+                self._save_batch(batch)
+                if self.on_progress:
+                    self.on_progress('save', start + len(batch))
+            # bulk_create 不会发送信号，提交后通知花名册索引重新加载
+            transaction.on_commit(roster.changed)
+        return len(self.students)
+
+    def _save_batch(self, batch):
+        # auth_user 表中已经存在的用户直接关联，不存在时批量创建，初始密码为学号后6位
+        user_ids = provision_users([item['student_number'] for item in batch], batch_size=self.batch_size)
+        Student.objects.bulk_create([
+            Student(user_id=user_ids[item['student_number']], **item)
+            for item in batch
+        ], batch_size=self.batch_size)
+
+    # 校验并写入，返回导入结果
+    def run(self):
+        start = time.perf_counter()
+        self.validate()
+        count = self.save()
+        elapsed = time.perf_counter() - start
+        observe_import('students', count, elapsed)
+        return {
+            'count': count,
+            'elapsed': round(elapsed, 3),
+            'rows_per_second': round(count / elapsed, 1) if elapsed else count,
+        }
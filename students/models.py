@@ -24,7 +24,21 @@ class Student(models.Model):
     def __str__(self):
         return self.user.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录从数据库读取时的学号，修改学号后用于从花名册索引中移除原来的学号，保存时不需要再查询一次
+        if 'student_number' in field_names:
+            instance._loaded_student_number = values[field_names.index('student_number')]
+        return instance
+
     class Meta:
         db_table = 'student'
         verbose_name = '学生信息'
-        verbose_name_plural = verbose_name
\ No newline at end of file
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 学生列表按班级筛选、按学号倒序，导出按班级筛选
+            models.Index(fields=['grade', 'student_number'], name='student_grade_number_idx'),
+            # 学生列表按姓名搜索、按学号倒序
+            models.Index(fields=['student_name', 'student_number'], name='student_name_number_idx'),
+        ]
\ No newline at end of file
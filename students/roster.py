@@ -0,0 +1,164 @@
+import threading
+import uuid
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Student
+
+# 共享缓存中的版本号，任意进程修改学生后都会更新，其它进程发现版本变化后重新加载
+VERSION_KEY = 'students:roster:version'
+
+'''
+学生花名册索引
+学号 -> (班级 id, 姓名, 学生 id)，用于成绩录入和导入时校验学生，不需要查询数据库。
+班级 id 和学生 id 保存在紧凑的 array 中，学号通过字典映射到槽位，10 万名学生只占用几 MB 内存
+'''
+class RosterIndex:
+    __slots__ = ('slots', 'grade_ids', 'student_ids', 'names', 'free', 'version', 'lock')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self._reset()
+
+    def _reset(self):
+        # 学号 -> 槽位
+        self.slots = {}
+        self.grade_ids = array('q')
+        self.student_ids = array('q')
+        self.names = []
+        # 删除学生后空出来的槽位，新增学生时复用
+        self.free = []
+
+    def _load(self):
+        self._reset()
+        rows = Student.objects.filter(student_number__isnull=False).values_list(
+            'student_number', 'grade_id', 'student_name', 'id'
+        ).iterator(chunk_size=5000)
+        for student_number, grade_id, student_name, student_id in rows:
+            self._put(student_number, grade_id, student_name, student_id)
+
+    def _put(self, student_number, grade_id, student_name, student_id):
+        slot = self.slots.get(student_number)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.names)
+                self.grade_ids.append(0)
+                self.student_ids.append(0)
+                self.names.append('')
+            self.slots[student_number] = slot
+        self.grade_ids[slot] = grade_id
+        self.student_ids[slot] = student_id
+        self.names[slot] = student_name
+
+    def _remove(self, student_number):
+        slot = self.slots.pop(student_number, None)
+        if slot is not None:
+            self.student_ids[slot] = 0
+            self.names[slot] = ''
+            self.free.append(slot)
+
+    # 第一次使用或其它进程修改了学生时重新加载
+    def _ensure_loaded(self):
+        version = cache.get(VERSION_KEY)
+        if version is not None and version == self.version:
+            return
+        with self.lock:
+            if version is None:
+                version = uuid.uuid4().hex
+                cache.set(VERSION_KEY, version, getattr(settings, 'ROSTER_CACHE_TIMEOUT', 300))
+            self._load()
+            self.version = version
+
+    def get(self, student_number):
+        """
+        返回 (grade_id, student_name, student_id)，学号不存在时返回 None
+        """
+        self._ensure_loaded()
+        with self.lock:
+            slot = self.slots.get(student_number)
+            if slot is None:
+                return None
+            return self.grade_ids[slot], self.names[slot], self.student_ids[slot]
+
+    def resolve(self, student_number, student_name, grade_id):
+        """
+        校验学号、姓名、班级是否属于同一个学生，返回学生 id，不匹配时返回 None
+        索引中没有命中时再查询一次数据库，避免其它进程刚刚新增或修改的学生被误判
+        """
+        entry = self.get(student_number)
+        if entry is not None and entry[0] == grade_id and entry[1] == student_name:
+            return entry[2]
+        student_id = Student.objects.filter(
+            student_number=student_number, student_name=student_name, grade_id=grade_id
+        ).values_list('id', flat=True).first()
+        if student_id is not None:
+            with self.lock:
+                self._put(student_number, grade_id, student_name, student_id)
+        return student_id
+
+    def resolve_many(self, items):
+        """
+        批量校验 (学号, 姓名, 班级 id)，返回 {(学号, 姓名, 班级 id): 学生 id}，不匹配的不包含在结果中
+        索引中没有命中的学号合并成一次查询
+        """
+        items = set(items)
+        result = {}
+        misses = set()
+        for item in items:
+            entry = self.get(item[0])
+            if entry is not None and entry[0] == item[2] and entry[1] == item[1]:
+                result[item] = entry[2]
+            else:
+                misses.add(item)
+        if misses:
+            rows = Student.objects.filter(student_number__in={item[0] for item in misses}).values_list(
+                'student_number', 'student_name', 'grade_id', 'id')
+            with self.lock:
+                for student_number, student_name, grade_id, student_id in rows:
+                    self._put(student_number, grade_id, student_name, student_id)
+                    if (student_number, student_name, grade_id) in misses:
+                        result[(student_number, student_name, grade_id)] = student_id
+        return result
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.slots)
+
+    # 以下方法由信号调用，修改当前进程的索引并更新共享版本号
+    def saved(self, student, old_number=None):
+        def update():
+            # 修改了学号时先移除原来的学号
+            if old_number and old_number != student.student_number:
+                self._remove(old_number)
+            if student.student_number:
+                self._put(student.student_number, student.grade_id, student.student_name, student.pk)
+        self._apply(update)
+
+    def deleted(self, student):
+        self._apply(lambda: self._remove(student.student_number))
+
+    def changed(self):
+        """
+        批量写入后调用，所有进程下次使用时重新加载
+        """
+        cache.delete(VERSION_KEY)
+
+    def _apply(self, update):
+        with self.lock:
+            # 索引是最新的才在原来的基础上修改，否则让所有进程下次使用时重新加载
+            if self.version is not None and cache.get(VERSION_KEY) == self.version:
+                update()
+                self.version = uuid.uuid4().hex
+                cache.set(VERSION_KEY, self.version, getattr(settings, 'ROSTER_CACHE_TIMEOUT', 300))
+            else:
+                self.version = None
+                cache.delete(VERSION_KEY)
+
+
+# 每个进程一个索引
+roster = RosterIndex()
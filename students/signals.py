@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Student
+from .roster import roster
+
+# 花名册索引中保存的字段，只修改其它字段时不需要更新索引
+ROSTER_FIELDS = {'student_number', 'student_name', 'grade', 'grade_id'}
+
+
+# 事务提交后再更新花名册索引，避免回滚后索引中残留数据
+@receiver(post_save, sender=Student)
+def update_roster(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not ROSTER_FIELDS & set(update_fields):
+        return
+    if created:
+        old_number = None
+    elif hasattr(instance, '_loaded_student_number'):
+        # 从数据库读取时的学号，修改了学号时从索引中移除
+        old_number = instance._loaded_student_number
+    else:
+        # 没有从数据库读取的对象不知道原来的学号，让所有进程下次使用时重新加载
+        transaction.on_commit(roster.changed)
+        return
+    instance._loaded_student_number = instance.student_number
+    transaction.on_commit(lambda: roster.saved(instance, old_number))
+
+
+@receiver(post_delete, sender=Student)
+def remove_from_roster(sender, instance, **kwargs):
+    transaction.on_commit(lambda: roster.deleted(instance))
@@ -1,3 +1,425 @@
+import datetime
+import io
+import json
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from scores.models import Exam, Score
+from utils.deletion import delete_in
+from utils.export import stream_export
+from utils.handle_excel import ReadCSV, ReadExcel, StreamWriteExcel
+from tests.query_plan import QueryPlanTestMixin
+from .deletion import delete_students
+from .importer import STUDENT_HEADER, StudentImporter, StudentImportError
+from .models import Student
+from .roster import RosterIndex, roster
+
+
+def xlsx_file(header, rows, name='students.xlsx'):
+    """
+    生成上传用的 Excel 文件
+    """
+    workbook = openpyxl.Workbook()
+    workbook.active.append(header)
+    for row in rows:
+        workbook.active.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return SimpleUploadedFile(name, output.getvalue())
+
 
 # Create your tests here.
+class StudentQueryPlanTests(QueryPlanTestMixin, TestCase):
+    """
+    学生列表、搜索和导出的查询不能全表扫描 student 表
+    """
+
+    def test_list(self):
+        self.assertNoFullScan(lambda: self.client.get(reverse('student_list')))
+
+    def test_list_filtered_by_grade(self):
+        self.assertNoFullScan(lambda: self.client.get(reverse('student_list'), {'grade': self.grade.pk}))
+
+    def test_list_search(self):
+        for keywords in (self.student.student_number, self.student.student_name):
+            with self.subTest(search=keywords):
+                self.assertNoFullScan(lambda: self.client.get(reverse('student_list'), {'search': keywords}))
+
+    def test_export(self):
+        self.assertNoFullScan(lambda: self.client.post(
+            reverse('export_student'), json.dumps({'grade': self.grade.pk, 'format': 'csv'}),
+            content_type='application/json'))
+
+
+class StudentBulkDeleteTests(TestCase):
+    def setUp(self):
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        for i in range(40):
+            user = User.objects.create_user(f'{20000000 + i}')
+            Student.objects.create(student_number=user.username, student_name=f'学生{i}', gender='M',
+                                   birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                                   grade=self.grade if i < 30 else self.other)
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def delete(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('student_bulk_delete'), data)
+        return response, [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+
+    def test_selected_ids_are_deleted_with_set_based_statements(self):
+        ids = list(Student.objects.filter(grade=self.grade).values_list('id', flat=True)[:20])
+        user_ids = list(Student.objects.filter(id__in=ids).values_list('user_id', flat=True))
+        response, deletes = self.delete({'student_ids': ids})
+        self.assertEqual(response.json()['count'], 20)
+        self.assertFalse(Student.objects.filter(id__in=ids).exists())
+        self.assertFalse(User.objects.filter(id__in=user_ids).exists())
+        # 每张表一条 DELETE，与删除的学生数量无关
+        table = connection.ops.quote_name(Student._meta.db_table)
+        self.assertEqual(len([sql for sql in deletes if sql.startswith(f'DELETE FROM {table} ')]), 1)
+        self.assertLessEqual(len(deletes), 10)
+
+    def test_delete_all_matching_filter(self):
+        response, _ = self.delete({'all': '1', 'grade': self.grade.pk})
+        self.assertEqual(response.json()['count'], 30)
+        self.assertEqual(Student.objects.count(), 10)
+
+    def test_scores_are_kept(self):
+        exam = Exam.objects.create(name='期中')
+        students = list(Student.objects.filter(grade=self.grade).order_by('id')[:3])
+        Score.objects.bulk_create([
+            Score(exam=exam, student=student, student_number=student.student_number, student_name=student.student_name,
+                  grade=self.grade, chinese_score=90, math_score=90, english_score=90)
+            for student in students
+        ])
+        self.assertEqual(delete_students(Student.objects.filter(pk__in=[student.pk for student in students[:2]])), 2)
+        # 与 Score.student 的 SET_NULL 一致，只把学生外键置空
+        self.assertEqual(sorted(Score.objects.values_list('student_number', 'student_id')),
+                         [(students[0].student_number, None), (students[1].student_number, None),
+                          (students[2].student_number, students[2].pk)])
+
+    def test_delete_in_accepts_other_fields(self):
+        self.assertEqual(delete_in(Student, ['20000000', '20000001', '30000000'], field='student_number', chunk_size=2), 2)
+        self.assertEqual(delete_in(Student, []), 0)
+        self.assertEqual(Student.objects.count(), 38)
+
+    def test_delete_all_requires_a_filter(self):
+        response, _ = self.delete({'all': '1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Student.objects.count(), 40)
+
+
+class StudentImportTests(TestCase):
+    def setUp(self):
+        grade_cache.invalidate()
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        user = User.objects.create_user('19990000')
+        Student.objects.create(student_number='19990000', student_name='老学生', gender='M',
+                               birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                               grade=self.grade)
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def rows(self, count, start=0):
+        return [['一班', f'学生{i}', f'{20000000 + i}', '男' if i % 2 else '女', datetime.datetime(2010, 1, 1),
+                 '13800000000', '地址'] for i in range(start, start + count)]
+
+    def upload(self, rows, header=STUDENT_HEADER):
+        return self.client.post(reverse('import_student'), {'excel_file': xlsx_file(header, rows)})
+
+    def test_wrong_header_is_rejected(self):
+        for header in (STUDENT_HEADER[:-1], STUDENT_HEADER[::-1], STUDENT_HEADER + ['备注']):
+            with self.subTest(header=header):
+                response = self.upload(self.rows(1), header)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('不是指定格式', response.json()['message'])
+        self.assertEqual(Student.objects.count(), 1)
+
+    def test_all_errors_are_reported_and_nothing_is_written(self):
+        rows = self.rows(5)
+        # 与表格中的第2行重复、与数据库中已有的学号重复、班级不存在、出生日期格式错误
+        rows[1][2] = rows[0][2]
+        rows[2][2] = '19990000'
+        rows[3][0] = '二班'
+        rows[4][4] = '2010年'
+        response = self.upload(rows)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(errors, [
+            '第3行：学号 20000000 已经存在',
+            '第4行：学号 19990000 已经存在',
+            '第5行：班级 二班 不存在',
+            '第6行：出生日期格式错误',
+        ])
+        self.assertEqual(Student.objects.count(), 1)
+        self.assertFalse(User.objects.filter(username='20000000').exists())
+
+    def test_import_is_written_in_bulk(self):
+        # 先请求一次，让会话、登录用户和班级目录的缓存生效
+        self.client.get(reverse('student_list'))
+        counts = []
+        for start, count in ((0, 5), (5, 20)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.upload(self.rows(count, start))
+            self.assertEqual(response.json()['count'], count)
+            counts.append(len(queries))
+        # 查询数量与行数无关
+        self.assertEqual(counts[0], counts[1])
+        student = Student.objects.select_related('user').get(student_number='20000003')
+        self.assertEqual((student.grade_id, student.gender, student.birthday, student.user.username),
+                         (self.grade.pk, 'M', datetime.date(2010, 1, 1), '20000003'))
+        self.assertTrue(student.user.check_password('000003'))
+
+    def test_failed_batch_rolls_back_the_whole_import(self):
+        importer = StudentImporter(self.rows(6), batch_size=2)
+        importer.validate()
+        original = Student.objects.bulk_create
+        calls = []
+
+        def bulk_create(objs, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError('写入失败')
+            return original(objs, **kwargs)
+
+        with mock.patch.object(Student.objects, 'bulk_create', side_effect=bulk_create), \
+                self.assertRaises(RuntimeError):
+            importer.save()
+        # 第一批已经写入的学生和账号也被回滚
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(Student.objects.count(), 1)
+        self.assertFalse(User.objects.filter(username__startswith='2000').exists())
+
+    def test_validation_error_lists_every_row(self):
+        rows = self.rows(30)
+        for row in rows:
+            row[1] = ''
+        with self.assertRaises(StudentImportError) as context:
+            StudentImporter(rows).validate()
+        self.assertEqual(len(context.exception.errors), 30)
+
+
+class ReadExcelTests(TestCase):
+    def workbook(self, header, count):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(header)
+        for i in range(count):
+            workbook.active.append([f'{i}班', f'学生{i}', i])
+        return workbook
+
+    def save(self, workbook):
+        output = io.BytesIO()
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    def test_read_only_iteration(self):
+        file = self.save(self.workbook(['班级', '姓名', '序号'], 1200))
+        with ReadExcel(file, read_only=True) as reader:
+            self.assertEqual(reader.get_header(), ['班级', '姓名', '序号'])
+            rows = list(reader.iter_rows())
+            self.assertEqual(len(rows), 1200)
+            self.assertEqual(rows[0], ['0班', '学生0', 0])
+            self.assertEqual(rows[-1], ['1199班', '学生1199', 1199])
+            self.assertEqual([len(chunk) for chunk in reader.iter_chunks(500)], [500, 500, 200])
+            self.assertEqual(next(reader.iter_rows(min_row=1)), ['班级', '姓名', '序号'])
+
+    def test_header_must_match_exactly(self):
+        header = ['班级', '姓名', '序号']
+        for actual, expected in ((header, True), (header[:2], False), (header + ['备注'], False),
+                                 (header[::-1], False)):
+            with self.subTest(header=actual):
+                with ReadExcel(self.save(self.workbook(actual, 1)), read_only=True) as reader:
+                    self.assertEqual(reader.check_header(header), expected)
+
+    def test_trailing_empty_header_cells_are_ignored(self):
+        workbook = self.workbook(['班级', '姓名', '序号'], 1)
+        # 设置过格式的空单元格也会被读取为 None
+        workbook.active.cell(row=1, column=5).font = openpyxl.styles.Font(bold=True)
+        with ReadExcel(self.save(workbook), read_only=True) as reader:
+            self.assertEqual(reader.get_header(), ['班级', '姓名', '序号', None, None])
+            self.assertTrue(reader.check_header(['班级', '姓名', '序号']))
+
+    def test_csv_has_the_same_interface(self):
+        content = '\ufeff班级,姓名,序号,\n一班,,1\n二班,学生,2\n'.encode('utf-8')
+        reader = ReadCSV(io.BytesIO(content))
+        self.assertTrue(reader.check_header(['班级', '姓名', '序号']))
+        self.assertFalse(reader.check_header(['班级', '姓名']))
+        self.assertEqual(list(reader.iter_rows()), [['一班', None, '1'], ['二班', '学生', '2']])
+
+
+class StudentExportTests(TestCase):
+    def setUp(self):
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        for i in range(3):
+            user = User.objects.create_user(f'{20000000 + i}')
+            Student.objects.create(student_number=user.username, student_name=f'学生{i}', gender='M' if i else 'F',
+                                   birthday=datetime.date(2010, 1, i + 1), contact_number='1380000000', address='地址',
+                                   user=user, grade=self.grade)
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def export(self, file_format):
+        return self.client.post(reverse('export_student'), json.dumps({'grade': self.grade.pk, 'format': file_format}),
+                                content_type='application/json')
+
+    def test_xlsx(self):
+        response = self.export('xlsx')
+        self.assertIn('students.xlsx', response['Content-Disposition'])
+        with ReadExcel(io.BytesIO(b''.join(response.streaming_content)), read_only=True) as reader:
+            # 导出的文件可以直接再导入
+            self.assertTrue(reader.check_header(STUDENT_HEADER))
+            rows = list(reader.iter_rows())
+        self.assertEqual(rows[0], ['一班', '学生0', '20000000', '女', datetime.datetime(2010, 1, 1), '1380000000', '地址'])
+        self.assertEqual(len(rows), 3)
+
+    def test_csv(self):
+        response = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('students.csv', response['Content-Disposition'])
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith('\ufeff'.encode('utf-8')))
+        self.assertEqual(content.decode('utf-8-sig').splitlines(), [
+            ','.join(STUDENT_HEADER),
+            '一班,学生0,20000000,女,2010-01-01,1380000000,地址',
+            '一班,学生1,20000001,男,2010-01-02,1380000000,地址',
+            '一班,学生2,20000002,男,2010-01-03,1380000000,地址',
+        ])
+
+    def test_csv_rows_are_read_while_streaming(self):
+        consumed = []
+
+        def rows():
+            for i in range(3):
+                consumed.append(i)
+                yield [i]
+
+        chunks = stream_export(['序号'], rows(), 'numbers', 'csv').streaming_content
+        # BOM 和标题行先返回，数据行在发送时才读取
+        self.assertEqual(b''.join([next(chunks), next(chunks)]).decode('utf-8-sig'), '序号\r\n')
+        self.assertEqual(consumed, [])
+        self.assertEqual(next(chunks), b'0\r\n')
+        self.assertEqual(consumed, [0])
+        self.assertEqual(b''.join(chunks), b'1\r\n2\r\n')
+
+    def test_xlsx_is_written_to_a_temporary_file(self):
+        with StreamWriteExcel(['序号'], ([i] for i in range(1000))).write_xlsx() as output:
+            self.assertEqual(output.tell(), 0)
+            with ReadExcel(output, read_only=True) as reader:
+                self.assertEqual(len(list(reader.iter_rows())), 1000)
+
+
+class RosterIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        roster.version = None
+        self.grade = Grade.objects.create(grade_name='一班', grade_number='001')
+        self.other = Grade.objects.create(grade_name='二班', grade_number='002')
+        self.students = [self.create(f'{20000000 + i}', f'学生{i}') for i in range(3)]
+
+    def create(self, student_number, student_name, grade=None):
+        user = User.objects.create_user(student_number)
+        return Student.objects.create(student_number=student_number, student_name=student_name, gender='M',
+                                      birthday=datetime.date(2010, 1, 1), contact_number='1', address='a', user=user,
+                                      grade=grade or self.grade)
+
+    def test_loaded_once(self):
+        self.assertEqual(roster.get('20000001'), (self.grade.pk, '学生1', self.students[1].pk))
+        with self.assertNumQueries(0):
+            self.assertIsNone(roster.get('29999999'))
+            self.assertEqual(len(roster), 3)
+
+    def test_saves_update_the_index_without_reloading(self):
+        roster.get('20000000')
+        with self.captureOnCommitCallbacks(execute=True):
+            student = self.create('20000003', '学生3')
+        with self.assertNumQueries(0):
+            self.assertEqual(roster.get('20000003'), (self.grade.pk, '学生3', student.pk))
+
+        # 修改学号只执行一条 UPDATE，不再查询原来的学号
+        student = Student.objects.get(pk=self.students[0].pk)
+        student.student_number = '20000010'
+        student.grade = self.other
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            student.save()
+        with self.assertNumQueries(0):
+            self.assertIsNone(roster.get('20000000'))
+            self.assertEqual(roster.get('20000010'), (self.other.pk, '学生0', student.pk))
+
+    def test_delete_frees_the_slot(self):
+        roster.get('20000000')
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.get(pk=self.students[2].pk).delete()
+        self.assertIsNone(roster.get('20000002'))
+        slots = len(roster.names)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create('20000004', '学生4')
+        self.assertEqual(len(roster.names), slots)
+        self.assertEqual(len(roster), 3)
+
+    def test_other_fields_and_unloaded_instances(self):
+        roster.get('20000000')
+        version = roster.version
+        student = Student.objects.get(pk=self.students[0].pk)
+        student.address = 'b'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            student.save(update_fields=['address'])
+        self.assertEqual((len(callbacks), roster.version), (0, version))
+        # 没有从数据库读取的对象不知道原来的学号，下次使用时重新加载
+        unloaded = Student(pk=student.pk, student_number='20000020', student_name='学生0', gender='M',
+                           birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                           user_id=student.user_id, grade=self.grade)
+        with self.captureOnCommitCallbacks(execute=True):
+            unloaded.save()
+        self.assertIsNone(roster.get('20000000'))
+        self.assertEqual(roster.get('20000020')[2], student.pk)
+
+    def test_other_processes_reload_after_a_change(self):
+        other = RosterIndex()
+        self.assertEqual(len(other), 3)
+        roster.get('20000000')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create('20000003', '学生3')
+        # 共享缓存中的版本号已经变化，其它进程下次使用时重新加载
+        self.assertNotEqual(other.version, cache.get('students:roster:version'))
+        self.assertEqual(other.get('20000003')[1], '学生3')
+        roster.changed()
+        with self.assertNumQueries(1):
+            roster.get('20000000')
+
+    def test_resolve_many(self):
+        roster.get('20000000')
+        # 其它进程刚刚新增的学生还不在索引中
+        Student.objects.bulk_create([Student(student_number='20000005', student_name='学生5', gender='M',
+                                             birthday=datetime.date(2010, 1, 1), contact_number='1', address='a',
+                                             user=User.objects.create_user('20000005'), grade=self.grade)])
+        new = Student.objects.get(student_number='20000005')
+        items = [('20000000', '学生0', self.grade.pk), ('20000001', '错名', self.grade.pk),
+                 ('20000002', '学生2', self.other.pk), ('20000005', '学生5', self.grade.pk),
+                 ('29999999', '学生', self.grade.pk)]
+        # 没有命中的学号合并成一次查询
+        with self.assertNumQueries(1):
+            result = roster.resolve_many(items)
+        self.assertEqual(result, {items[0]: self.students[0].pk, items[3]: new.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(roster.resolve('20000005', '学生5', self.grade.pk), new.pk)
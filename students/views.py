@@ -1,25 +1,45 @@
-import datetime
 import json
-from io import BytesIO
 
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse
 from pathlib import Path
 
 from django.http import JsonResponse
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.db.models import Q
 from django.urls import reverse_lazy
-from django.contrib.auth.models import User
-from django.contrib.auth.hashers import make_password
 
+from utils.pagination import CursorPaginationMixin
 from utils.premissions import RoleRequiredMixin, role_required
+from utils.passwords import make_initial_password
+from accounts.provisioning import provision_user, default_password
 from .models import Student
+from .deletion import delete_students
 from .forms import StudentForm
 from grades.models import Grade
+from grades.cache import get_grades
+from .importer import StudentImporter, StudentImportError, STUDENT_HEADER
 from utils.handle_excel import ReadExcel
-import openpyxl
+from .exporter import export_rows
+from utils.export import stream_export
+from jobs.models import Job
 
 # Create your views here.
+def filter_students(queryset, params):
+    """
+    按班级和姓名/学号筛选学生，列表页和删除筛选结果共用
+    """
+    grade_id = params.get('grade')
+    keywords = params.get('search')
+    if grade_id:
+        queryset = queryset.filter(grade__pk=grade_id)
+    if keywords:
+        queryset = queryset.filter(
+            Q(student_number=keywords) |
+            Q(student_name=keywords)
+        )
+    return queryset
+
+
 class StudentBaseView(RoleRequiredMixin):
     """
     学生管理基类
@@ -31,31 +51,20 @@ class StudentBaseView(RoleRequiredMixin):
     success_url = reverse_lazy('student_list')
     allowed_roles = ['teacher', 'admin']
 
-class StudentListView(StudentBaseView, ListView):
+class StudentListView(StudentBaseView, CursorPaginationMixin, ListView):
     template_name = 'students/list.html'
     paginate_by = 9
     ordering = ['-student_number']
 
     # 重写get_queryset 方法，添加搜索功能
     def get_queryset(self):
-        # 使用父类的方法，获取所有学生
-        queryset = super().get_queryset()
-        grade_id = self.request.GET.get('grade')
-        keywords = self.request.GET.get('search')
-
-        if grade_id:
-            queryset = queryset.filter(grade__pk=grade_id)
-        if keywords:
-            queryset = queryset.filter(
-                Q(student_number=keywords) |
-                Q(student_name=keywords)
-            )
-        return queryset
+        # 使用父类的方法，获取所有学生，列表中显示班级名称，所以一起查询班级，避免每个学生再查询一次
+        return filter_students(super().get_queryset().select_related('grade'), self.request.GET)
     # 默认的 context 返回的 student 对象，由于我们还要在页面中使用 grade 对象，所以可以重写 get_context_data 方法
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # 获取所有班级并添加到上下文对象
-        context['grades'] = Grade.objects.all().order_by('grade_number')
+        # 从缓存中获取所有班级并添加到上下文对象
+        context['grades'] = get_grades()
         # 判断当前选中的班级，并添加到上下文对象中
         context['current_grade'] = self.request.GET.get('grade', '')
         return context
@@ -67,13 +76,8 @@ class StudentCreateView(StudentBaseView, CreateView):
         # student 表和 user 表是一对一关联，所以接收学号字段，来作为 user 的 username
         student_number = form.cleaned_data['student_number']
 
-        # 检查是user表中否已存在该用户
-        users = User.objects.filter(username=student_number)
-        if users.exists():
-            user = users.first()
-        else:
-            # 如果不存在该用户，则创建该用户,注意，密码是不能再使用 make_password 方法加密，因为User.objects.create_user 方法会自动对密码进行加密
-            user = User.objects.create_user(username=student_number, password=student_number[-6:])
+        # 获取user表中的该用户，不存在时创建该用户，初始密码为学号后6位
+        user = provision_user(student_number)
         # 写入到student表中
         form.instance.user = user
         form.save()
@@ -101,7 +105,7 @@ class StudentUpdateView(StudentBaseView, UpdateView):
         # 检查是否修改了学号，因为学号是关联了user表的username的
         if 'student_number' in form.changed_data:
             student.user.username = form.cleaned_data['student_number']
-            student.user.password = make_password(form.cleaned_data['student_number'][-6:])
+            student.user.password = make_initial_password(default_password(form.cleaned_data['student_number']))
             # 保存更改后的用户
             student.user.save()
 
@@ -128,10 +132,8 @@ class StudentDeleteView(StudentBaseView, UpdateView):
     def delete(self, request, *args, **kwargs):
         self.object = self.get_object()
         try:
-            # 删除关联的 user 表中的数据
-            self.object.user.delete()
-            # 删除 student 表中的数据
-            self.object.delete()
+            # 删除 student 表和关联的 user 表中的数据，学生的成绩保留
+            delete_students(Student.objects.filter(pk=self.object.pk))
             return JsonResponse({
                 'status': 'success',
                 'message': '删除成功'
@@ -145,23 +147,29 @@ class StudentDeleteView(StudentBaseView, UpdateView):
 class StudentBulkDeleteView(StudentBaseView, DeleteView):
 
     def post(self, request, *args, **kwargs):
-        student_ids = request.POST.getlist('student_ids')
-        print(student_ids)
-        if not student_ids:
-            return JsonResponse({
-                'status': 'error',
-                'message': '请选择要删除的学生'
-            }, status=400)
-        self.object_list = self.get_queryset().filter(id__in=student_ids)
+        # all 为真时删除当前筛选条件下的所有学生，不需要提交学生 id
+        if request.POST.get('all'):
+            if not (request.POST.get('grade') or request.POST.get('search')):
+                return JsonResponse({
+                    'status': 'error',
+                    'message': '请先选择班级或输入搜索条件'
+                }, status=400)
+            self.object_list = filter_students(self.get_queryset(), request.POST)
+        else:
+            student_ids = request.POST.getlist('student_ids')
+            if not student_ids:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': '请选择要删除的学生'
+                }, status=400)
+            self.object_list = self.get_queryset().filter(id__in=student_ids)
         try:
-            for student in self.object_list:
-                # 删除关联的 user 表中的数据
-                student.user.delete()
-                # 删除 student 表中的数据
-            self.object_list.delete()
+            # 一次查询出学生和用户 id，在一个事务中批量删除学生和用户，学生的成绩保留
+            count = delete_students(self.object_list)
             return JsonResponse({
                 'status': 'success',
-                'message': '删除成功'
+                'message': f'删除成功，共删除 {count} 名学生',
+                'count': count
             }, status=200)
         except Exception as e:
             return JsonResponse({
@@ -175,14 +183,18 @@ class StudentBulkDeleteView(StudentBaseView, DeleteView):
 @role_required('admin', 'teacher')
 def import_student(request):
     # 导入学生的功能使用POST请求
-    if request.method == 'POST':
-        file = request.FILES.get('excel_file')
-        # 判断文件是否上传
-        if not file:
-            return JsonResponse({
-                'status': 'error',
-                'message': '请上传Excel文件'
-            }, status=400)
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': '请求方式错误'
+        }, status=405)
+    file = request.FILES.get('excel_file')
+    # 判断文件是否上传
+    if not file:
+        return JsonResponse({
+            'status': 'error',
+            'message': '请上传Excel文件'
+        }, status=400)
     # 判断文件类型是否是Excel文件
     ext = Path(file.name).suffix
     if ext.lower() != '.xlsx':
@@ -191,72 +203,27 @@ def import_student(request):
             'message': '文件类型错误，请上传.xlsx格式的文件'
         }, status=400)
 
-    # 使用之前定义的ReadExcel类读取Excel文件
-    read_excel = ReadExcel(file)
-    data = read_excel.get_data()
-    if data[0] != ['班级', '姓名', '学号', '性别', '出生日期', '联系电话', '家庭住址']:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Excel 中学生信息不是指定格式'
-        }, status=400)
-    # 写入到数据库，因为第一行是标题行，所以从第二行开始写入数据库
-    for row in data[1:]:
-        # 解析数据
-        grade, student_name, student_number, gender, birthday, contact_number, address = row
-        # 检查班级是否存在
-        grade = Grade.objects.filter(grade_name=grade).first()
-        # 检查班级是否填写
-        if not grade:
-            return JsonResponse({
-                'status': 'error',
-                'message': f'ddd{grade} 不存在'
-            }, status=400)
-        # 检测主要字段
-        if not student_name:
-            return JsonResponse({
-                'status': 'error',
-                'message': '学生姓名不能为空'
-            }, status=400)
-        if not student_number or len(student_number) != 8:
-            return JsonResponse({
-                'status': 'error',
-                'message': '学号不能为空，且长度必须为8位'
-            }, status=400)
-        # 检查日期格式
-        if not isinstance(birthday, datetime.datetime):
+    # 数据量较大时放到后台任务中执行，返回任务 id
+    if request.POST.get('background'):
+        job = Job.enqueue(Job.STUDENT_IMPORT, request.user, file=file)
+        return JsonResponse({'status': 'success', 'message': '已提交后台导入', 'job_id': job.pk}, status=202)
+
+    # 使用之前定义的ReadExcel类以只读模式逐行读取Excel文件
+    with ReadExcel(file, read_only=True) as read_excel:
+        if not read_excel.check_header(STUDENT_HEADER):
             return JsonResponse({
                 'status': 'error',
-                'message': '出生日期格式错误'
+                'message': 'Excel 中学生信息不是指定格式'
             }, status=400)
-        # 判断学生信息是否已经存在
-        if Student.objects.filter(student_number=student_number).exists():
+        # 先校验整张表，全部通过后在一个事务中批量写入，因为第一行是标题行，所以从第二行开始
+        try:
+            result = StudentImporter(read_excel.iter_rows()).run()
+        except StudentImportError as e:
             return JsonResponse({
                 'status': 'error',
-                'message': f'学号 {student_name} 已经存在'
+                'message': str(e),
+                'errors': e.errors
             }, status=400)
-
-        # 写入到数据库中
-        try:
-            # 判断 auth_user 表中是否存在该用户,不存在时创建该用户
-            username = student_number
-            users = User.objects.filter(username=username)
-            if users.exists():
-                user = users.first()
-            else:
-                # 同样的，这里也不能使用 make_password, 因为 make_password 会对密码进行加密
-                user = User.objects.create_user(username=username, password=username[-6:])
-            # 在 student 表中写入数据
-            Student.objects.create(
-                grade=grade,
-                student_name=student_name,
-                student_number=student_number,
-                gender= 'M' if gender == '男' else 'F',
-                birthday=birthday,
-                contact_number=contact_number,
-                address=address,
-                user=user
-            )
-
         except Exception as e:
             return JsonResponse({
                 'status': 'error',
@@ -265,7 +232,8 @@ def import_student(request):
     # 全部导入成功，返回成功信息
     return JsonResponse({
         'status': 'success',
-        'message': '导入成功'
+        'message': f'导入成功，共导入 {result["count"]} 条学生信息',
+        **result
     }, status=200)
 
 """
@@ -298,28 +266,9 @@ def export_student(request):
                 'message': '没有该班级的学生信息'
             }, status=404)
 
-        # 操作 excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        # 添加标题行
-        ws.append(['班级', '姓名', '学号', '性别', '出生日期', '联系电话', '家庭住址'])
-        for student in students:
-            ws.append([
-                student.grade.grade_name,
-                student.student_name,
-                student.student_number,
-                '男' if student.gender == 'M' else '女',
-                student.birthday,
-                student.contact_number,
-                student.address
-            ])
-        # 将 excel 数据保存到内存中
-        output = BytesIO()
-        wb.save(output)
-        wb.close()
-        # 重置文件指针(游标)
-        output.seek(0)
-        # 设置响应
-        response = HttpResponse(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="students.xlsx"'
-        return response
+        # 数据量较大时放到后台任务中执行，返回任务 id
+        if data.get('background'):
+            job = Job.enqueue(Job.STUDENT_EXPORT, request.user, params={'grade': grade.pk, 'format': data.get('format', 'xlsx')})
+            return JsonResponse({'status': 'success', 'message': '已提交后台导出', 'job_id': job.pk}, status=202)
+        # 以流的方式返回 excel 文件，format 为 csv 时导出 csv 文件
+        return stream_export(STUDENT_HEADER, export_rows(students), 'students', data.get('format', 'xlsx'))
@@ -0,0 +1,13 @@
+from utils.export import EXPORT_CHUNK_SIZE
+from .importer import TEACHER_HEADER
+
+
+def export_rows(teachers):
+    """
+    生成导出的数据行，只查询需要导出的字段，并通过 join 获取班级名称，分批从数据库中读取
+    """
+    rows = teachers.values_list(
+        'grade__grade_name', 'teacher_name', 'phone_number', 'gender', 'birthday'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for grade_name, teacher_name, phone_number, gender, birthday in rows:
+        yield [grade_name, teacher_name, phone_number, '男' if gender == 'M' else '女', birthday]
@@ -2,7 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 import datetime
 
-from grades.models import Grade
+from grades.cache import use_cached_grades
 from .models import Teacher
 
 GENDER_CHOICES = (
@@ -14,7 +14,8 @@ class TeacherForm(forms.ModelForm):
     # 重写父类方法，对象属性grade进行排序
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['grade'].queryset = Grade.objects.all().order_by('grade_number')
+        # 班级选项从缓存中读取
+        use_cached_grades(self.fields['grade'])
         self.fields['grade'].empty_label = '请选择班级'
         self.fields['gender'].widget = forms.Select(choices=GENDER_CHOICES)
 
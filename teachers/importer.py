@@ -0,0 +1,160 @@
+import datetime
+import time
+
+from django.db import transaction
+
+from accounts.provisioning import provision_users
+from grades.cache import get_grade_ids
+from monitoring.metrics import observe_import
+from .models import Teacher
+
+# Excel 标题行，导入和导出共用
+TEACHER_HEADER = ['班级', '姓名', '手机号', '性别', '出生日期']
+# 每次 bulk_create 写入的行数
+BATCH_SIZE = 500
+# 返回给前端的最多错误条数
+MAX_ERRORS = 20
+# 姓名的最大长度，与 Teacher.teacher_name 一致
+NAME_LENGTH = 20
+GENDERS = {'男': 'M', '女': 'F'}
+
+
+class TeacherImportError(Exception):
+    """
+    导入数据校验失败，errors 中保存所有出错行的信息
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('；'.join(errors[:MAX_ERRORS]))
+
+
+def parse_birthday(value):
+    """
+    Excel 中的日期读取为 datetime，csv 中为 2020-01-01 格式的字符串，无法解析时返回 None
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+'''
+批量导入老师信息
+先一次性加载班级、已存在的手机号和已有负责老师的班级，在内存中校验整张表，
+手机号不能重复，一个班级只能有一个负责老师（Teacher.grade 是一对一关联），
+全部通过后在一个事务中分批 bulk_create 写入 user 表和 teacher 表
+'''
+class TeacherImporter:
+    def __init__(self, rows, batch_size=BATCH_SIZE, on_progress=None):
+        # rows 为不含标题行的数据行
+        self.rows = rows
+        self.batch_size = batch_size
+        # 进度回调，参数为当前阶段（validate 或 save）和该阶段已经处理的行数
+        self.on_progress = on_progress
+        # 校验通过后待写入的老师数据
+        self.teachers = []
+
+    # 校验整张表，出错时抛出 TeacherImportError
+    def validate(self):
+        # 1.一次性加载班级（从缓存中读取）、已存在的手机号和已有负责老师的班级
+        grades = get_grade_ids()
+        phones = {}
+        assigned = {}
+        teachers = Teacher.objects.values_list('phone_number', 'grade_id', 'teacher_name')
+        for phone_number, grade_id, teacher_name in teachers:
+            phones[phone_number] = teacher_name
+            assigned[grade_id] = teacher_name
+        # 表格中已经出现过的手机号和班级，保存所在行号
+        phone_lines = {}
+        grade_lines = {}
+        today = datetime.date.today()
+        errors = []
+        self.teachers = []
+        # 因为第一行是标题行，所以数据从第二行开始
+        for line, row in enumerate(self.rows, start=2):
+            if self.on_progress and (line - 1) % self.batch_size == 0:
+                self.on_progress('validate', line - 1)
+            # 跳过空行
+            if not any(row):
+                continue
+            grade_name, teacher_name, phone_number, gender, birthday = (list(row) + [None] * 5)[:5]
+            phone_number = str(phone_number).strip() if phone_number is not None else ''
+            teacher_name = str(teacher_name).strip() if teacher_name is not None else ''
+            grade_id = grades.get(grade_name)
+            if not grade_id:
+                errors.append(f'第{line}行：班级 {grade_name} 不存在')
+                continue
+            if not teacher_name or len(teacher_name) > NAME_LENGTH:
+                errors.append(f'第{line}行：老师姓名不能为空，且不能超过{NAME_LENGTH}个字')
+                continue
+            if len(phone_number) != 11 or not phone_number.isdigit():
+                errors.append(f'第{line}行：手机号必须为11位数字')
+                continue
+            if gender not in GENDERS:
+                errors.append(f'第{line}行：性别只能是男或女')
+                continue
+            birthday = parse_birthday(birthday) if birthday is not None else None
+            if birthday is None or birthday > today:
+                errors.append(f'第{line}行：出生日期格式错误，正确格式为：2020-01-01')
+                continue
+            # 手机号在数据库或者表格中已经存在
+            if phone_number in phones:
+                errors.append(f'第{line}行：手机号 {phone_number} 已经是老师【{phones[phone_number]}】的手机号')
+                continue
+            if phone_number in phone_lines:
+                errors.append(f'第{line}行：手机号 {phone_number} 与第{phone_lines[phone_number]}行重复')
+                continue
+            # 班级在数据库或者表格中已经有负责老师
+            if grade_id in assigned:
+                errors.append(f'第{line}行：班级 {grade_name} 已经由老师【{assigned[grade_id]}】负责')
+                continue
+            if grade_id in grade_lines:
+                errors.append(f'第{line}行：班级 {grade_name} 与第{grade_lines[grade_id]}行重复')
+                continue
+            phone_lines[phone_number] = line
+            grade_lines[grade_id] = line
+            self.teachers.append({
+                'grade_id': grade_id,
+                'teacher_name': teacher_name,
+                'phone_number': phone_number,
+                'gender': GENDERS[gender],
+                'birthday': birthday,
+            })
+        if errors:
+            raise TeacherImportError(errors)
+        return self.teachers
+
+    # 写入数据库，返回写入的老师数量
+    def save(self):
+        with transaction.atomic():
+            for start in range(0, len(self.teachers), self.batch_size):
+                batch = self.teachers[start:start + self.batch_size]
+                self._save_batch(batch)
+                if self.on_progress:
+                    self.on_progress('save', start + len(batch))
+        return len(self.teachers)
+
+    def _save_batch(self, batch):
+        # auth_user 表中已经存在的用户直接关联，不存在时批量创建，初始密码为手机号后6位
+        user_ids = provision_users([item['phone_number'] for item in batch], batch_size=self.batch_size)
+        Teacher.objects.bulk_create([
+            Teacher(user_id=user_ids[item['phone_number']], **item)
+            for item in batch
+        ], batch_size=self.batch_size)
+
+    # 校验并写入，返回导入结果
+    def run(self):
+        start = time.perf_counter()
+        self.validate()
+        count = self.save()
+        elapsed = time.perf_counter() - start
+        observe_import('teachers', count, elapsed)
+        return {
+            'count': count,
+            'elapsed': round(elapsed, 3),
+            'rows_per_second': round(count / elapsed, 1) if elapsed else count,
+        }
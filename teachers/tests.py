@@ -1,3 +1,132 @@
+import datetime
+import io
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from utils.handle_excel import ReadCSV
+from .importer import TEACHER_HEADER
+from .models import Teacher
+
 
 # Create your tests here.
+class TeacherImportExportTests(TestCase):
+    def setUp(self):
+        grade_cache.invalidate()
+        Grade.objects.bulk_create([Grade(grade_name=f'{i}班', grade_number=f'{i:03d}') for i in range(30)])
+        user = User.objects.create_user('13900000000')
+        Teacher.objects.create(user=user, teacher_name='王老师', phone_number='13900000000', gender='F',
+                               birthday=datetime.date(1990, 1, 1), grade=Grade.objects.get(grade_name='0班'))
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def rows(self, count, start=1):
+        return [[f'{i}班', f'老师{i}', f'138{i:08d}', '男' if i % 2 else '女', datetime.datetime(1990, 1, 1)]
+                for i in range(start, start + count)]
+
+    def upload(self, rows, ext='xlsx', encoding='utf-8-sig'):
+        if ext == 'csv':
+            lines = [','.join(TEACHER_HEADER)] + [
+                ','.join(value.strftime('%Y-%m-%d') if isinstance(value, datetime.date) else str(value)
+                         for value in row) for row in rows]
+            content = '\n'.join(lines).encode(encoding)
+        else:
+            workbook = openpyxl.Workbook()
+            workbook.active.append(TEACHER_HEADER)
+            for row in rows:
+                workbook.active.append(row)
+            output = io.BytesIO()
+            workbook.save(output)
+            content = output.getvalue()
+        file = SimpleUploadedFile(f'teachers.{ext}', content)
+        return self.client.post(reverse('import_teacher'), {'excel_file': file})
+
+    def test_import_creates_users_and_teachers_in_bulk(self):
+        # 先请求一次，让会话、登录用户和班级目录的缓存生效
+        self.client.get(reverse('teacher_list'))
+        counts = []
+        for ext, start, count in (('xlsx', 1, 5), ('csv', 6, 20)):
+            with self.subTest(format=ext), CaptureQueriesContext(connection) as queries:
+                response = self.upload(self.rows(count, start), ext)
+                self.assertEqual(response.json()['count'], count)
+            counts.append(len(queries))
+        # 查询数量与行数无关
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Teacher.objects.count(), 26)
+        teacher = Teacher.objects.select_related('user', 'grade').get(phone_number='13800000015')
+        self.assertEqual((teacher.grade.grade_name, teacher.gender, teacher.user.username),
+                         ('15班', 'M', '13800000015'))
+        self.assertTrue(teacher.user.check_password('000015'))
+
+    def test_gbk_csv(self):
+        response = self.upload(self.rows(3), 'csv', 'gbk')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(Teacher.objects.get(phone_number='13800000002').teacher_name, '老师2')
+
+    def test_undecodable_csv_is_rejected(self):
+        file = SimpleUploadedFile('teachers.csv', b'\xff\xfe\xff' + ','.join(TEACHER_HEADER).encode('utf-16-le'))
+        response = self.client.post(reverse('import_teacher'), {'excel_file': file})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('不是指定格式', response.json()['message'])
+        # 开头按 UTF-8 解码成功，后面的行无法解码
+        with mock.patch.object(ReadCSV, 'SAMPLE_SIZE', 8):
+            file = SimpleUploadedFile('teachers.csv', ','.join(TEACHER_HEADER).encode('utf-8') + b'\n\xff\xff')
+            response = self.client.post(reverse('import_teacher'), {'excel_file': file})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Teacher.objects.count(), 1)
+
+    def test_detect_encoding(self):
+        # 开头在多字节字符的中间截断时仍然识别为 UTF-8
+        with mock.patch.object(ReadCSV, 'SAMPLE_SIZE', 4):
+            for encoding, expected in (('utf-8', 'utf-8-sig'), ('utf-8-sig', 'utf-8-sig'), ('gbk', 'gb18030')):
+                with self.subTest(encoding=encoding):
+                    file = io.BytesIO('班级,姓名'.encode(encoding))
+                    self.assertEqual(ReadCSV.detect_encoding(file), expected)
+                    self.assertEqual(file.tell(), 0)
+
+    def test_conflicts_are_reported_for_the_whole_file(self):
+        rows = self.rows(5)
+        rows[1][2] = rows[0][2]
+        rows[2][0] = rows[0][0]
+        rows[3][2] = '13900000000'
+        rows[4][0] = '0班'
+        response = self.upload(rows)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 4)
+        self.assertIn('与第2行重复', errors[0])
+        self.assertIn('与第2行重复', errors[1])
+        self.assertIn('王老师', errors[2])
+        self.assertIn('王老师', errors[3])
+        self.assertEqual(Teacher.objects.count(), 1)
+
+    def test_export_rejects_bad_parameters(self):
+        url = reverse('export_teacher')
+        response = self.client.post(url, '{"format": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+        response = self.client.post(url, '{"grade": "abc"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], '班级参数错误')
+        response = self.client.post(url, '{"grade": 999}', content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_export(self):
+        self.upload(self.rows(3))
+        response = self.client.post(reverse('export_teacher'), '{"format": "csv"}', content_type='application/json')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], ','.join(TEACHER_HEADER))
+        self.assertEqual(lines[1:], ['0班,王老师,13900000000,女,1990-01-01'] + [
+            f'{i}班,老师{i},138{i:08d},{"男" if i % 2 else "女"},1990-01-01' for i in range(1, 4)])
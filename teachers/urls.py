@@ -1,10 +1,13 @@
 from django.urls import path
 
-from .views import (TeacherListView, TeacherCreateView, TeacherDeleteView, TeacherUpdateView)
+from .views import (TeacherListView, TeacherCreateView, TeacherDeleteView, TeacherUpdateView,
+                    import_teacher, export_teacher)
 
 urlpatterns = [
     path('', TeacherListView.as_view(), name='teacher_list'),
     path('create/', TeacherCreateView.as_view(), name='teacher_create'),
     path('<int:pk>/update/', TeacherUpdateView.as_view(), name='teacher_update'),
-    path('<int:pk>/delete/', TeacherDeleteView.as_view(), name='teacher_delete')
+    path('<int:pk>/delete/', TeacherDeleteView.as_view(), name='teacher_delete'),
+    path('import_teacher/', import_teacher, name='import_teacher'),
+    path('export_teacher/', export_teacher, name='export_teacher'),
 ]
\ No newline at end of file
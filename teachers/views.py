@@ -1,14 +1,23 @@
+import json
+from pathlib import Path
+
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.contrib.auth.models import User
 from django.urls import reverse_lazy
 from django.http import JsonResponse
-from django.contrib.auth.hashers import make_password
 from django.db.models import Q
 
-from utils.premissions import RoleRequiredMixin
+from utils.pagination import CursorPaginationMixin
+from utils.premissions import RoleRequiredMixin, role_required
+from utils.passwords import make_initial_password
+from accounts.provisioning import provision_user, default_password
 from .models import Teacher
 from .forms import TeacherForm
+from .importer import TeacherImporter, TeacherImportError, TEACHER_HEADER
+from .exporter import export_rows
+from grades.cache import get_grades
 from grades.models import Grade
+from utils.handle_excel import ReadExcel, ReadCSV
+from utils.export import stream_export
 
 # Create your views here.
 class TeacherBaseView(RoleRequiredMixin):
@@ -19,9 +28,10 @@ class TeacherBaseView(RoleRequiredMixin):
     form_class = TeacherForm
     allowed_roles = ['admin',]
 
-class TeacherListView(TeacherBaseView, ListView):
+class TeacherListView(TeacherBaseView, CursorPaginationMixin, ListView):
     template_name = 'teachers/list.html'
     paginate_by = 9
+    ordering = ['id']
 
     # 重写 get_queryset 方法，添加搜索功能
     def get_queryset(self):
@@ -41,8 +51,8 @@ class TeacherListView(TeacherBaseView, ListView):
     # 默认的 context 返回的 teacher 对象，由于我们还要在页面中使用 grade 对象，所以可以重写 get_context_data 方法
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # 获取所有班级并添加到上下文对象
-        context['grades'] = Grade.objects.all().order_by('grade_number')
+        # 从缓存中获取所有班级并添加到上下文对象
+        context['grades'] = get_grades()
         # 判断当前选中的班级，并添加到上下文对象中
         context['current_grade'] = self.request.GET.get('grade', '')
         return context
@@ -54,13 +64,8 @@ class TeacherCreateView(TeacherBaseView, CreateView):
         # grade 表和 user 表是一对一关联，所以接收手机号字段，来作为 user 的 username
         phone_number = form.cleaned_data['phone_number']
 
-        # 检查是user表中否已存在该用户
-        users = User.objects.filter(username=phone_number)
-        if users.exists():
-            user = users.first()
-        else:
-            # 如果不存在该用户，则创建该用户
-            user = User.objects.create_user(username=phone_number, password=phone_number[-6:])
+        # 获取user表中的该用户，不存在时创建该用户，初始密码为手机号后6位
+        user = provision_user(phone_number)
         # 写入到student表中
         form.instance.user = user
         form.save()
@@ -88,7 +93,7 @@ class TeacherUpdateView(TeacherBaseView, UpdateView):
         # 检查是否修改了手机号，因为手机号是关联了user表的username的
         if 'phone_number' in form.changed_data:
             teacher.user.username = form.cleaned_data['phone_number']
-            teacher.user.password = make_password(form.cleaned_data['phone_number'][-6:])
+            teacher.user.password = make_initial_password(default_password(form.cleaned_data['phone_number']))
             # 保存更改后的用户
             teacher.user.save()
 
@@ -129,3 +134,101 @@ class TeacherDeleteView(TeacherBaseView, DeleteView):
                 'message': '删除失败' + str(e)
             }, status=500)
 
+
+"""
+批量导入老师信息，支持 .xlsx 和 .csv 文件
+"""
+@role_required('admin')
+def import_teacher(request):
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': '请求方式错误'
+        }, status=405)
+    file = request.FILES.get('excel_file')
+    if not file:
+        return JsonResponse({
+            'status': 'error',
+            'message': '请上传Excel文件'
+        }, status=400)
+    ext = Path(file.name).suffix.lower()
+    if ext not in ('.xlsx', '.csv'):
+        return JsonResponse({
+            'status': 'error',
+            'message': '文件类型错误，请上传.xlsx或.csv格式的文件'
+        }, status=400)
+
+    try:
+        reader = ReadCSV(file) if ext == '.csv' else ReadExcel(file, read_only=True)
+    except UnicodeDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': '文件中老师信息不是指定格式，csv 文件请使用 UTF-8 或 GBK 编码'
+        }, status=400)
+    with reader:
+        if not reader.check_header(TEACHER_HEADER):
+            return JsonResponse({
+                'status': 'error',
+                'message': '文件中老师信息不是指定格式'
+            }, status=400)
+        # 先校验整张表的手机号和班级，全部通过后在一个事务中批量写入
+        try:
+            result = TeacherImporter(reader.iter_rows()).run()
+        except TeacherImportError as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': str(e),
+                'errors': e.errors
+            }, status=400)
+        except UnicodeDecodeError:
+            return JsonResponse({
+                'status': 'error',
+                'message': '文件中老师信息不是指定格式，csv 文件请使用 UTF-8 或 GBK 编码'
+            }, status=400)
+        except Exception as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': '导入失败' + str(e)
+            }, status=500)
+    return JsonResponse({
+        'status': 'success',
+        'message': f'导入成功，共导入 {result["count"]} 条老师信息',
+        **result
+    }, status=200)
+
+
+"""
+导出老师信息，可以只导出一个班级的老师，format 为 csv 时导出 csv 文件
+"""
+@role_required('admin')
+def export_teacher(request):
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': '请求方式错误'
+        }, status=405)
+    try:
+        data = json.loads(request.body or '{}')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JsonResponse({
+            'status': 'error',
+            'message': '请求数据格式错误'
+        }, status=400)
+    teachers = Teacher.objects.order_by('id')
+    grade_id = data.get('grade')
+    if grade_id:
+        # 判断班级参数是否正确以及班级是否存在
+        if not str(grade_id).isdigit():
+            return JsonResponse({
+                'status': 'error',
+                'message': '班级参数错误'
+            }, status=400)
+        if not Grade.objects.filter(id=grade_id).exists():
+            return JsonResponse({
+                'status': 'error',
+                'message': '班级不存在'
+            }, status=404)
+        teachers = teachers.filter(grade_id=grade_id)
+    return stream_export(TEACHER_HEADER, export_rows(teachers), 'teachers', data.get('format', 'xlsx'))
@@ -0,0 +1,63 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from grades import cache as grade_cache
+from grades.models import Grade
+from students.models import Student
+from utils.query_plan import analyze, full_table_scans
+
+
+class QueryPlanTestMixin:
+    """
+    查询计划测试共用的数据和断言，与 TestCase 一起使用
+    创建 GRADES 个班级、每个班级 STUDENTS 个学生，并以管理员身份登录，
+    assertNoFullScan 检查请求中的查询没有全表扫描 scanned_tables 中的表
+    """
+    GRADES = 10
+    STUDENTS = 50
+    # 不允许全表扫描的表
+    scanned_tables = (Student._meta.db_table,)
+
+    @classmethod
+    def setUpTestData(cls):
+        Grade.objects.bulk_create(
+            [Grade(grade_name=f'{i}班', grade_number=f'{i:03d}') for i in range(cls.GRADES)])
+        cls.grades = list(Grade.objects.order_by('id'))
+        User.objects.bulk_create(
+            [User(username=f'{20000000 + i}') for i in range(cls.GRADES * cls.STUDENTS)])
+        Student.objects.bulk_create([
+            Student(student_number=user.username, student_name=f'学生{i}', gender='M', birthday=datetime.date(2010, 1, 1),
+                    contact_number='1', address='a', user=user, grade=cls.grades[i % cls.GRADES])
+            for i, user in enumerate(User.objects.order_by('id'))
+        ])
+        analyze(Student)
+        cls.grade = cls.grades[0]
+        cls.students = list(Student.objects.order_by('id'))
+        cls.student = cls.students[0]
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+
+    def setUp(self):
+        super().setUp()
+        grade_cache.invalidate()
+        self.client.force_login(self.admin)
+        session = self.client.session
+        session['user_role'] = 'admin'
+        session.save()
+
+    def assertNoFullScan(self, request):
+        """
+        执行请求并检查其中每一条查询的执行计划
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            scans = set(full_table_scans(query['sql'])) & set(self.scanned_tables)
+            self.assertFalse(scans, f'全表扫描 {scans}：{query["sql"]}')
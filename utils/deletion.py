@@ -0,0 +1,25 @@
+from django.db import connections, router
+
+# 每条 DELETE 语句中 IN 列表的最大长度
+DELETE_CHUNK_SIZE = 1000
+
+
+def delete_in(model, values, field='pk', chunk_size=DELETE_CHUNK_SIZE):
+    """
+    按 field 的值分批执行 DELETE ... WHERE field IN (...)，返回删除的行数
+    直接执行 SQL，不会加载模型实例，也不会发送 pre_delete / post_delete 信号，也不会处理关联表，
+    调用方需要先删除引用这些行的数据，并自行更新缓存
+    """
+    values = list(values)
+    using = router.db_for_write(model)
+    connection = connections[using]
+    field = model._meta.pk if field == 'pk' else model._meta.get_field(field)
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(field.column)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(values), chunk_size):
+            chunk = [field.get_db_prep_value(value, connection) for value in values[start:start + chunk_size]]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(chunk))})', chunk)
+            deleted += cursor.rowcount
+    return deleted
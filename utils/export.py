@@ -0,0 +1,47 @@
+import os
+import time
+
+from django.http import FileResponse, StreamingHttpResponse
+
+from monitoring.metrics import observe_export
+from utils.handle_excel import StreamWriteExcel
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# 导出时每次从数据库中读取的行数
+EXPORT_CHUNK_SIZE = 2000
+
+
+def file_size(file):
+    """
+    文件的字节数，读取位置恢复到开头
+    """
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+def _measured(chunks, kind):
+    # 全部内容发送完成后记录导出的字节数和耗时，客户端中途断开时不记录
+    start = time.perf_counter()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    observe_export(kind, size, time.perf_counter() - start)
+
+
+def stream_export(header, rows, filename, file_format='xlsx'):
+    """
+    以流的方式返回导出文件，file_format 为 xlsx 或 csv，filename 不含扩展名，同时作为导出指标的 kind
+    """
+    writer = StreamWriteExcel(header, rows)
+    if file_format == 'csv':
+        response = StreamingHttpResponse(_measured(writer.iter_csv(), filename), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+    start = time.perf_counter()
+    output = writer.write_xlsx()
+    observe_export(filename, file_size(output), time.perf_counter() - start)
+    # FileResponse 会分块读取临时文件，响应结束后自动关闭
+    return FileResponse(output, as_attachment=True, filename=f'{filename}.xlsx', content_type=XLSX_CONTENT_TYPE)
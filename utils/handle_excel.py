@@ -1,12 +1,29 @@
+import codecs
+import csv
+import io
+import tempfile
+from itertools import islice
+
 import openpyxl
 
+
+def strip_trailing_empty(row):
+    """
+    去掉行末尾的空单元格，Excel 中设置过格式的空列也会被读取出来
+    """
+    row = list(row)
+    while row and row[-1] in (None, ''):
+        row.pop()
+    return row
+
 '''
 用 openpyxl 读取 excel 文件的操作
+read_only=True 时以只读模式打开，按需逐行读取，内存占用不随行数增长
 '''
 class ReadExcel:
-    def __init__(self, file_path):
+    def __init__(self, file_path, read_only=False):
         # 1.加载 excel 文件
-        self.workbook = openpyxl.load_workbook(file_path)
+        self.workbook = openpyxl.load_workbook(file_path, read_only=read_only, data_only=read_only)
         # 2.获取当前工作薄
         self.worksheet = self.workbook.active
 
@@ -23,6 +40,108 @@ class ReadExcel:
             data.append(row_data)
         return  data
 
+    # 读取标题行
+    def get_header(self):
+        for row in self.worksheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            return list(row)
+        return []
+
+    # 只读取标题行判断格式，不加载数据行，标题必须完全一致，多出或缺少列都不通过
+    def check_header(self, header):
+        return strip_trailing_empty(self.get_header()) == list(header)
+
+    # 逐行返回数据，默认跳过标题行
+    def iter_rows(self, min_row=2):
+        for row in self.worksheet.iter_rows(min_row=min_row, values_only=True):
+            yield list(row)
+
+    # 每次返回 size 行数据，便于调用方分批校验和写入
+    def iter_chunks(self, size=500, min_row=2):
+        rows = self.iter_rows(min_row=min_row)
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    # 只读模式下会一直占用文件，读取完成后需要关闭
+    def close(self):
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+'''
+读取 csv 文件，接口与 ReadExcel 相同，可以直接替换使用
+file_path 可以是文件路径或上传的文件对象，逐行读取，兼容 Excel 导出时带的 BOM
+'''
+class ReadCSV:
+    # 用于判断编码的文件开头字节数
+    SAMPLE_SIZE = 64 * 1024
+
+    def __init__(self, file_path, encoding=None):
+        if isinstance(file_path, (str, bytes)) or hasattr(file_path, '__fspath__'):
+            file_path = open(file_path, 'rb')
+        # 没有指定编码时按文件开头判断，中文 Windows 中 Excel 另存的 csv 是 GBK 编码
+        encoding = encoding or self.detect_encoding(file_path)
+        self.file = io.TextIOWrapper(file_path, encoding=encoding, newline='')
+        self.reader = csv.reader(self.file)
+        try:
+            self.header = next(self.reader, [])
+        except UnicodeDecodeError:
+            self.file.close()
+            raise
+
+    @classmethod
+    def detect_encoding(cls, file):
+        """
+        文件开头能按 UTF-8 解码时使用 utf-8-sig（兼容带 BOM 的文件），否则使用兼容 GBK 的 gb18030
+        """
+        sample = file.read(cls.SAMPLE_SIZE)
+        file.seek(0)
+        try:
+            # 开头的字节可能在一个多字节字符的中间截断，final=False 时不会因此报错
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        except UnicodeDecodeError:
+            return 'gb18030'
+        return 'utf-8-sig'
+
+    # 空单元格统一返回 None，与 openpyxl 读取的结果一致
+    @staticmethod
+    def _row(row):
+        return [value if value != '' else None for value in row]
+
+    def get_header(self):
+        return list(self.header)
+
+    def check_header(self, header):
+        return strip_trailing_empty(self.get_header()) == list(header)
+
+    # 标题行在打开文件时已经读取，所以从第二行开始时不需要跳过
+    def iter_rows(self, min_row=2):
+        for row in islice(self.reader, max(min_row - 2, 0), None):
+            yield self._row(row)
+
+    def iter_chunks(self, size=500, min_row=2):
+        rows = self.iter_rows(min_row=min_row)
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 '''
 用 openpyxl 写入 excel 文件的操作
 '''
@@ -43,4 +162,42 @@ class WriteExcel:
         for row in self.data:
             self.worksheet.append(row)
 
-        self.workbook.save(self.file_path)
\ No newline at end of file
+        self.workbook.save(self.file_path)
+
+'''
+以流的方式导出数据，rows 可以是生成器
+xlsx 使用 openpyxl 的 write_only 模式写入临时文件，csv 则逐行生成，内存占用都不随行数增长
+'''
+class StreamWriteExcel:
+    def __init__(self, header, rows):
+        # 标题行
+        self.header = header
+        # 数据行
+        self.rows = rows
+
+    # 写入到临时文件中，返回已经将指针重置到开头的文件对象
+    def write_xlsx(self):
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(self.header)
+        for row in self.rows:
+            worksheet.append(row)
+        output = tempfile.TemporaryFile()
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    # 逐行生成 csv 数据，开头加上 BOM，避免 Excel 打开中文乱码
+    def iter_csv(self):
+        buffer = _LineBuffer()
+        writer = csv.writer(buffer)
+        yield '\ufeff'.encode('utf-8')
+        yield writer.writerow(self.header).encode('utf-8')
+        for row in self.rows:
+            yield writer.writerow(row).encode('utf-8')
+
+
+class _LineBuffer:
+    # csv.writer 需要一个带 write 方法的对象，这里直接把写入的内容返回
+    def write(self, value):
+        return value
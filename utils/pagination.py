@@ -0,0 +1,180 @@
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+# 游标的签名盐值，防止伪造游标
+CURSOR_SALT = 'utils.pagination.cursor'
+# 跳转到最后一页时使用的游标
+LAST_CURSOR = 'last'
+
+
+class CursorSerializer(signing.JSONSerializer):
+    """
+    排序字段可能是日期、小数等类型，序列化为字符串，查询时由 Django 转换回字段的类型
+    """
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), cls=DjangoJSONEncoder).encode('latin-1')
+
+'''
+基于游标（keyset）的分页
+按照排序字段的值定位下一页，而不是使用 OFFSET，翻到很深的页码时也只需要扫描一页的数据。
+排序字段中 NULL 视为最小值，与 MySQL 的默认排序一致
+'''
+class CursorPaginator:
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.model = queryset.model
+        # 解析排序字段为 [(字段名, 是否倒序)]，最后追加主键保证排序唯一
+        pk_name = self.model._meta.pk.name
+        self.keys = []
+        for field in ordering:
+            name = field.lstrip('-')
+            self.keys.append((pk_name if name == 'pk' else name, field.startswith('-')))
+        if pk_name not in [name for name, _ in self.keys]:
+            self.keys.append((pk_name, self.keys[-1][1] if self.keys else False))
+
+    # 近似的总条数，结果会缓存一段时间，避免每次请求都执行 COUNT(*)
+    @property
+    def count(self):
+        try:
+            query = str(self.queryset.order_by().query)
+        except EmptyResultSet:
+            # 不可能有结果的查询，如 filter(pk__in=[]) 或 none()
+            return 0
+        key = 'pagination:count:' + hashlib.md5(query.encode('utf-8')).hexdigest()
+        timeout = getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+        return cache.get_or_set(key, self.queryset.order_by().count, timeout)
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def _nullable(self, name):
+        return self.model._meta.get_field(name).null
+
+    def _order_by(self, reverse=False):
+        expressions = []
+        for name, descending in self.keys:
+            if descending != reverse:
+                expressions.append(F(name).desc(nulls_last=True) if self._nullable(name) else F(name).desc())
+            else:
+                expressions.append(F(name).asc(nulls_first=True) if self._nullable(name) else F(name).asc())
+        return expressions
+
+    # 按照 NULL 最小的规则，生成 "字段值大于 / 小于 value" 的条件，没有满足条件的数据时返回 None
+    def _compare(self, name, value, greater):
+        if greater:
+            return Q(**{f'{name}__isnull': False}) if value is None else Q(**{f'{name}__gt': value})
+        if value is None:
+            return None
+        condition = Q(**{f'{name}__lt': value})
+        if self._nullable(name):
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def _equal(self, name, value):
+        return Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+    # 生成排在 values 之后（reverse 为 True 时为之前）的数据的条件
+    def _beyond(self, values, reverse=False):
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending), value in zip(self.keys, values):
+            compare = self._compare(name, value, greater=(descending == reverse))
+            if compare is not None:
+                condition |= equal & compare
+            equal &= self._equal(name, value)
+        return condition
+
+    def _key(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def encode(self, obj, direction):
+        return signing.dumps({'k': self._key(obj), 'd': direction}, salt=CURSOR_SALT, serializer=CursorSerializer,
+                             compress=True)
+
+    def decode(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT, serializer=CursorSerializer)
+            return data['k'], data['d']
+        except (signing.BadSignature, KeyError, TypeError):
+            return None, None
+
+    def page(self, cursor=None):
+        """
+        返回游标对应的一页数据，cursor 为空时返回第一页，为 LAST_CURSOR 时返回最后一页
+        """
+        size = self.per_page
+        values, direction = (None, None) if cursor in (None, '', LAST_CURSOR) else self.decode(cursor)
+        if cursor == LAST_CURSOR or direction == 'p':
+            # 向前翻页时倒序查询，再把结果反转回来
+            queryset = self.queryset.order_by(*self._order_by(reverse=True))
+            if values is not None:
+                queryset = queryset.filter(self._beyond(values, reverse=True))
+            items = list(queryset[:size + 1])
+            has_previous = len(items) > size
+            items = items[:size][::-1]
+            has_next = cursor != LAST_CURSOR
+        else:
+            queryset = self.queryset.order_by(*self._order_by())
+            if values is not None:
+                queryset = queryset.filter(self._beyond(values))
+            items = list(queryset[:size + 1])
+            has_next = len(items) > size
+            items = items[:size]
+            has_previous = values is not None
+        return CursorPage(items, self, has_previous, has_next)
+
+
+class CursorPage:
+    """
+    游标分页的一页数据，模板中通过 previous_cursor / next_cursor 翻页
+    """
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous and bool(object_list)
+        self._has_next = has_next and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode(self.object_list[0], 'p') if self._has_previous else None
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode(self.object_list[-1], 'n') if self._has_next else None
+
+
+class CursorPaginationMixin:
+    """
+    ListView 使用游标分页，每页条数仍然使用 paginate_by，排序使用 ordering
+    """
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, self.get_ordering() or [])
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
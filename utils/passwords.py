@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, make_password
+
+# 少于这个数量时直接在当前进程中加密，避免创建进程池的开销
+PARALLEL_THRESHOLD = 200
+
+'''
+初始密码的加密方式
+使用较少迭代次数的 PBKDF2，加密结果与默认的 PBKDF2 格式相同，
+用户首次登录成功时 Django 会发现迭代次数与默认不一致，自动使用默认的加密方式重新加密
+'''
+class InitialPasswordHasher(PBKDF2PasswordHasher):
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+
+def get_initial_hasher():
+    """
+    获取初始密码的加密方式，未配置 INITIAL_PASSWORD_ITERATIONS 时使用默认的加密方式
+    """
+    iterations = getattr(settings, 'INITIAL_PASSWORD_ITERATIONS', None)
+    if not iterations:
+        return None
+    return InitialPasswordHasher(iterations)
+
+
+def make_initial_password(raw_password):
+    """
+    加密单个初始密码
+    """
+    return make_password(raw_password, hasher=get_initial_hasher() or 'default')
+
+
+def _hash_chunk(hasher, raw_passwords):
+    # 在子进程中执行，不能依赖 Django 的配置，所以 hasher 由主进程传入
+    return [make_password(raw_password, hasher=hasher) for raw_password in raw_passwords]
+
+
+def hash_passwords(raw_passwords):
+    """
+    批量加密初始密码，数量较多时使用多进程并行加密，返回的顺序与传入的顺序一致
+    """
+    raw_passwords = list(raw_passwords)
+    # 没有配置初始密码的加密方式时使用默认的加密方式，这里取出实例以便传给子进程
+    hasher = get_initial_hasher() or get_hasher('default')
+    workers = getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+    if workers == 1 or len(raw_passwords) < PARALLEL_THRESHOLD:
+        return _hash_chunk(hasher, raw_passwords)
+    # 按进程数平均分块
+    size = -(-len(raw_passwords) // workers)
+    chunks = [raw_passwords[start:start + size] for start in range(0, len(raw_passwords), size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_hash_chunk, [hasher] * len(chunks), chunks)
+    return [encoded for chunk in results for encoded in chunk]
@@ -0,0 +1,45 @@
+import re
+
+from django.db import connections
+
+# SQLite 查询计划中的全表扫描，如 "SCAN score"，使用索引扫描时为 "SCAN score USING INDEX ..."
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def full_table_scans(sql, params=None, using='default'):
+    """
+    通过 EXPLAIN 获取查询计划，返回被全表扫描的表名列表，用于测试查询是否使用了索引
+    sql 可以是 CaptureQueriesContext 捕获到的 SQL，也可以是 queryset.query.sql_with_params() 的结果
+    支持 MySQL（type 为 ALL）和 SQLite（SCAN 表名 且没有使用索引）
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [row['table'] for row in rows if row['type'] == 'ALL']
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            scans = []
+            for row in cursor.fetchall():
+                match = SQLITE_SCAN.match(row[-1])
+                if match:
+                    scans.append(match.group(1))
+            return scans
+    raise NotImplementedError(f'不支持的数据库：{connection.vendor}')
+
+
+def analyze(*models, using='default'):
+    """
+    更新表的统计信息，让查询计划与真实数据一致
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in models:
+            table = connection.ops.quote_name(model._meta.db_table)
+            if connection.vendor == 'mysql':
+                cursor.execute(f'ANALYZE TABLE {table}')
+                cursor.fetchall()
+            elif connection.vendor == 'sqlite':
+                cursor.execute(f'ANALYZE {table}')
@@ -0,0 +1,52 @@
+import math
+import time
+
+from django.core.cache import caches
+
+'''
+令牌桶限流
+桶中最多有 capacity 个令牌，每 period 秒补满，每次操作取走一个令牌，令牌不足时拒绝。
+令牌数和更新时间保存在缓存中，cache 为 settings.CACHES 中的别名，可以换成 Redis 等共享缓存；
+读取和写入不是原子操作，并发时可能多放行几次，用于限制暴力尝试已经足够
+'''
+class TokenBucket:
+    def __init__(self, key, capacity, period, cache='default'):
+        self.key = key
+        self.capacity = capacity
+        self.period = period
+        # 每秒补充的令牌数
+        self.rate = capacity / period
+        self.cache = caches[cache]
+
+    def _tokens(self, now):
+        tokens, updated_at = self.cache.get(self.key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def _save(self, tokens, now):
+        # 超过 period 秒没有操作时桶已经补满，缓存过期即可
+        self.cache.set(self.key, (tokens, now), math.ceil(self.period))
+
+    def consume(self, tokens=1):
+        """
+        取走令牌，令牌不足时返回 False
+        """
+        now = time.time()
+        available = self._tokens(now)
+        if available < tokens:
+            return False
+        self._save(available - tokens, now)
+        return True
+
+    def refund(self, tokens=1):
+        """
+        归还令牌，例如登录成功时不计入失败次数
+        """
+        now = time.time()
+        self._save(min(self.capacity, self._tokens(now) + tokens), now)
+
+    def retry_after(self, tokens=1):
+        """
+        距离有足够令牌还需要等待的秒数
+        """
+        missing = tokens - self._tokens(time.time())
+        return max(0, math.ceil(missing / self.rate))